@@ -58,31 +58,57 @@ struct py_error_set {
 
 enum storage_mode {UNINITIALIZED = 0,CONTAINS,MANAGEDREF,MANAGEDPTR,UNMANAGEDREF};
 
+// holds a new reference (or NULL) and releases it when destroyed
+struct owned_ref {
+    PyObject *ptr;
+
+    explicit owned_ref(PyObject *ptr) : ptr(ptr) {}
+    ~owned_ref() { Py_XDECREF(ptr); }
+
+private:
+    owned_ref(const owned_ref&);
+    owned_ref &operator=(const owned_ref&);
+};
+
+
+/* raises OverflowError, or TypeError if x is negative and min is 0, for a value
+   that narrow found to be out of range */
+void narrow_failed(long x,long min);
+
+// checks that Min <= x <= Max and raises an exception otherwise
+template<typename T,long Max,long Min> inline T narrow(long x) {
+    if(UNLIKELY(x > Max || x < Min)) narrow_failed(x,Min);
+    return static_cast<T>(x);
+}
+
+/* The conversions from Python numbers read the value of int and float objects
+   directly, and convert long objects without going through the number
+   protocol. Other types, including subclasses, are left to the generic
+   functions. */
 
 inline long py_to_long(PyObject *po) {
-    long r = PyInt_AsLong(po);
+    if(PyInt_CheckExact(po)) return PyInt_AS_LONG(po);
+    long r = PyLong_CheckExact(po) ? PyLong_AsLong(po) : PyInt_AsLong(po);
     if(UNLIKELY(r == -1 && PyErr_Occurred())) throw py_error_set();
     return r;
 }
 
-// checks that min <= x <= max and raises an exception otherwise
-long narrow(long x,long max,long min);
-
-inline long PyToXInt(PyObject *po,long max,long min) {
-    return narrow(py_to_long(po),max,min);
+template<typename T,long Max,long Min> inline T py_to_narrow(PyObject *po) {
+    return narrow<T,Max,Min>(py_to_long(po));
 }
 
 inline short py_to_short(PyObject *po) {
-    return static_cast<short>(PyToXInt(po,SHRT_MAX,SHRT_MIN));
+    return py_to_narrow<short,SHRT_MAX,SHRT_MIN>(po);
 }
 
 inline unsigned short py_to_ushort(PyObject *po) {
-    return static_cast<unsigned short>(PyToXInt(po,USHRT_MAX,0));
+    return py_to_narrow<unsigned short,USHRT_MAX,0>(po);
 }
 
 inline unsigned long py_to_ulong(PyObject *po) {
+    if(PyInt_CheckExact(po) && PyInt_AS_LONG(po) >= 0) return PyInt_AS_LONG(po);
     unsigned long r = PyLong_AsUnsignedLong(po);
-    if(UNLIKELY(PyErr_Occurred())) throw py_error_set();
+    if(UNLIKELY(r == static_cast<unsigned long>(-1) && PyErr_Occurred())) throw py_error_set();
     return r;
 }
 
@@ -103,35 +129,51 @@ inline unsigned long py_to_ulong(PyObject *po) {
 
     #else
         inline int py_to_int(PyObject *po) {
-            return static_cast<int>(PyToXInt(po,INT_MAX,INT_MIN));
+            return py_to_narrow<int,INT_MAX,INT_MIN>(po);
         }
 
         inline unsigned int py_to_uint(PyObject *po) {
-            return static_cast<unsigned int>(PyToXInt(po,UINT_MAX,0));
+            return py_to_narrow<unsigned int,UINT_MAX,0>(po);
         }
     #endif
 #endif
 
 #ifdef HAVE_LONG_LONG
     inline long long py_to_longlong(PyObject *po) {
+        if(PyInt_CheckExact(po)) return PyInt_AS_LONG(po);
         long long r = PyLong_AsLongLong(po);
-        if(UNLIKELY(PyErr_Occurred())) throw py_error_set();
+        if(UNLIKELY(r == -1 && PyErr_Occurred())) throw py_error_set();
         return r;
     }
 
     inline unsigned long long py_to_ulonglong(PyObject *po) {
+        if(PyInt_CheckExact(po) && PyInt_AS_LONG(po) >= 0) return PyInt_AS_LONG(po);
         unsigned long long r = PyLong_AsUnsignedLongLong(po);
-        if(UNLIKELY(PyErr_Occurred())) throw py_error_set();
+        if(UNLIKELY(r == static_cast<unsigned long long>(-1) && PyErr_Occurred())) throw py_error_set();
         return r;
     }
 #endif
 
 inline double py_to_double(PyObject *po) {
-    double r = PyFloat_AsDouble(po);
-    if(UNLIKELY(PyErr_Occurred())) throw py_error_set();
+    if(PyFloat_CheckExact(po)) return PyFloat_AS_DOUBLE(po);
+    if(PyInt_CheckExact(po)) return static_cast<double>(PyInt_AS_LONG(po));
+    double r = PyLong_CheckExact(po) ? PyLong_AsDouble(po) : PyFloat_AsDouble(po);
+    if(UNLIKELY(r == -1.0 && PyErr_Occurred())) throw py_error_set();
     return r;
 }
 
+/* These are used to choose an overload by the type of a number. PyNumber_Check
+   is a function call, and so is PyFloat_Check of anything but a float, so the
+   exact types, which only take a comparison, are tested first. Nothing can be
+   both an int or long and a float. */
+inline bool number_check(PyObject *po) {
+    return PyInt_CheckExact(po) || PyFloat_CheckExact(po) || PyLong_CheckExact(po) || PyNumber_Check(po);
+}
+
+inline bool float_check(PyObject *po) {
+    return PyFloat_CheckExact(po) || (!PyInt_Check(po) && !PyLong_Check(po) && PyFloat_Check(po));
+}
+
 inline PyObject *string_to_py(const std::string &s) {
     return PyString_FromStringAndSize(s.c_str(),s.size());
 }
@@ -143,11 +185,11 @@ inline PyObject *bool_to_py(bool x) {
 }
 
 inline unsigned char py_ssize_t_to_uchar(Py_ssize_t x) {
-    return static_cast<unsigned char>(narrow(x,UCHAR_MAX,0));
+    return narrow<unsigned char,UCHAR_MAX,0>(x);
 }
 
 inline signed char py_ssize_t_to_schar(Py_ssize_t x) {
-    return static_cast<signed char>(narrow(x,SCHAR_MAX,SCHAR_MIN));
+    return narrow<signed char,SCHAR_MAX,SCHAR_MIN>(x);
 }
 
 #if CHAR_MIN == 0
@@ -157,33 +199,115 @@ inline signed char py_ssize_t_to_schar(Py_ssize_t x) {
 #endif
 
 inline unsigned short py_ssize_t_to_ushort(Py_ssize_t x) {
-    return static_cast<unsigned short>(narrow(x,USHRT_MAX,0));
+    return narrow<unsigned short,USHRT_MAX,0>(x);
 }
 
 inline short py_ssize_t_to_sshort(Py_ssize_t x) {
-    return static_cast<short>(narrow(x,SHRT_MAX,SHRT_MIN));
+    return narrow<short,SHRT_MAX,SHRT_MIN>(x);
 }
 
 #if (PY_SIZE_MAX>>1) > INT_MAX
     inline unsigned int py_ssize_t_to_uint(Py_ssize_t x) {
-        return static_cast<unsigned int>(narrow(x,UINT_MAX,0));
+        return narrow<unsigned int,UINT_MAX,0>(x);
     }
 
     inline int py_ssize_t_to_sint(Py_ssize_t x) {
-        return static_cast<int>(narrow(x,INT_MAX,INT_MIN));
+        return narrow<int,INT_MAX,INT_MIN>(x);
     }
 #else
     inline int py_ssize_t_to_sint(Py_ssize_t x) { return x; }
 
     inline unsigned int py_ssize_t_to_uint(Py_ssize_t x) {
-        return static_cast<unsigned int>(narrow(x,INT_MAX,0));
+        return narrow<unsigned int,INT_MAX,0>(x);
     }
 #endif
 
 inline unsigned long py_ssize_t_to_ulong(Py_ssize_t x) {
-    return static_cast<unsigned long>(narrow(x,LONG_MAX,0));
+    return narrow<unsigned long,LONG_MAX,0>(x);
+}
+
+
+#define OVERLOAD_CACHE_SIZE 4
+
+/* Remembers which overload of a function was chosen for the last few
+   combinations of argument types, so the checks that choose an overload only
+   run when a combination is new. N is the greatest number of arguments any
+   overload takes. An instance must have static storage duration, so that it
+   starts out zeroed.
+
+   Combinations including a type created by Python code aren't remembered,
+   since such a type can gain or lose a base class or a conversion method, and
+   another type can later be allocated at the same address. */
+template<int N> struct overload_cache {
+    struct entry {
+        Py_ssize_t size;
+        PyTypeObject *types[N];
+        int choice; // the index of the overload plus one, or 0 if unused
+    } entries[OVERLOAD_CACHE_SIZE];
+    unsigned int next;
+
+    // returns the index of the overload or -1 if the combination is new
+    int find(PyObject *args) const {
+        Py_ssize_t size = PyTuple_GET_SIZE(args);
+        for(int i = 0; i < OVERLOAD_CACHE_SIZE; ++i) {
+            const entry &e = entries[i];
+            if(e.size != size || !e.choice) continue;
+            Py_ssize_t j = 0;
+            while(j < size && Py_TYPE(PyTuple_GET_ITEM(args,j)) == e.types[j]) ++j;
+            if(j == size) return e.choice - 1;
+        }
+        return -1;
+    }
+
+    void add(PyObject *args,int index) {
+        Py_ssize_t size = PyTuple_GET_SIZE(args);
+        assert(size <= N);
+        for(Py_ssize_t i = 0; i < size; ++i) {
+            if(Py_TYPE(PyTuple_GET_ITEM(args,i))->tp_flags & Py_TPFLAGS_HEAPTYPE) return;
+        }
+
+        entry &e = entries[next++ % OVERLOAD_CACHE_SIZE];
+        e.size = size;
+        for(Py_ssize_t i = 0; i < size; ++i) e.types[i] = Py_TYPE(PyTuple_GET_ITEM(args,i));
+        e.choice = index + 1;
+    }
+};
+
+
+/* Used by modules generated with call counting (the --instrument option of
+   pyexpose) to count the calls of each overload. Every counter adds itself to
+   a list the first time its overload is called, and the counts in the list
+   are appended to the file named by the PYEXPOSE_CALL_PROFILE environment
+   variable (by default, "pyexpose.callprofile") when the process exits. */
+struct call_counter {
+    const char *name;
+    unsigned long count;
+    call_counter *next;
+
+    explicit call_counter(const char *name);
+};
+
+inline call_counter *&call_counters() {
+    static call_counter *head = 0;
+    return head;
+}
+
+inline void write_call_counts() {
+    const char *path = getenv("PYEXPOSE_CALL_PROFILE");
+    FILE *f = fopen(path ? path : "pyexpose.callprofile","a");
+    if(!f) return;
+    for(call_counter *c = call_counters(); c; c = c->next) fprintf(f,"%lu %s\n",c->count,c->name);
+    fclose(f);
 }
 
+inline call_counter::call_counter(const char *name) : name(name), count(0), next(call_counters()) {
+    if(!next) atexit(write_call_counts);
+    call_counters() = this;
+}
+
+#define PYEXPOSE_COUNT_CALL(NAME) { static call_counter counter(NAME); ++counter.count; }
+
+
 
 #ifdef PYEXPOSE_TEMPLATE_HELPERS
 
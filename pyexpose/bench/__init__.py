@@ -0,0 +1,7 @@
+"""Benchmarks for the code generator and the code it generates.
+
+Each module in this package can be run with "python -m". The results are
+printed and, with --json, written to a file so they can be compared across
+versions.
+
+"""
@@ -0,0 +1,184 @@
+"""Measure what ordering overload checks by a call profile gains.
+
+A module with overloaded functions is built with call counting
+(instrument=True), a workload is run with it in a separate process to write the
+profile, and the module is built twice more: once as usual and once with the
+checks ordered by the profile (call_counts). Each operation in OPERATIONS is
+then timed on both:
+
+  class overload -- a function overloaded on six unrelated classes, called
+      with the class checked for last
+  number overload -- a function overloaded on float, int and long, called with
+      a long
+
+The arguments are instances of classes defined in Python, so the calls aren't
+resolved by the cache of overload choices and go through the checks every
+time, as they do at call sites that see more combinations of argument types
+than the cache holds.
+
+Requires gccxml, a C++ compiler and the Python headers.
+
+usage: python -m pyexpose.bench.callprofile [options]
+
+"""
+
+import os
+import os.path
+import sys
+import json
+import platform
+import subprocess
+from distutils.spawn import find_executable
+from optparse import OptionParser
+
+from ..conversion import read_call_profile
+from ..test.test_compile import TestCompile
+from .runtime import time_operation
+from .scale import generator_digest
+
+
+CLASSES = 'ABCDEF'
+
+HEADER = '\n'.join(
+    ['#ifndef CALLPROFILE_BENCH_H','#define CALLPROFILE_BENCH_H'] +
+    ['class {0} {{ public: int x; }};'.format(c) for c in CLASSES] +
+    ['inline int which(const {0}&) {{ return {1}; }}'.format(c,i) for i,c in enumerate(CLASSES)] + [
+    'inline int number(double) { return 1; }',
+    'inline int number(int) { return 2; }',
+    'inline int number(unsigned long) { return 3; }',
+    '#endif',''])
+
+SPEC = '''<?xml version="1.0"?>
+<module name="callprofilebench" include="main.h">
+{0}
+    <def func="which"/>
+    <def func="number"/>
+</module>
+'''.format('\n'.join('    <class type="{0}"/>'.format(c) for c in CLASSES))
+
+SETUP = '''
+class Hot(m.{0}): pass
+class HotLong(long): pass
+obj = Hot()
+num = HotLong(1)
+'''.format(CLASSES[-1])
+
+# name, setup, statement, the number of calls the statement makes
+OPERATIONS = [
+    ('class overload',SETUP,'m.which(obj)',1),
+    ('number overload',SETUP,'m.number(num)',1)]
+
+# the calls the profile is made from; the others are called once each
+WORKLOAD = '''
+import {module} as m
+{setup}
+for i in range(1000):
+    m.which(obj)
+    m.number(num)
+for c in m.{first},m.{second}: m.which(c())
+m.number(1.0)
+m.number(1)
+'''
+
+VARIANTS = 'default','profiled'
+
+
+class Build(TestCompile):
+    """Generates and compiles a variant of the module for the benchmark.
+
+    This isn't run as a test. setUp and tearDown are called directly.
+
+    """
+    header_file = HEADER
+    spec_file = SPEC
+
+    def runTest(self):
+        pass
+
+def build(name,**options):
+    return type(name,(Build,),{'generate_options' : options})()
+
+
+def make_profile():
+    """Build the module with call counting, run WORKLOAD with it and return
+    the counts."""
+    b = build('CallProfileInstrumented',instrument=True)
+    b.setUp()
+    try:
+        b.compile()
+        path = os.path.join(b.dir,'calls')
+        env = dict(os.environ,PYEXPOSE_CALL_PROFILE=path,PYTHONPATH=b.dir)
+        subprocess.check_call([sys.executable,'-c',WORKLOAD.format(
+            module=b.modname(),
+            setup=SETUP,
+            first=CLASSES[0],
+            second=CLASSES[1])],env=env)
+        return read_call_profile(path)
+    finally:
+        b.tearDown()
+
+def run(number=100000,repeat=5,progress=None):
+    """Build the module, profile it and time both variants. The results are
+    returned as a dictionary that can be saved as JSON."""
+    counts = make_profile()
+
+    builds = [
+        build('CallProfileDefault'),
+        build('CallProfileOrdered',call_counts=counts)]
+    ready = []
+    try:
+        modules = {}
+        for v,b in zip(VARIANTS,builds):
+            b.setUp()
+            ready.append(b)
+            modules[v] = b.compile()
+
+        ops = []
+        for name,setup,stmt,calls in OPERATIONS:
+            r = {'operation' : name}
+            for v in VARIANTS:
+                r[v] = time_operation(modules[v].__name__,setup,stmt,calls,number,repeat)
+            r['speedup'] = r['default'] / r['profiled'] if r['profiled'] else None
+            if progress: progress(r)
+            ops.append(r)
+    finally:
+        # each setUp changes to a new directory and its tearDown changes back
+        # to the previous one, so they are undone in reverse
+        for b in reversed(ready): b.tearDown()
+
+    return {
+        'generator' : generator_digest(),
+        'python' : platform.python_version(),
+        'number' : number,
+        'repeat' : repeat,
+        'operations' : ops}
+
+def print_row(r):
+    print '{0:<20}{1:>14.1f}{2:>14.1f}{3:>10}'.format(
+        r['operation'],
+        r['default'],
+        r['profiled'],
+        '-' if r['speedup'] is None else '{0:.2f}'.format(r['speedup']))
+    sys.stdout.flush()
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--number",dest="number",type="int",default=100000,help="the number of calls to time in each repeat (default: %default)",metavar="N")
+    p.add_option("--repeat",dest="repeat",type="int",default=5,help="the number of repeats to take the best of (default: %default)",metavar="N")
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    options,args = p.parse_args()
+
+    if not find_executable('gccxml'):
+        p.error("gccxml was not found")
+    if options.number < 1 or options.repeat < 1:
+        p.error("--number and --repeat must be at least 1")
+
+    print '{0:<20}{1:>14}{2:>14}{3:>10}'.format('operation','default (ns)','profiled (ns)','speed-up')
+    r = run(options.number,options.repeat,print_row)
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
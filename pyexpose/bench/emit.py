@@ -0,0 +1,73 @@
+"""Measure code generation for functions with large overload sets.
+
+Runs espec.ModuleDef.write_file on synthetic modules where every method and
+function has many overloads. Each overload takes one more argument than the
+previous one, so the generated overload-resolution code nests as deep as the
+longest argument list.
+
+usage: python -m pyexpose.bench.emit [options]
+
+"""
+
+import os
+import json
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+from .. import gccxml
+from .synth import module
+
+
+def generate(overloads,classes,methods,functions,args):
+    """Return the time spent in write_file for one synthetic module and the
+    number of bytes it wrote."""
+    tdir = tempfile.mkdtemp()
+    try:
+        tree = os.path.join(tdir,'parsetree')
+        with open(tree,'w') as f:
+            spec = module(f,classes=classes,methods=methods,overloads=overloads,args=args,functions=functions)
+        scope = gccxml.getinterface(tree)
+
+        start = time.time()
+        spec.write_file(tdir,scope)
+        elapsed = time.time() - start
+
+        size = sum(os.path.getsize(os.path.join(tdir,spec.name + ext)) for ext in ('.cpp','.h'))
+        return elapsed,size
+    finally:
+        shutil.rmtree(tdir)
+
+def run(overloads,classes=4,methods=4,functions=4,args=1):
+    results = []
+    for n in overloads:
+        seconds,size = generate(n,classes,methods,functions,args)
+        results.append({
+            'overloads' : n,
+            'seconds' : seconds,
+            'output_bytes' : size})
+    return results
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--overloads",default="20,40,80",help="comma-separated overload counts (default: %default)")
+    p.add_option("--classes",type="int",default=4)
+    p.add_option("--methods",type="int",default=4)
+    p.add_option("--functions",type="int",default=4)
+    p.add_option("--args",type="int",default=1,help="the number of arguments of the shortest overload (default: %default)")
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    options,args = p.parse_args()
+
+    r = run([int(x) for x in options.overloads.split(',')],options.classes,options.methods,options.functions,options.args)
+
+    print '{0:>10}{1:>12}{2:>14}'.format('overloads','seconds','output (KiB)')
+    for x in r:
+        print '{overloads:>10}{seconds:>12.3f}{0:>14.0f}'.format(x['output_bytes'] / 1024.0,**x)
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
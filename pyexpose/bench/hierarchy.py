@@ -0,0 +1,65 @@
+"""Measure how code generation scales with the size of class hierarchies.
+
+Runs espec.ModuleDef.write_file on synthetic modules whose classes form either
+deep chains of single inheritance or a single wide tree.
+
+usage: python -m pyexpose.bench.hierarchy [options]
+
+"""
+
+import os
+import json
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+from .. import gccxml
+from .synth import module
+
+
+def generate(classes,methods,depth=1,fanout=None):
+    """Return the time spent in write_file for one synthetic module."""
+    tdir = tempfile.mkdtemp()
+    try:
+        tree = os.path.join(tdir,'parsetree')
+        with open(tree,'w') as f:
+            spec = module(f,classes=classes,methods=methods,depth=depth,fanout=fanout,functions=0)
+        scope = gccxml.getinterface(tree)
+
+        start = time.time()
+        spec.write_file(tdir,scope)
+        return time.time() - start
+    finally:
+        shutil.rmtree(tdir)
+
+def run(sizes,methods=4,depth=50,fanout=10):
+    results = []
+    for n in sizes:
+        results.append({
+            'classes' : n,
+            'deep_seconds' : generate(n,methods,depth=min(depth,n)),
+            'wide_seconds' : generate(n,methods,fanout=fanout)})
+    return results
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--sizes",default="250,500,1000,2000",help="comma-separated class counts (default: %default)")
+    p.add_option("--methods",type="int",default=4)
+    p.add_option("--depth",type="int",default=50,help="the length of the inheritance chains in the deep hierarchy (default: %default)")
+    p.add_option("--fanout",type="int",default=10,help="the number of derived classes per class in the wide hierarchy (default: %default)")
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    options,args = p.parse_args()
+
+    r = run([int(x) for x in options.sizes.split(',')],options.methods,options.depth,options.fanout)
+
+    print '{0:>8}{1:>12}{2:>12}'.format('classes','deep (s)','wide (s)')
+    for x in r:
+        print '{classes:>8}{deep_seconds:>12.3f}{wide_seconds:>12.3f}'.format(**x)
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
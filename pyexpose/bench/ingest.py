@@ -0,0 +1,75 @@
+"""Measure how fast GCCXML output is read.
+
+Compares the generic spec-file parser (xmlparse.parse with the gccxml tag
+classes) against gccxml.parse_tree on a synthetic tree.
+
+usage: python -m pyexpose.bench.ingest [options]
+
+"""
+
+import os
+import json
+import time
+import tempfile
+from optparse import OptionParser
+
+from .. import gccxml
+from ..xmlparse import parse
+from .synth import gccxml_tree
+
+
+def generic_parse(path):
+    return parse(path,'GCC_XML',gccxml.tag_root)
+
+def best_time(f,arg,repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        r = f(arg)
+        t = time.time() - start
+        if best is None or t < best: best = t
+    return best,r
+
+def run(classes=1000,methods=10,overloads=2,repeat=3):
+    f = tempfile.NamedTemporaryFile('w',suffix='.xml',delete=False)
+    try:
+        with f:
+            w = gccxml_tree(f,classes=classes,methods=methods,overloads=overloads)
+        size = os.path.getsize(f.name)
+
+        count = sum(1 + len(children) for tag,attrs,children in w.elements)
+        results = {'elements' : count, 'bytes' : size}
+        items = {}
+        for name,func in (('generic',generic_parse),('parse_tree',gccxml.parse_tree)):
+            t,r = best_time(func,f.name,repeat)
+            items[name] = r[0]
+            results[name] = {'seconds' : t, 'elements_per_second' : count / t}
+    finally:
+        os.remove(f.name)
+
+    # both must produce the same objects
+    assert sorted(items['generic']) == sorted(items['parse_tree'])
+    return results
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--classes",type="int",default=1000)
+    p.add_option("--methods",type="int",default=10)
+    p.add_option("--overloads",type="int",default=2)
+    p.add_option("--repeat",type="int",default=3)
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    options,args = p.parse_args()
+
+    r = run(options.classes,options.methods,options.overloads,options.repeat)
+
+    print '{0} elements, {1} bytes'.format(r['elements'],r['bytes'])
+    for name in ('generic','parse_tree'):
+        print '{0:<12}{1:>10.3f} s{2:>14.0f} elements/s'.format(name,r[name]['seconds'],r[name]['elements_per_second'])
+    print 'speed-up: {0:.2f}x'.format(r['generic']['seconds'] / r['parse_tree']['seconds'])
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
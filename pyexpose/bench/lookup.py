@@ -0,0 +1,76 @@
+"""Measure symbol lookup in the linked declaration graph.
+
+Performs the kinds of lookups the generator does while building the typed
+model: finding classes by qualified name, finding (inherited) methods of each
+class and finding free functions from inside a class's scope. Every lookup is
+repeated, the way TypedDefDef, TypedClassDef and Conversion repeat them.
+
+usage: python -m pyexpose.bench.lookup [options]
+
+"""
+
+import os
+import json
+import time
+import tempfile
+from optparse import OptionParser
+
+from .. import gccxml
+from .synth import gccxml_tree
+
+
+def lookups(root,classes,methods,functions,repeat):
+    for r in range(repeat):
+        for i in range(classes):
+            c = root.find('synth::c{0}'.format(i))[0]
+            for m in range(methods):
+                c.lookup('m{0}'.format(m))
+                c.find('m{0}'.format(m))
+            for f in range(functions):
+                c.find('func{0}'.format(f))
+
+def run(classes=300,methods=10,depth=10,functions=10,repeat=5):
+    f = tempfile.NamedTemporaryFile('w',suffix='.xml',delete=False)
+    try:
+        with f:
+            gccxml_tree(f,classes=classes,methods=methods,depth=depth,functions=functions)
+        root = gccxml.getinterface(f.name)
+    finally:
+        os.remove(f.name)
+
+    start = time.time()
+    lookups(root,classes,methods,functions,1)
+    first = time.time() - start
+
+    start = time.time()
+    lookups(root,classes,methods,functions,repeat)
+    rest = time.time() - start
+
+    count = classes * (1 + 2*methods + functions)
+    return {
+        'lookups' : count,
+        'first_pass_seconds' : first,
+        'repeated_seconds_per_pass' : rest / repeat}
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--classes",type="int",default=300)
+    p.add_option("--methods",type="int",default=10)
+    p.add_option("--depth",type="int",default=10,help="the length of the inheritance chains")
+    p.add_option("--functions",type="int",default=10)
+    p.add_option("--repeat",type="int",default=5)
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    options,args = p.parse_args()
+
+    r = run(options.classes,options.methods,options.depth,options.functions,options.repeat)
+
+    print '{0} lookups per pass'.format(r['lookups'])
+    print 'first pass:    {0:.3f} s'.format(r['first_pass_seconds'])
+    print 'later passes:  {0:.3f} s'.format(r['repeated_seconds_per_pass'])
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
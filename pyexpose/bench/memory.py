@@ -0,0 +1,103 @@
+"""Measure how much memory the linked declaration graph uses.
+
+Loads a synthetic tree (or the GCCXML output given with --xml) with
+gccxml.getinterface and reports the total size of every object reachable from
+the root namespace, as well as the growth of the process's resident set.
+
+usage: python -m pyexpose.bench.memory [options]
+
+"""
+
+import os
+import sys
+import gc
+import json
+import tempfile
+from optparse import OptionParser
+
+from .. import gccxml
+from .synth import gccxml_tree
+
+
+def rss():
+    """Return the current resident set size in bytes, or None if it can't be
+    determined."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError,OSError,ValueError):
+        return None
+
+def deep_size(root):
+    """Return the number of unique objects reachable from root and the sum of
+    their sizes.
+
+    Classes, modules and functions are not counted.
+
+    """
+    seen = set()
+    pending = [root]
+    count = 0
+    size = 0
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o,(type,type(sys),type(deep_size))):
+            continue
+        seen.add(id(o))
+        count += 1
+        size += sys.getsizeof(o)
+        pending.extend(gc.get_referents(o))
+
+        # objects with __slots__ don't always report their contents to the GC
+        for cls in type(o).__mro__:
+            slots = cls.__dict__.get('__slots__',())
+            if isinstance(slots,basestring): slots = (slots,)
+            for s in slots:
+                v = getattr(o,s,None)
+                if v is not None: pending.append(v)
+    return count,size
+
+def measure(path):
+    gc.collect()
+    before = rss()
+    root = gccxml.getinterface(path)
+    gc.collect()
+    after = rss()
+
+    count,size = deep_size(root)
+    return {
+        'objects' : count,
+        'deep_size' : size,
+        'rss_growth' : after - before if before is not None and after is not None else None}
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--classes",type="int",default=2000)
+    p.add_option("--methods",type="int",default=10)
+    p.add_option("--overloads",type="int",default=2)
+    p.add_option("--xml",dest="xml",help="measure an existing GCCXML output file instead of a synthetic one",metavar="FILE")
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    options,args = p.parse_args()
+
+    if options.xml:
+        r = measure(options.xml)
+    else:
+        f = tempfile.NamedTemporaryFile('w',suffix='.xml',delete=False)
+        try:
+            with f:
+                gccxml_tree(f,classes=options.classes,methods=options.methods,overloads=options.overloads)
+            r = measure(f.name)
+        finally:
+            os.remove(f.name)
+
+    print '{0} objects'.format(r['objects'])
+    print 'deep size: {0:.1f} MiB'.format(r['deep_size'] / 1048576.0)
+    if r['rss_growth'] is not None:
+        print 'RSS growth: {0:.1f} MiB'.format(r['rss_growth'] / 1048576.0)
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Measure the cost of regenerating a module whose spec hasn't changed.
+
+A synthetic module is generated and compiled, then generated again from the
+same spec and brought up to date the way make would, by recompiling every
+object file that is older than its source or the generated header. Reported:
+
+  regenerate -- the time spent in write_file the second time
+  rewritten -- how many of the generated files were written again
+  rebuild -- the time spent recompiling after the second run
+  full rebuild -- the time spent recompiling every source, which is what the
+      rebuild costs if every generated file gets a new modification time
+
+A C++ compiler and the Python headers are required.
+
+usage: python -m pyexpose.bench.rebuild [options]
+
+"""
+
+import os
+import os.path
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+from distutils import sysconfig
+
+from .. import gccxml
+from .synth import module, header
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Build(object):
+    def __init__(self,directory,compiler,sources,headers):
+        self.directory = directory
+        self.compiler = compiler
+        self.sources = sources
+        self.headers = headers
+        self.includes = [sysconfig.get_python_inc(),os.path.join(ROOT,'include'),directory]
+
+    def path(self,name):
+        return os.path.join(self.directory,name)
+
+    def object(self,source):
+        return self.path(os.path.splitext(source)[0] + '.o')
+
+    def stale(self):
+        deps = max(os.path.getmtime(self.path(h)) for h in self.headers)
+        r = []
+        for s in self.sources:
+            o = self.object(s)
+            if not os.path.exists(o) or os.path.getmtime(o) < max(deps,os.path.getmtime(self.path(s))):
+                r.append(s)
+        return r
+
+    def compile(self,sources):
+        """Compile sources and return the time it took."""
+        start = time.time()
+        for s in sources:
+            subprocess.check_call(
+                [self.compiler,'-c','-fPIC','-w','-DLOCAL_PYEXPOSE_COMMON'] +
+                ['-I' + i for i in self.includes] +
+                [self.path(s),'-o',self.object(s)])
+        return time.time() - start
+
+def mtimes(directory):
+    return dict((name,os.path.getmtime(os.path.join(directory,name))) for name in os.listdir(directory))
+
+def run(classes=40,methods=4,overloads=2,split=8,compiler='g++'):
+    tdir = tempfile.mkdtemp()
+    try:
+        params = dict(classes=classes,methods=methods,overloads=overloads,args=1,depth=5,functions=4)
+        tree = os.path.join(tdir,'parsetree')
+        with open(tree,'w') as f:
+            spec = module(f,**params)
+        with open(os.path.join(tdir,'synth.h'),'w') as f:
+            header(f,**params)
+        scope = gccxml.getinterface(tree)
+
+        gendir = os.path.join(tdir,'gen')
+        os.mkdir(gendir)
+        sources = spec.write_file(gendir,scope,split)
+        shutil.copy(os.path.join(tdir,'synth.h'),gendir)
+        build = Build(gendir,compiler,sources,['synth.h',spec.name + '.h'])
+        full = build.compile(build.stale())
+
+        before = mtimes(gendir)
+        start = time.time()
+        spec.write_file(gendir,scope,split)
+        regenerate = time.time() - start
+        after = mtimes(gendir)
+
+        stale = build.stale()
+        rebuild = build.compile(stale)
+
+        return {
+            'sources' : len(sources),
+            'regenerate_seconds' : regenerate,
+            'rewritten_files' : sum(1 for name,t in after.iteritems() if before.get(name) != t),
+            'recompiled_sources' : len(stale),
+            'rebuild_seconds' : rebuild,
+            'full_rebuild_seconds' : full}
+    finally:
+        shutil.rmtree(tdir)
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--classes",type="int",default=40)
+    p.add_option("--methods",type="int",default=4)
+    p.add_option("--overloads",type="int",default=2)
+    p.add_option("--split",type="int",default=8,help="the number of classes per source file (default: %default)")
+    p.add_option("--compiler",default="g++",help="the C++ compiler to use (default: %default)")
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    options,args = p.parse_args()
+
+    r = run(options.classes,options.methods,options.overloads,options.split,options.compiler)
+
+    print 'regenerate:    {0:.3f} s'.format(r['regenerate_seconds'])
+    print 'rewritten:     {0} files'.format(r['rewritten_files'])
+    print 'rebuild:       {0:.3f} s ({1} of {2} sources)'.format(r['rebuild_seconds'],r['recompiled_sources'],r['sources'])
+    print 'full rebuild:  {0:.3f} s'.format(r['full_rebuild_seconds'])
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
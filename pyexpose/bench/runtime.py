@@ -0,0 +1,555 @@
+"""Measure the overhead of calling into a generated extension module.
+
+A module is generated from HEADER and SPEC and compiled the same way the tests
+in test_compile are. A hand-written extension module (HANDWRITTEN) that wraps
+the same classes with the plain CPython API is compiled alongside it, with the
+same compiler and flags. Each operation in OPERATIONS is then timed on both:
+
+  no arguments -- a METH_NOARGS method
+  one argument -- a METH_O method
+  two arguments -- a method that takes a tuple of arguments
+  keyword arguments -- a method called with its arguments by name
+  keywords, by position -- the same method called with its arguments by
+      position
+  overload (int/float/str) -- the overload of a method chosen by the type of
+      its argument
+  attribute get/set -- reading and writing a member variable
+  construct and destroy -- creating an instance and letting it go
+  virtual -- a call from C++ through a virtual method that Python code may
+      override, per call, both when the method is overridden and when it
+      isn't
+  operator + -- a binary numeric operator that returns a new instance
+
+The time of each operation, in nanoseconds per call, is the best of several
+repeats minus the time of an empty loop with the same setup. The number of
+objects each call leaves behind is also recorded: the growth in the number of
+objects tracked by the garbage collector, which shows reference leaks. Release
+builds of Python 2 don't count allocations; on builds with COUNT_ALLOCS or
+Py_REF_DEBUG, the allocations and references per call are recorded as well.
+
+Requires gccxml, a C++ compiler and the Python headers.
+
+usage: python -m pyexpose.bench.runtime [options]
+
+"""
+
+import os
+import os.path
+import sys
+import gc
+import json
+import timeit
+import platform
+from distutils.spawn import find_executable
+from optparse import OptionParser
+
+from ..test.test_compile import TestCompile, write_file
+from .scale import generator_digest
+
+
+HEADER = '''
+#ifndef RUNTIME_BENCH_H
+#define RUNTIME_BENCH_H
+
+class Bench {
+public:
+    int value;
+
+    Bench(int value) : value(value) {}
+
+    int noarg() { return value; }
+    // methods whose arguments have no names don't take keyword arguments
+    int onearg(int);
+    double varargs(int,double);
+    double keywords(int a,double b) { return value + a + b; }
+
+    int ovl(int) { return 1; }
+    int ovl(double) { return 2; }
+    int ovl(const char*) { return 3; }
+};
+
+inline int Bench::onearg(int a) { return value + a; }
+inline double Bench::varargs(int a,double b) { return value + a + b; }
+
+class Virtual {
+public:
+    virtual ~Virtual() {}
+
+    virtual int v(int x) { return x; }
+
+    int call_v(int n) {
+        int total = 0;
+        for(int i=0; i<n; ++i) total += v(i);
+        return total;
+    }
+};
+
+class Num {
+public:
+    double x;
+
+    Num(double x) : x(x) {}
+
+    Num operator+(const Num &b) const { return Num(x + b.x); }
+};
+
+#endif
+'''
+
+SPEC = '''<?xml version="1.0"?>
+<module name="runtimegenerated" include="main.h">
+    <class type="Bench" instance-dict="false" weakrefs="false">
+        <init overload="int"/>
+        <attr cmember="value"/>
+        <def func="noarg"/>
+        <def func="onearg"/>
+        <def func="varargs"/>
+        <def func="keywords"/>
+        <def func="ovl"/>
+    </class>
+    <class type="Virtual" instance-dict="false" weakrefs="false">
+        <def func="v"/>
+        <def func="call_v"/>
+    </class>
+    <class type="Num" instance-dict="false" weakrefs="false">
+        <init overload="double"/>
+        <def name="__add__" func="operator+"/>
+    </class>
+</module>
+'''
+
+# What the generated module would look like if it were written by hand
+HANDWRITTEN = r'''
+#include <Python.h>
+#include <climits>
+#include <new>
+#include "main.h"
+
+namespace {
+
+struct py_error {};
+
+bool to_int(PyObject *o,int &r) {
+    long x = PyInt_AsLong(o);
+    if(x == -1 && PyErr_Occurred()) return false;
+    if(x < INT_MIN || x > INT_MAX) {
+        PyErr_SetString(PyExc_OverflowError,"value is out of range for int");
+        return false;
+    }
+    r = int(x);
+    return true;
+}
+
+
+struct BenchObject {
+    PyObject_HEAD
+    Bench base;
+};
+
+PyTypeObject BenchType = {PyVarObject_HEAD_INIT(NULL,0) "runtimehandwritten.Bench",sizeof(BenchObject)};
+
+inline Bench &get_Bench(PyObject *self) {
+    return reinterpret_cast<BenchObject*>(self)->base;
+}
+
+PyObject *Bench_new(PyTypeObject *type,PyObject *args,PyObject *kwds) {
+    int value;
+    if(!PyArg_ParseTuple(args,"i",&value)) return NULL;
+    PyObject *self = type->tp_alloc(type,0);
+    if(self) new(&get_Bench(self)) Bench(value);
+    return self;
+}
+
+void Bench_dealloc(PyObject *self) {
+    get_Bench(self).~Bench();
+    Py_TYPE(self)->tp_free(self);
+}
+
+PyObject *Bench_noarg(PyObject *self,PyObject*) {
+    return PyInt_FromLong(get_Bench(self).noarg());
+}
+
+PyObject *Bench_onearg(PyObject *self,PyObject *arg) {
+    int a;
+    if(!to_int(arg,a)) return NULL;
+    return PyInt_FromLong(get_Bench(self).onearg(a));
+}
+
+PyObject *Bench_varargs(PyObject *self,PyObject *args) {
+    int a;
+    double b;
+    if(!PyArg_ParseTuple(args,"id",&a,&b)) return NULL;
+    return PyFloat_FromDouble(get_Bench(self).varargs(a,b));
+}
+
+PyObject *Bench_keywords(PyObject *self,PyObject *args,PyObject *kwds) {
+    static const char *names[] = {"a","b",NULL};
+    int a;
+    double b;
+    if(!PyArg_ParseTupleAndKeywords(args,kwds,"id",const_cast<char**>(names),&a,&b)) return NULL;
+    return PyFloat_FromDouble(get_Bench(self).keywords(a,b));
+}
+
+PyObject *Bench_ovl(PyObject *self,PyObject *arg) {
+    Bench &b = get_Bench(self);
+    if(PyInt_Check(arg) || PyLong_Check(arg)) {
+        int a;
+        if(!to_int(arg,a)) return NULL;
+        return PyInt_FromLong(b.ovl(a));
+    }
+    if(PyFloat_Check(arg)) return PyInt_FromLong(b.ovl(PyFloat_AS_DOUBLE(arg)));
+    if(PyString_Check(arg)) return PyInt_FromLong(b.ovl(PyString_AS_STRING(arg)));
+    PyErr_SetString(PyExc_TypeError,"ovl takes an int, a float or a str");
+    return NULL;
+}
+
+PyObject *Bench_get_value(PyObject *self,void*) {
+    return PyInt_FromLong(get_Bench(self).value);
+}
+
+int Bench_set_value(PyObject *self,PyObject *value,void*) {
+    if(!value) {
+        PyErr_SetString(PyExc_TypeError,"value cannot be deleted");
+        return -1;
+    }
+    return to_int(value,get_Bench(self).value) ? 0 : -1;
+}
+
+PyMethodDef Bench_methods[] = {
+    {"noarg",&Bench_noarg,METH_NOARGS,NULL},
+    {"onearg",&Bench_onearg,METH_O,NULL},
+    {"varargs",&Bench_varargs,METH_VARARGS,NULL},
+    {"keywords",reinterpret_cast<PyCFunction>(&Bench_keywords),METH_VARARGS|METH_KEYWORDS,NULL},
+    {"ovl",&Bench_ovl,METH_O,NULL},
+    {NULL}};
+
+PyGetSetDef Bench_getset[] = {
+    {const_cast<char*>("value"),&Bench_get_value,&Bench_set_value,NULL,NULL},
+    {NULL}};
+
+
+// calls the Python method when a subclass overrides it
+struct VirtualBridge : Virtual {
+    PyObject *self;
+
+    int v(int x);
+};
+
+struct VirtualObject {
+    PyObject_HEAD
+    VirtualBridge base;
+};
+
+PyTypeObject VirtualType = {PyVarObject_HEAD_INIT(NULL,0) "runtimehandwritten.Virtual",sizeof(VirtualObject)};
+
+inline VirtualBridge &get_Virtual(PyObject *self) {
+    return reinterpret_cast<VirtualObject*>(self)->base;
+}
+
+PyObject *Virtual_v(PyObject *self,PyObject *arg) {
+    int x;
+    if(!to_int(arg,x)) return NULL;
+    return PyInt_FromLong(get_Virtual(self).Virtual::v(x));
+}
+
+int VirtualBridge::v(int x) {
+    if(Py_TYPE(self) != &VirtualType) {
+        PyObject *f = PyObject_GetAttrString(self,"v");
+        if(!f) throw py_error();
+        if(!(PyCFunction_Check(f) && PyCFunction_GET_FUNCTION(f) == &Virtual_v)) {
+            PyObject *r = PyObject_CallFunction(f,const_cast<char*>("i"),x);
+            Py_DECREF(f);
+            if(!r) throw py_error();
+            int cr;
+            bool ok = to_int(r,cr);
+            Py_DECREF(r);
+            if(!ok) throw py_error();
+            return cr;
+        }
+        Py_DECREF(f);
+    }
+    return Virtual::v(x);
+}
+
+PyObject *Virtual_new(PyTypeObject *type,PyObject *args,PyObject *kwds) {
+    if(!PyArg_ParseTuple(args,"")) return NULL;
+    PyObject *self = type->tp_alloc(type,0);
+    if(self) (new(&get_Virtual(self)) VirtualBridge())->self = self;
+    return self;
+}
+
+void Virtual_dealloc(PyObject *self) {
+    get_Virtual(self).~VirtualBridge();
+    Py_TYPE(self)->tp_free(self);
+}
+
+PyObject *Virtual_call_v(PyObject *self,PyObject *arg) {
+    int n;
+    if(!to_int(arg,n)) return NULL;
+    try {
+        return PyInt_FromLong(get_Virtual(self).call_v(n));
+    } catch(py_error&) {
+        return NULL;
+    }
+}
+
+PyMethodDef Virtual_methods[] = {
+    {"v",&Virtual_v,METH_O,NULL},
+    {"call_v",&Virtual_call_v,METH_O,NULL},
+    {NULL}};
+
+
+struct NumObject {
+    PyObject_HEAD
+    Num base;
+};
+
+PyTypeObject NumType = {PyVarObject_HEAD_INIT(NULL,0) "runtimehandwritten.Num",sizeof(NumObject)};
+
+inline Num &get_Num(PyObject *self) {
+    return reinterpret_cast<NumObject*>(self)->base;
+}
+
+PyObject *Num_new(PyTypeObject *type,PyObject *args,PyObject *kwds) {
+    double x;
+    if(!PyArg_ParseTuple(args,"d",&x)) return NULL;
+    PyObject *self = type->tp_alloc(type,0);
+    if(self) new(&get_Num(self)) Num(x);
+    return self;
+}
+
+void Num_dealloc(PyObject *self) {
+    get_Num(self).~Num();
+    Py_TYPE(self)->tp_free(self);
+}
+
+PyObject *Num_add(PyObject *a,PyObject *b) {
+    if(!PyObject_TypeCheck(a,&NumType) || !PyObject_TypeCheck(b,&NumType)) {
+        Py_INCREF(Py_NotImplemented);
+        return Py_NotImplemented;
+    }
+    PyObject *r = NumType.tp_alloc(&NumType,0);
+    if(r) new(&get_Num(r)) Num(get_Num(a) + get_Num(b));
+    return r;
+}
+
+PyNumberMethods Num_number = {&Num_add};
+
+} // namespace
+
+
+PyMODINIT_FUNC initruntimehandwritten(void) {
+    BenchType.tp_flags = Py_TPFLAGS_DEFAULT|Py_TPFLAGS_BASETYPE;
+    BenchType.tp_new = &Bench_new;
+    BenchType.tp_dealloc = &Bench_dealloc;
+    BenchType.tp_methods = Bench_methods;
+    BenchType.tp_getset = Bench_getset;
+
+    VirtualType.tp_flags = Py_TPFLAGS_DEFAULT|Py_TPFLAGS_BASETYPE;
+    VirtualType.tp_new = &Virtual_new;
+    VirtualType.tp_dealloc = &Virtual_dealloc;
+    VirtualType.tp_methods = Virtual_methods;
+
+    NumType.tp_flags = Py_TPFLAGS_DEFAULT|Py_TPFLAGS_BASETYPE|Py_TPFLAGS_CHECKTYPES;
+    NumType.tp_new = &Num_new;
+    NumType.tp_dealloc = &Num_dealloc;
+    NumType.tp_as_number = &Num_number;
+
+    if(PyType_Ready(&BenchType) < 0 || PyType_Ready(&VirtualType) < 0 || PyType_Ready(&NumType) < 0) return;
+
+    PyObject *m = Py_InitModule(const_cast<char*>("runtimehandwritten"),NULL);
+    if(!m) return;
+
+    Py_INCREF(&BenchType);
+    PyModule_AddObject(m,"Bench",reinterpret_cast<PyObject*>(&BenchType));
+    Py_INCREF(&VirtualType);
+    PyModule_AddObject(m,"Virtual",reinterpret_cast<PyObject*>(&VirtualType));
+    Py_INCREF(&NumType);
+    PyModule_AddObject(m,"Num",reinterpret_cast<PyObject*>(&NumType));
+}
+'''
+
+HANDWRITTEN_NAME = 'runtimehandwritten'
+
+SUBCLASS = '''
+class Sub(m.Virtual):
+    def v(self,x): return x
+'''
+
+# name, setup, statement, the number of calls the statement makes
+OPERATIONS = [
+    ('no arguments','o = m.Bench(1)','o.noarg()',1),
+    ('one argument','o = m.Bench(1)','o.onearg(2)',1),
+    ('two arguments','o = m.Bench(1)','o.varargs(1,2.0)',1),
+    ('keyword arguments','o = m.Bench(1)','o.keywords(a=1,b=2.0)',1),
+    ('keywords, by position','o = m.Bench(1)','o.keywords(1,2.0)',1),
+    ('overload (int)','o = m.Bench(1)','o.ovl(1)',1),
+    ('overload (float)','o = m.Bench(1)','o.ovl(1.0)',1),
+    ('overload (str)','o = m.Bench(1)',"o.ovl('a')",1),
+    ('attribute get','o = m.Bench(1)','o.value',1),
+    ('attribute set','o = m.Bench(1)','o.value = 2',1),
+    ('construct and destroy','','m.Bench(1)',1),
+    ('virtual, not overridden','o = m.Virtual()','o.call_v(100)',100),
+    ('virtual, overridden',SUBCLASS + 'o = Sub()','o.call_v(100)',100),
+    ('operator +','a = m.Num(1.0)\nb = m.Num(2.0)','a + b',1)]
+
+MODULES = 'generated','handwritten'
+
+
+class RuntimeGenerated(TestCompile):
+    """Generates and compiles the module for the benchmark.
+
+    This isn't run as a test. setUp and tearDown are called directly.
+
+    """
+    header_file = HEADER
+    spec_file = SPEC
+
+    def compile_handwritten(self):
+        write_file(HANDWRITTEN_NAME + '.cpp',HANDWRITTEN)
+        obj = self.comp.compile([HANDWRITTEN_NAME + '.cpp'],debug=True)
+        self.comp.link_shared_lib(obj,HANDWRITTEN_NAME,debug=True)
+
+        mname = self.comp.library_filename(HANDWRITTEN_NAME,'shared')
+        name,ext = os.path.splitext(mname)
+        if name != HANDWRITTEN_NAME:
+            os.rename(mname,HANDWRITTEN_NAME+ext)
+
+        return __import__(HANDWRITTEN_NAME)
+
+    def runTest(self):
+        pass
+
+
+def counters():
+    """Return the total number of allocations and the total reference count,
+    each None if this build of Python doesn't keep track of it."""
+    allocs = None
+    if hasattr(sys,'getcounts'):
+        allocs = sum(c[1] for c in sys.getcounts())
+    refs = None
+    if hasattr(sys,'gettotalrefcount'):
+        refs = sys.gettotalrefcount()
+    return allocs,refs
+
+def per_call(before,after,calls):
+    if before is None: return None
+    return (after - before) / float(calls)
+
+def count_objects(module,setup,stmt,calls,number):
+    """Run stmt number times and return the increase in GC-tracked objects,
+    allocations and references per call, the last two None if this build of
+    Python doesn't count them."""
+    ns = {'m' : module}
+    exec setup in ns
+    code = compile('for _ in xrange({0}):\n    {1}\n'.format(number,stmt),'<benchmark>','exec')
+
+    # run once so that anything created on the first call, like cached
+    # attribute names, isn't counted
+    exec code in ns
+
+    gc.collect()
+    gc.disable()
+    try:
+        objects = len(gc.get_objects())
+        allocs,refs = counters()
+        exec code in ns
+        allocs = per_call(allocs,counters()[0],number*calls)
+        refs = per_call(refs,counters()[1],number*calls)
+        objects = per_call(objects,len(gc.get_objects()),number*calls)
+    finally:
+        gc.enable()
+
+    return objects,allocs,refs
+
+def time_operation(module,setup,stmt,calls,number,repeat):
+    """Return the time, in nanoseconds, of one call."""
+    setup = 'import {0} as m\n{1}'.format(module,setup)
+    t = min(timeit.Timer(stmt,setup).repeat(repeat,number))
+    empty = min(timeit.Timer('pass',setup).repeat(repeat,number))
+    return max(t - empty,0.0) / (number * calls) * 1e9
+
+def measure(modules,number=100000,repeat=5,progress=None):
+    """Time every operation in OPERATIONS and return the results as a
+    dictionary that can be saved as JSON.
+
+    modules -- a dictionary that maps each name in MODULES to the imported
+        module
+    progress -- if not None, a function that is called with the result of
+        each operation as soon as it is measured
+
+    """
+    ops = []
+    for name,setup,stmt,calls in OPERATIONS:
+        r = {'operation' : name}
+        for mname in MODULES:
+            mod = modules[mname]
+            objects,allocs,refs = count_objects(mod,setup,stmt,calls,max(number // 10,1))
+            r[mname] = {
+                'ns_per_call' : time_operation(mod.__name__,setup,stmt,calls,number,repeat),
+                'objects_per_call' : objects,
+                'allocations_per_call' : allocs,
+                'references_per_call' : refs}
+        hand = r['handwritten']['ns_per_call']
+        r['ratio'] = r['generated']['ns_per_call'] / hand if hand else None
+        if progress: progress(r)
+        ops.append(r)
+
+    return {
+        'generator' : generator_digest(),
+        'python' : platform.python_version(),
+        'number' : number,
+        'repeat' : repeat,
+        'operations' : ops}
+
+def run(number=100000,repeat=5,progress=None):
+    """Build both modules and measure them (see measure)."""
+    build = RuntimeGenerated()
+    build.setUp()
+    try:
+        modules = {
+            'generated' : build.compile(),
+            'handwritten' : build.compile_handwritten()}
+        return measure(modules,number,repeat,progress)
+    finally:
+        build.tearDown()
+
+def format_count(x):
+    return '-' if x is None else '{0:.2f}'.format(x)
+
+def print_row(r):
+    gen = r['generated']
+    hand = r['handwritten']
+    print '{0:<26}{1:>10.1f}{2:>10.1f}{3:>8}{4:>11}{5:>11}{6:>13}{7:>13}'.format(
+        r['operation'],
+        gen['ns_per_call'],
+        hand['ns_per_call'],
+        '-' if r['ratio'] is None else '{0:.2f}'.format(r['ratio']),
+        format_count(gen['objects_per_call']),
+        format_count(hand['objects_per_call']),
+        format_count(gen['allocations_per_call']),
+        format_count(hand['allocations_per_call']))
+    sys.stdout.flush()
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--number",dest="number",type="int",default=100000,help="the number of calls to time in each repeat (default: %default)",metavar="N")
+    p.add_option("--repeat",dest="repeat",type="int",default=5,help="the number of repeats to take the best of (default: %default)",metavar="N")
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    options,args = p.parse_args()
+
+    if not find_executable('gccxml'):
+        p.error("gccxml was not found")
+    if options.number < 1 or options.repeat < 1:
+        p.error("--number and --repeat must be at least 1")
+
+    print '{0:<26}{1:>10}{2:>10}{3:>8}{4:>11}{5:>11}{6:>13}{7:>13}'.format(
+        'operation','gen (ns)','hand (ns)','ratio','gen objs','hand objs','gen allocs','hand allocs')
+    r = run(options.number,options.repeat,print_row)
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""Measure how the time and memory of the whole generator scale with the size
+of the module.
+
+For every combination of the sizes given, a header and a spec file are
+synthesized (see synth) and the spec goes through the same steps as in the
+pyexpose script: it is read with getspec, gccxml runs on it, its output is
+loaded with getinterface and the module is generated with write_file. Each
+combination runs in a fresh process, so the peak RSS recorded for it only
+belongs to that combination.
+
+Without gccxml, --synthetic-tree has the synthetic GCCXML output for the same
+header stand in for the output of gccxml, and no "gccxml" phase is recorded.
+
+Every size option accepts a comma-separated list of values. The JSON output
+includes a digest of the generator's source, to tell apart the results of
+different versions.
+
+usage: python -m pyexpose.bench.scale [options]
+
+"""
+
+import os
+import os.path
+import sys
+import json
+import hashlib
+import itertools
+import platform
+import shutil
+import tempfile
+import subprocess
+from distutils.spawn import find_executable
+from optparse import OptionParser, SUPPRESS_HELP
+
+from .. import timing
+from ..espec import getspec, reset_unique_num
+from ..gccxml import getinterface
+from ..expose import generate_intermediate, generator_files
+from .synth import gccxml_tree, header, spec_file
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SIZES = 'classes','methods','overloads','depth','templates'
+PHASES = 'getspec','gccxml','getinterface','write_file'
+
+# wide enough for the longest heading, e.g. "getinterface (s)", and a gap
+PHASE_WIDTH = max(len(n) for n in PHASES) + len(' (s)') + 2
+
+# the same for every run
+ARGS = 1
+FUNCTIONS = 10
+
+
+def generator_digest():
+    """Return a digest of the generator's source files."""
+    h = hashlib.sha1()
+    for path in generator_files():
+        with open(path,'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def measure(classes,methods,overloads,depth,templates,gccxml=None,synthetic=False,split=None,jobs=1):
+    """Run the generator on a synthetic module in this process and return the
+    phases recorded by timing.Profile (see Profile.to_dict), the number of
+    source files written and the peak resident set size of the process."""
+    tdir = tempfile.mkdtemp()
+    try:
+        spec_path = os.path.join(tdir,'synthmod.xml')
+        with open(spec_path,'w') as f:
+            spec_file(f,'synthmod',classes,methods,FUNCTIONS,templates)
+        with open(os.path.join(tdir,'synth.h'),'w') as f:
+            header(f,classes,methods,overloads,ARGS,depth,None,FUNCTIONS,templates)
+        tree = os.path.join(tdir,'parsetree')
+        out = os.path.join(tdir,'out')
+        os.mkdir(out)
+
+        profile = timing.Profile()
+        with timing.activate(profile):
+            reset_unique_num()
+            with timing.phase('getspec'):
+                spec = getspec(spec_path)
+
+            if synthetic:
+                with open(tree,'w') as f:
+                    gccxml_tree(f,classes,methods,overloads,ARGS,depth,None,FUNCTIONS,
+                        test_ns_extra=[('class_type_{0}'.format(c.uniquenum),c.name) for c in spec.classes],
+                        templates=templates)
+            else:
+                with timing.phase('gccxml'):
+                    generate_intermediate(spec,tree,gccxml)
+
+            with timing.phase('getinterface'):
+                scope = getinterface(tree,spec.referenced_names(),[spec.test_ns])
+
+            with timing.phase('write_file'):
+                sources = spec.write_file(out,scope,split,jobs)
+
+        r = profile.to_dict()
+        return r['phases'],len(sources),r['peak_rss']
+    finally:
+        shutil.rmtree(tdir)
+
+def run_in_process(params,gccxml=None,synthetic=False,split=None,jobs=1):
+    """Run measure in a new Python process and return a dictionary with params
+    and the results."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (ROOT,env.get('PYTHONPATH')) if p)
+    cmd = [sys.executable,'-m','pyexpose.bench.scale','--measure',json.dumps(params),'--jobs',str(jobs)]
+    if gccxml: cmd.extend(['--gccxml',gccxml])
+    if synthetic: cmd.append('--synthetic-tree')
+    if split: cmd.extend(['--split',str(split)])
+
+    p = subprocess.Popen(cmd,stdout=subprocess.PIPE,env=env)
+    out = p.communicate()[0]
+    if p.returncode:
+        raise subprocess.CalledProcessError(p.returncode,cmd)
+    phases,sources,peak = json.loads(out)
+
+    r = dict(params)
+    r['sources'] = sources
+    r['phases'] = phases
+    top = [ph for ph in phases if len(ph['path']) == 1]
+    r['total_seconds'] = sum(ph['wall_seconds'] for ph in top)
+    r['peak_rss'] = peak
+    return r
+
+def run(sizes,gccxml=None,synthetic=False,split=None,jobs=1,progress=None):
+    """Measure every combination of sizes, a dictionary that maps each name in
+    SIZES to a list of values, and return the results as a dictionary that can
+    be saved as JSON.
+
+    progress -- if not None, a function that is called with the result of
+        each combination as soon as it is measured
+
+    """
+    runs = []
+    for values in itertools.product(*[sizes[n] for n in SIZES]):
+        r = run_in_process(dict(zip(SIZES,values)),gccxml,synthetic,split,jobs)
+        if progress: progress(r)
+        runs.append(r)
+
+    return {
+        'generator' : generator_digest(),
+        'python' : platform.python_version(),
+        'tree' : 'synthetic' if synthetic else 'gccxml',
+        'split' : split,
+        'jobs' : jobs,
+        'runs' : runs}
+
+def phase_seconds(r,name):
+    for ph in r['phases']:
+        if ph['path'] == [name]: return ph['wall_seconds']
+    return None
+
+def print_row(r):
+    times = ''.join('{0:>{1}}'.format('-' if t is None else '{0:.3f}'.format(t),PHASE_WIDTH) for t in (phase_seconds(r,n) for n in PHASES))
+    print '{0:>8}{1:>8}{2:>10}{3:>6}{4:>10}{5}{6:>10.3f}{7:>12.1f}'.format(
+        r['classes'],r['methods'],r['overloads'],r['depth'],r['templates'],times,r['total_seconds'],r['peak_rss'] / 1048576.0)
+    sys.stdout.flush()
+
+def int_list(option,value):
+    try:
+        r = [int(v) for v in value.split(',')]
+    except ValueError:
+        r = None
+    if not r or min(r) < (1 if option in ('classes','overloads','depth') else 0):
+        raise ValueError('invalid value for --{0}: "{1}"'.format(option,value))
+    return r
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--classes",default="50,100,200,400",help="the numbers of classes (default: %default)",metavar="N[,N...]")
+    p.add_option("--methods",default="10",help="the numbers of methods per class (default: %default)",metavar="N[,N...]")
+    p.add_option("--overloads",default="2",help="the numbers of overloads per method (default: %default)",metavar="N[,N...]")
+    p.add_option("--depth",default="1",help="the lengths of the chains of single inheritance the classes form (default: %default)",metavar="N[,N...]")
+    p.add_option("--templates",default="0",help="the numbers of class template instances, in addition to the classes (default: %default)",metavar="N[,N...]")
+    p.add_option("--gccxml",dest="gccxml",help="path to the gccxml executable",metavar="PATH")
+    p.add_option("--synthetic-tree",dest="synthetic",action="store_true",default=False,help="use synthetic GCCXML output instead of running gccxml")
+    p.add_option("--split",dest="split",type="int",help="pass --split-classes=N to the generator",metavar="N")
+    p.add_option("--jobs",dest="jobs",type="int",default=1,help="the number of processes to render the classes in (default: %default)",metavar="N")
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    p.add_option("--measure",dest="measure",help=SUPPRESS_HELP)
+    options,args = p.parse_args()
+
+    if options.measure:
+        params = json.loads(options.measure)
+        r = measure(gccxml=options.gccxml,synthetic=options.synthetic,split=options.split,jobs=options.jobs,**params)
+        json.dump(r,sys.stdout)
+        return
+
+    if not (options.synthetic or find_executable(options.gccxml or 'gccxml')):
+        p.error("gccxml was not found (use --gccxml or --synthetic-tree)")
+
+    try:
+        sizes = dict((n,int_list(n,getattr(options,n))) for n in SIZES)
+    except ValueError as e:
+        p.error(str(e))
+
+    print '{0:>8}{1:>8}{2:>10}{3:>6}{4:>10}{5}{6:>10}{7:>12}'.format(
+        'classes','methods','overloads','depth','templates',''.join('{0:>{1}}'.format(n + ' (s)',PHASE_WIDTH) for n in PHASES),'total (s)','peak (MiB)')
+    r = run(sizes,options.gccxml,options.synthetic,options.split,options.jobs,print_row)
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
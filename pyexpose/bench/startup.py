@@ -0,0 +1,97 @@
+"""Measure the start-up cost of the generator.
+
+Each measurement is taken in a fresh interpreter:
+
+  import -- importing pyexpose.expose (what scripts/pyexpose does before it
+      reads the spec)
+  templates (cold) -- loading every template with an empty bytecode cache
+  templates (warm) -- loading every template from the bytecode cache filled by
+      the previous run
+  templates (no cache) -- loading every template with the bytecode cache
+      disabled
+
+usage: python -m pyexpose.bench.startup [options]
+
+"""
+
+import sys
+import os.path
+import json
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+
+CHILD = '''
+import sys,time,json
+start = time.time()
+import pyexpose.expose
+from pyexpose import espectmpl
+imported = time.time()
+jinja_imported = 'jinja2' in sys.modules
+espectmpl.bytecode_cache_dir = {cache!r}
+for t in vars(espectmpl).values():
+    if isinstance(t,espectmpl.Template):
+        espectmpl.get_env().get_template(t.name)
+json.dump({{
+    'import' : imported - start,
+    'templates' : time.time() - imported,
+    'jinja_imported' : jinja_imported}},sys.stdout)
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def measure(cache):
+    out = subprocess.check_output(
+        [sys.executable,'-c',CHILD.format(cache=cache)],
+        cwd=ROOT)
+    return json.loads(out)
+
+def best(cache,repeat):
+    results = [measure(cache) for i in range(repeat)]
+    return min(results,key=lambda x: x['import'] + x['templates'])
+
+def run(repeat=5):
+    tdir = tempfile.mkdtemp()
+    try:
+        # the cold run has to start with an empty cache every time
+        cold = []
+        for i in range(repeat):
+            d = os.path.join(tdir,str(i))
+            os.mkdir(d)
+            cold.append(measure(d))
+        cold = min(cold,key=lambda x: x['templates'])
+
+        warm = best(os.path.join(tdir,'0'),repeat)
+        nocache = best(False,repeat)
+    finally:
+        shutil.rmtree(tdir)
+
+    return {
+        'import_seconds' : warm['import'],
+        'jinja2_imported_by_import' : warm['jinja_imported'],
+        'templates_cold_seconds' : cold['templates'],
+        'templates_warm_seconds' : warm['templates'],
+        'templates_no_cache_seconds' : nocache['templates']}
+
+def main():
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--repeat",type="int",default=5,help="take the best of this many runs (default: %default)")
+    p.add_option("--json",dest="json",help="also write the results to FILE",metavar="FILE")
+    options,args = p.parse_args()
+
+    r = run(options.repeat)
+
+    print 'import:                {0:.3f} s{1}'.format(r['import_seconds'],
+        ' (jinja2 imported)' if r['jinja2_imported_by_import'] else '')
+    print 'templates (cold):      {0:.3f} s'.format(r['templates_cold_seconds'])
+    print 'templates (warm):      {0:.3f} s'.format(r['templates_warm_seconds'])
+    print 'templates (no cache):  {0:.3f} s'.format(r['templates_no_cache_seconds'])
+
+    if options.json:
+        with open(options.json,'w') as f:
+            json.dump(r,f,indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""Generate synthetic GCCXML output.
+
+This allows the parts of the generator after GCCXML to be measured on trees of
+any size without having GCCXML installed. The output mimics what GCCXML
+produces for a header like:
+
+    namespace synth {
+        class c0 { public: int f0; c0(); c0(int); ~c0(); int m0(int,double); ... };
+        class c1 : public c0 { ... };
+        ...
+        int func0(int,double);
+        ...
+    }
+
+plus instantiations of a class template "t" with the same members, the TEST_NS
+typedefs that espec.ModuleDef.print_gccxml_input declares, and any number of
+unrelated declarations that stand in for the system headers.
+
+header writes the corresponding C++ header and spec_file a spec that exposes
+all of it.
+
+"""
+
+from xml.sax.saxutils import quoteattr
+
+from ..espec import TEST_NS, ModuleDef, ClassDef, DefDef, Overload
+
+
+FUNDAMENTAL = [
+    ('bool',8),('int',32),('unsigned int',32),('short int',16),
+    ('short unsigned int',16),('long int',64),('long unsigned int',64),
+    ('long long int',64),('long long unsigned int',64),('float',32),
+    ('double',64),('long double',128),('signed char',8),('unsigned char',8),
+    ('char',8),('wchar_t',32),('void',None)]
+
+TEST_TYPES = [
+    ('bool','bool'),('sint','int'),('uint','unsigned int'),
+    ('sshort','short int'),('ushort','short unsigned int'),
+    ('slong','long int'),('ulong','long unsigned int'),
+    ('slonglong','long long int'),('ulonglong','long long unsigned int'),
+    ('float','float'),('double','double'),('long_double','long double'),
+    ('size_t','long unsigned int'),('py_ssize_t','long int'),
+    ('schar','signed char'),('uchar','unsigned char'),('char','char'),
+    ('wchar_t','wchar_t'),('py_unicode','unsigned int'),('void','void')]
+
+# the argument types used by the synthetic methods and functions, in order
+ARG_TYPES = ['int','double','long int','float','short int','long unsigned int']
+
+
+class TreeWriter(object):
+    """Accumulates GCCXML elements, assigning IDs as it goes."""
+
+    def __init__(self):
+        self.elements = []
+        self.next_id = 1
+        self.fundamental = {}
+        self.derived = {}
+
+    def new_id(self):
+        r = '_{0}'.format(self.next_id)
+        self.next_id += 1
+        return r
+
+    def add(self,tag,attrs,children=(),id=None):
+        if id is None: id = self.new_id()
+        self.elements.append((tag,[('id',id)] + attrs,children))
+        return id
+
+    def fundamental_type(self,name):
+        return self.fundamental[name]
+
+    def derived_type(self,tag,type,extra=()):
+        key = tag,type,tuple(extra)
+        id = self.derived.get(key)
+        if id is None:
+            id = self.add(tag,[('type',type)] + list(extra))
+            self.derived[key] = id
+        return id
+
+    def pointer(self,type):
+        return self.derived_type('PointerType',type,[('size','64'),('align','64')])
+
+    def reference(self,type):
+        return self.derived_type('ReferenceType',type,[('size','64'),('align','64')])
+
+    def const(self,type):
+        return self.derived_type('CvQualifiedType',type,[('const','1')])
+
+    def write(self,out):
+        out.write('<?xml version="1.0"?>\n<GCC_XML cvs_revision="1.135">\n')
+        for tag,attrs,children in self.elements:
+            a = ' '.join('{0}={1}'.format(k,quoteattr(str(v))) for k,v in attrs)
+            if children:
+                out.write('  <{0} {1}>\n'.format(tag,a))
+                for ctag,cattrs in children:
+                    out.write('    <{0} {1}/>\n'.format(ctag,' '.join('{0}={1}'.format(k,quoteattr(str(v))) for k,v in cattrs)))
+                out.write('  </{0}>\n'.format(tag))
+            else:
+                out.write('  <{0} {1}/>\n'.format(tag,a))
+        out.write('  <File id="f1" name="synth.h"/>\n</GCC_XML>\n')
+
+
+def arguments(w,count,offset=0):
+    return [('Argument',[('name','a{0}'.format(i)),('type',w.fundamental_type(ARG_TYPES[(i+offset) % len(ARG_TYPES)]))])
+        for i in range(count)]
+
+def base_index(i,depth=1,fanout=None):
+    """Return the index of the base class of synthetic class i or None."""
+    if fanout:
+        return (i-1) // fanout if i else None
+    return i-1 if i % depth else None
+
+def start_tree(test_namespaces,namespaces=()):
+    """Create a TreeWriter with what every tree needs: the global namespace,
+    the namespace "std", the fundamental types, and a namespace for each name
+    in test_namespaces with the typedefs that conversion.Conversion looks up.
+
+    namespaces -- the names of further namespaces to add to the global one
+
+    Returns the TreeWriter, the IDs of the test namespaces, the IDs of the
+    other namespaces and a dictionary that maps the names of the fundamental
+    types, "std::string" and "std::wstring" to their IDs.
+
+    """
+    w = TreeWriter()
+    root = w.add('Namespace',[('name','::')])
+    tnss = [w.add('Namespace',[('name',name),('context',root)]) for name in test_namespaces]
+    std = w.add('Namespace',[('name','std'),('context',root)])
+    namespaces = [w.add('Namespace',[('name',name),('context',root)]) for name in namespaces]
+
+    for name,size in FUNDAMENTAL:
+        attrs = [('name',name)]
+        if size: attrs.append(('size',size))
+        w.fundamental[name] = w.add('FundamentalType',attrs)
+
+    named = dict(w.fundamental)
+    for name in ('string','wstring'):
+        named['std::'+name] = w.add('Class',[('name',name),('context',std),('size','64'),('members',''),('bases','')])
+    pyobj = w.add('Struct',[('name','_object'),('context',root),('size','128'),('members',''),('bases','')])
+    visitproc = w.add('FunctionType',[('returns',w.fundamental_type('int'))],
+        [('Argument',[('type',w.pointer(pyobj))]),('Argument',[('type',w.pointer(w.fundamental_type('void')))])])
+
+    for tns in tnss:
+        for name,type in TEST_TYPES:
+            w.add('Typedef',[('name','type_'+name),('type',named[type]),('context',tns)])
+        w.add('Typedef',[('name','type_stdstring'),('type',named['std::string']),('context',tns)])
+        w.add('Typedef',[('name','type_stdwstring'),('type',named['std::wstring']),('context',tns)])
+        w.add('Typedef',[('name','type_pyobject'),('type',w.pointer(pyobj)),('context',tns)])
+        w.add('Typedef',[('name','type_visitproc'),('type',w.pointer(visitproc)),('context',tns)])
+
+    return w,tnss,namespaces,named
+
+def gccxml_tree(out,classes=100,methods=10,overloads=1,args=2,depth=1,fanout=None,functions=10,padding=0,test_ns_extra=(),test_namespaces=None,templates=0):
+    """Write a synthetic GCCXML tree to the file-like object out.
+
+    classes -- the number of classes in namespace "synth"
+    methods -- the number of methods per class
+    overloads -- the number of overloads of each method and function
+    args -- the number of arguments of the first overload (each further
+        overload takes one more)
+    depth -- the classes form chains of single inheritance this long
+    fanout -- if not None, the classes instead form a single tree where
+        every class has this many derived classes
+    functions -- the number of free functions
+    padding -- the number of unrelated classes (with "methods" methods each)
+        in namespace "other"
+    test_ns_extra -- a sequence of (name,type) tuples to declare as typedefs in
+        TEST_NS, where type is the name of one of the synthetic classes (e.g.
+        "c5") or a fundamental type
+    test_namespaces -- if not None, a sequence of (namespace,test_ns_extra)
+        tuples to declare instead of TEST_NS and test_ns_extra, as GCCXML
+        would for the input of several modules parsed together
+    templates -- the number of instantiations of the class template "t"
+        (named "t<0>", "t<1>", ...), which have the same members as the other
+        classes. They can be referred to in test_ns_extra as "t0", "t1", ...
+
+    Returns the TreeWriter, whose "elements" list can be used to count the
+    elements.
+
+    """
+    if test_namespaces is None: test_namespaces = [(TEST_NS,test_ns_extra)]
+
+    w,tnss,(synth,other),named = start_tree([name for name,extra in test_namespaces],['synth','other'])
+
+    def add_class(name,context,base,cname=None):
+        # the constructors of a template instance are named after the template
+        cname = cname or name
+        id = w.new_id()
+        children = []
+        if base:
+            children.append(('Base',[('type',base),('access','public'),('virtual','0'),('offset','0')]))
+        w.add('Class',[('name',name),('context',context),('size','64'),('members',''),('bases',base or '')],children,id)
+
+        w.add('Field',[('name','f0'),('type',w.fundamental_type('int')),('offset','0'),('context',id),('access','public')])
+        w.add('Constructor',[('name',cname),('context',id),('access','public')])
+        w.add('Constructor',[('name',cname),('context',id),('access','public'),('artificial','1')],
+            [('Argument',[('type',w.reference(w.const(id)))])])
+        w.add('Constructor',[('name',cname),('context',id),('access','public')],arguments(w,1))
+        w.add('Destructor',[('name',cname),('context',id),('access','public')])
+        w.add('OperatorMethod',[('name','='),('returns',w.reference(id)),('context',id),('access','public'),('artificial','1')],
+            [('Argument',[('type',w.reference(w.const(id)))])])
+        for m in range(methods):
+            for o in range(overloads):
+                w.add('Method',[('name','m{0}'.format(m)),('returns',w.fundamental_type('int')),('context',id),('access','public')],
+                    arguments(w,args + o,m))
+        return id
+
+    for i in range(classes):
+        b = base_index(i,depth,fanout)
+        named['c{0}'.format(i)] = add_class('c{0}'.format(i),synth,None if b is None else named['c{0}'.format(b)])
+
+    for i in range(templates):
+        named['t{0}'.format(i)] = add_class('t<{0}>'.format(i),synth,None,'t')
+
+    for i in range(padding):
+        add_class('p{0}'.format(i),other,None)
+
+    for f in range(functions):
+        for o in range(overloads):
+            w.add('Function',[('name','func{0}'.format(f)),('returns',w.fundamental_type('int')),('context',synth)],arguments(w,args + o,f))
+
+    for tns,(ns,extra) in zip(tnss,test_namespaces):
+        for name,type in extra:
+            w.add('Typedef',[('name',name),('type',named[type]),('context',tns)])
+
+    w.write(out)
+    return w
+
+def header(out,classes=100,methods=10,overloads=1,args=2,depth=1,fanout=None,functions=10,templates=0):
+    """Write a C++ header that declares, with inline definitions, what
+    gccxml_tree describes for the same parameters, so that the generated
+    module can be compiled.
+
+    Every method and function returns the number of arguments it was called
+    with.
+
+    """
+    def params(count,offset):
+        return ','.join('{0} a{1}'.format(ARG_TYPES[(i+offset) % len(ARG_TYPES)],i) for i in range(count))
+
+    out.write('#pragma once\nnamespace synth {\n')
+    for i in range(classes):
+        b = base_index(i,depth,fanout)
+        out.write('class c{0}{1} {{\npublic:\n    int f0;\n'.format(i,'' if b is None else ' : public c{0}'.format(b)))
+        out.write('    c{0}() : f0(0) {{}}\n    c{0}(int a0) : f0(a0) {{}}\n    ~c{0}() {{}}\n'.format(i))
+        for m in range(methods):
+            for o in range(overloads):
+                out.write('    int m{0}({1}) {{ return {2}; }}\n'.format(m,params(args + o,m),args + o))
+        out.write('};\n')
+
+    if templates:
+        out.write('template<int N> class t {\npublic:\n    int f0;\n')
+        out.write('    t() : f0(0) {}\n    t(int a0) : f0(a0) {}\n    ~t() {}\n')
+        for m in range(methods):
+            for o in range(overloads):
+                out.write('    int m{0}({1}) {{ return {2}; }}\n'.format(m,params(args + o,m),args + o))
+        out.write('};\n')
+
+    for f in range(functions):
+        for o in range(overloads):
+            out.write('inline int func{0}({1}) {{ return {2}; }}\n'.format(f,params(args + o,f),args + o))
+    out.write('}\n')
+
+    # the generated code calls free functions by their unqualified names
+    out.write('using namespace synth;\n')
+
+def spec(name,classes=100,methods=10,functions=10,templates=0):
+    """Create a spec that exposes every class, method and function of a
+    synthetic tree.
+
+    Returns an instance of espec.ModuleDef and the list of TEST_NS typedefs
+    its classes need (see test_ns_extra in gccxml_tree).
+
+    """
+    m = ModuleDef(name,['synth.h'])
+    extra = []
+    for cname,ctype in class_names(classes,templates):
+        c = ClassDef(cname,ctype)
+        for k in range(methods):
+            d = DefDef('m{0}'.format(k))
+            d.overloads.append(Overload('m{0}'.format(k)))
+            c.methods[d.name] = d
+        m.classes.append(c)
+        extra.append(('class_type_{0}'.format(c.uniquenum),cname))
+
+    for f in range(functions):
+        d = DefDef('func{0}'.format(f))
+        d.overloads.append(Overload('synth::func{0}'.format(f)))
+        m.functions[d.name] = d
+
+    return m,extra
+
+def class_names(classes,templates=0):
+    """Return the names and C++ types of the synthetic classes and template
+    instances, in the order spec and spec_file expose them."""
+    return ([('c{0}'.format(i),'synth::c{0}'.format(i)) for i in range(classes)] +
+        [('t{0}'.format(i),'synth::t<{0}>'.format(i)) for i in range(templates)])
+
+def spec_file(out,name,classes=100,methods=10,functions=10,templates=0):
+    """Write a spec file that describes the same module as spec.
+
+    The TEST_NS typedefs the classes of the spec need (see test_ns_extra in
+    gccxml_tree) are named after the "uniquenum" attributes of the classes
+    that espec.getspec creates when reading it.
+
+    """
+    out.write('<?xml version="1.0"?>\n<module name="{0}" include="synth.h">\n'.format(name))
+    for cname,ctype in class_names(classes,templates):
+        out.write('  <class name="{0}" type={1}>\n'.format(cname,quoteattr(ctype)))
+        for k in range(methods):
+            out.write('    <def func="m{0}"/>\n'.format(k))
+        out.write('  </class>\n')
+    for f in range(functions):
+        out.write('  <def name="func{0}" func="synth::func{0}"/>\n'.format(f))
+    out.write('</module>\n')
+
+def module(out,classes=100,methods=10,overloads=1,args=2,depth=1,fanout=None,functions=10,padding=0,templates=0):
+    """Create a spec that exposes every class, method and function of a
+    synthetic tree and write the tree to out.
+
+    The parameters are the same as for gccxml_tree. Returns an instance of
+    espec.ModuleDef that can be passed to its write_file method together with
+    the result of gccxml.getinterface.
+
+    """
+    m,extra = spec('synthmod',classes,methods,functions,templates)
+    gccxml_tree(out,classes,methods,overloads,args,depth,fanout,functions,padding,extra,templates=templates)
+    return m
+
+def modules(out,count,classes=100,methods=10,overloads=1,args=2,depth=1,fanout=None,functions=10,padding=0):
+    """Create "count" specs that expose the same synthetic tree, named
+    "synthmod0", "synthmod1", ..., and write the tree, as a single run of
+    GCCXML would produce it for all of them, to out.
+
+    The specs' test namespaces are the ones expose.generate_modules gives
+    specs with the same includes. Returns the list of specs.
+
+    """
+    specs = []
+    namespaces = []
+    for i in range(count):
+        m,extra = spec('synthmod{0}'.format(i),classes,methods,functions)
+        specs.append(m)
+        namespaces.append(('{0}{1}'.format(TEST_NS,i),extra))
+    gccxml_tree(out,classes,methods,overloads,args,depth,fanout,functions,padding,test_namespaces=namespaces)
+    return specs
@@ -0,0 +1,426 @@
+"""Generate, compile and link extension modules in one step.
+
+Builder compiles the generated sources with the compiler that distutils uses
+(which has to be GCC or compatible), running several compilers at once. An
+object file is only compiled again if the command that compiles it changed or
+if its source or any header the source included (which the compiler lists in a
+".d" file next to the object file) changed since it was last compiled. If it has an
+ObjectCache, every source is preprocessed first and the object file
+is taken from the cache when the preprocessed source and the command line are
+the same as before. When a module has more than one source file, the headers
+that every one of them includes first are precompiled once.
+
+build_ext is a distutils (or setuptools) command that does all of this for
+extensions whose sources include a spec file, and main implements
+"pyexpose build".
+
+"""
+
+import os
+import os.path
+import sys
+import errno
+import filecmp
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+from distutils import ccompiler, sysconfig, log
+from distutils.dep_util import newer_group
+from distutils.errors import CompileError, LinkError, DistutilsSetupError
+from distutils.command.build_ext import build_ext as _build_ext
+
+from .espec import getspec
+from .expose import generate_module, parse_make_rule
+from .conversion import read_call_profile
+from .cache import ObjectCache, DEFAULT_MAX_SIZE
+from .outfile import OutputFile
+from . import espectmpl as tmpl
+
+
+# unless told otherwise, put every this many classes in a separate source
+# file, so that even a single module can be compiled in parallel
+DEFAULT_SPLIT = 8
+
+# what Builder.compile did with a source
+COMPILED = 0
+CACHED = 1
+CURRENT = 2
+
+
+def common_include_dir():
+    """Return the directory that contains pyexpose_common.h if running from a
+    source checkout, or None if it has to be installed with the Python
+    headers."""
+    d = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'include')
+    return d if os.path.isfile(os.path.join(d,'pyexpose_common.h')) else None
+
+def read_dependencies(path):
+    """Return the prerequisites listed in the makefile rule at path, written by
+    the compiler's -MMD option."""
+    with open(path) as f:
+        return parse_make_rule(f.read())
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST: raise
+
+def run_compiler(args):
+    """Run the compiler and return its standard output. Its standard error
+    (warnings) is passed on."""
+    p = subprocess.Popen(args,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+    out,err = p.communicate()
+    if err: sys.stderr.write(err)
+    if p.returncode:
+        raise CompileError('command "{0}" failed with exit status {1}'.format(' '.join(args),p.returncode))
+    return out
+
+
+class Builder(object):
+    """Compiles and links the sources of generated modules.
+
+    cc -- a distutils CCompiler for GCC or a compatible compiler, already
+        customized (see distutils.sysconfig.customize_compiler)
+    build_dir -- where to put object files and precompiled headers
+    jobs -- the number of compilers to run at once (by default, one per CPU)
+    cache_dir -- if not None, the directory of an ObjectCache to take object
+        files from and add them to
+    cache_size -- the maximum size of the cache in bytes
+    pch -- if True, precompile the headers included by every source of a
+        module that has more than one source
+    include_dirs, macros, extra_args -- added to what cc already has
+
+    Sources are queued with add_module and add_sources and compiled with run.
+
+    The object files of the sources in build_dir (the generated ones) are put
+    next to them. The object files of other sources are put in the "src"
+    directory of build_dir, at the same path as the source relative to the
+    current directory (with ".." replaced by "__"), so that sources with the
+    same name don't share an object file.
+
+    """
+    def __init__(self,cc,build_dir,jobs=None,cache_dir=None,cache_size=DEFAULT_MAX_SIZE,pch=True,include_dirs=(),macros=(),extra_args=()):
+        self.cc = cc
+        self.build_dir = build_dir
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.cache = cache_dir and ObjectCache(cache_dir,cache_size)
+        self.pch = pch
+
+        # distutils uses the C compiler's flags, some of which don't apply to C++
+        self.command = ([a for a in cc.compiler_so if a != '-Wstrict-prototypes'] +
+            ccompiler.gen_preprocess_options(cc.macros + list(macros),cc.include_dirs + list(include_dirs)) +
+            list(extra_args))
+
+        self.headers = []
+        self.sources = []
+
+        # the number of object files compiled, taken from the cache and found
+        # to be up to date by run
+        self.compiled = 0
+        self.cached = 0
+        self.current = 0
+
+    def make_build_dir(self):
+        makedirs(self.build_dir)
+
+    def object_name(self,source,ext='.o'):
+        path = os.path.relpath(source,self.build_dir)
+        if path.split(os.sep)[0] == os.pardir:
+            path = os.path.relpath(source)
+            if os.path.isabs(path): path = os.path.splitdrive(path)[1].lstrip(os.sep)
+            path = os.path.join('src',*['__' if p == os.pardir else p for p in path.split(os.sep)])
+        return os.path.join(self.build_dir,os.path.splitext(path)[0] + ext)
+
+    def add_module(self,name,sources,includes):
+        """Queue the sources of the module "name", whose spec includes the
+        headers in includes, and return the names of the object files that
+        run will create."""
+        extra = []
+        if self.pch and len(sources) > 1:
+            self.make_build_dir()
+            header = os.path.abspath(os.path.join(self.build_dir,name + '_pch.h'))
+            with OutputFile(header) as f:
+                f.write(tmpl.precompiled_header.format(includes="\n".join('#include "{0}"'.format(i) for i in includes)))
+            self.headers.append((header,header + '.gch',['-x','c++-header'],[],[]))
+            extra = ['-include',header,'-Winvalid-pch']
+
+            # the compiler doesn't list the precompiled header as a dependency
+            return self.add_sources(sources,extra,[header + '.gch'])
+
+        return self.add_sources(sources)
+
+    def add_sources(self,sources,extra=(),depends=()):
+        """Queue sources that are not part of any generated module (e.g. the
+        implementation of the exposed classes) and return the names of the
+        object files that run will create."""
+        objects = [self.object_name(s) for s in sources]
+        self.sources.extend((s,o,[],list(extra),list(depends)) for s,o in zip(sources,objects))
+        return objects
+
+    def up_to_date(self,obj,cmdline,depends):
+        """Return True if obj was compiled by cmdline and none of the files it
+        was compiled from changed since.
+
+        The time of the last compile is taken from the ".cmd" file, which is
+        written every time, because an object file taken from the cache keeps
+        its old time when it's the same as the one already there.
+
+        """
+        try:
+            with open(obj + '.cmd') as f:
+                if f.read() != cmdline: return False
+            depends = read_dependencies(obj + '.d') + depends
+        except IOError:
+            return False
+        return os.path.exists(obj) and not newer_group(depends,obj + '.cmd','newer')
+
+    def compile(self,task):
+        """Compile one source and return COMPILED, CACHED or CURRENT, depending
+        on whether the object file was compiled, taken from the cache or
+        already up to date."""
+        source,obj,lang,extra,depends = task
+        cmd = self.command + lang
+        deps = ['-MMD','-MF',obj + '.d']
+        cmdline = '\n'.join(cmd + extra + [source]) + '\n'
+
+        if self.up_to_date(obj,cmdline,depends): return CURRENT
+
+        # the command is written again once the object file is, so that an
+        # object file from an interrupted or failed compile isn't used
+        makedirs(os.path.dirname(obj))
+        if os.path.exists(obj + '.cmd'): os.remove(obj + '.cmd')
+
+        r = COMPILED
+        key = None
+        if self.cache:
+            key = self.cache.key(run_compiler(cmd + deps + ['-E',source]),cmd)
+
+            # leave an identical object file alone, so that it doesn't have to
+            # be linked again
+            tmp = obj + '.cached'
+            if self.cache.get(key,tmp):
+                if os.path.exists(obj) and filecmp.cmp(tmp,obj,False):
+                    os.remove(tmp)
+                else:
+                    os.rename(tmp,obj)
+                r = CACHED
+
+        if r == COMPILED:
+            run_compiler(cmd + extra + deps + ['-c',source,'-o',obj])
+            if key: self.cache.put(key,obj)
+
+        with open(obj + '.cmd','w') as f:
+            f.write(cmdline)
+        return r
+
+    def run(self):
+        """Compile everything that was queued, the precompiled headers first."""
+        self.make_build_dir()
+        pool = ThreadPool(self.jobs)
+        try:
+            for tasks in (self.headers,self.sources):
+                for r in pool.map(self.compile,tasks):
+                    if r == CACHED: self.cached += 1
+                    elif r == CURRENT: self.current += 1
+                    else: self.compiled += 1
+        finally:
+            pool.terminate()
+
+        self.headers = []
+        self.sources = []
+
+    def link(self,objects,output,libraries=(),library_dirs=(),extra_args=()):
+        """Link objects into the extension module output, unless it is already
+        newer than all of them."""
+        if os.path.exists(output) and not newer_group(objects,output):
+            return
+        self.cc.link_shared_object(objects,output,
+            libraries=list(libraries),
+            library_dirs=list(library_dirs),
+            extra_postargs=list(extra_args),
+            target_lang='c++')
+
+
+def build_modules(specs,builder,output_dir='.',sources=(),libraries=(),library_dirs=(),split=DEFAULT_SPLIT,**options):
+    """Generate, compile and link the modules of specs and return the names of
+    the extension modules.
+
+    builder -- an instance of Builder. The modules are generated in its
+        build_dir.
+    output_dir -- where to put the extension modules
+    sources -- more source files to compile and link into every module (e.g.
+        the implementation of the exposed classes)
+    split -- passed to espec.ModuleDef.write_file
+    options -- passed to expose.generate_module
+
+    """
+    builder.make_build_dir()
+    modules = []
+    for spec in specs:
+        generated = generate_module(spec,builder.build_dir,split=split,jobs=builder.jobs,**options)
+        objects = builder.add_module(spec.name,[os.path.join(builder.build_dir,s) for s in generated],spec.includes)
+        modules.append((spec.name,objects))
+
+    shared = builder.add_sources(sources)
+    builder.run()
+
+    outputs = []
+    for name,objects in modules:
+        output = os.path.join(output_dir,name + sysconfig.get_config_var('SO'))
+        builder.link(objects + shared,output,libraries,library_dirs)
+        outputs.append(output)
+    return outputs
+
+
+class build_ext(_build_ext):
+    """A build_ext command that accepts PyExpose spec files (files ending in
+    ".xml") among the sources of an Extension.
+
+    The module is generated from the spec, using the extension's include_dirs
+    and define_macros for gccxml as well, and compiled together with the
+    extension's other sources by a Builder. Extensions without a spec file are
+    built as usual.
+
+        setup(...,
+            ext_modules=[Extension('mymodule',['mymodule.xml','impl.cpp'])],
+            cmdclass={'build_ext' : build_ext})
+
+    """
+    user_options = _build_ext.user_options + [
+        ('jobs=','j',"number of compilers to run at once (default: one per CPU)"),
+        ('object-cache=',None,"cache object files in this directory"),
+        ('no-pch',None,"don't precompile headers"),
+        ('gccxml=',None,"path to the gccxml executable"),
+        ('gccxml-cache=',None,"cache the output of gccxml in this directory")]
+    boolean_options = _build_ext.boolean_options + ['no-pch']
+
+    def initialize_options(self):
+        _build_ext.initialize_options(self)
+        self.jobs = None
+        self.object_cache = None
+        self.no_pch = 0
+        self.gccxml = None
+        self.gccxml_cache = None
+
+    def finalize_options(self):
+        _build_ext.finalize_options(self)
+        if self.jobs is not None:
+            self.jobs = int(self.jobs)
+
+    def build_extension(self,ext):
+        specs = [s for s in ext.sources if s.endswith('.xml')]
+        if not specs:
+            return _build_ext.build_extension(self,ext)
+        if len(specs) > 1:
+            raise DistutilsSetupError('extension "{0}" has more than one spec file'.format(ext.name))
+
+        log.info("building '%s' extension",ext.name)
+        spec = getspec(specs[0])
+        spec.name = ext.name.split('.')[-1]
+
+        include_dirs = ['.'] + ext.include_dirs
+        macros = list(ext.define_macros)
+        common = common_include_dir()
+        if common:
+            include_dirs.append(common)
+            macros.append(('LOCAL_PYEXPOSE_COMMON',None))
+        flags = ccompiler.gen_preprocess_options(macros,include_dirs + self.include_dirs)
+
+        build_dir = os.path.join(self.build_temp,'pyexpose',ext.name)
+        self.mkpath(build_dir)
+        builder = Builder(self.compiler,build_dir,self.jobs,self.object_cache,pch=not self.no_pch,
+            include_dirs=include_dirs,macros=macros,extra_args=ext.extra_compile_args or ())
+
+        generated = generate_module(spec,build_dir,self.gccxml,None,' '.join(flags),self.gccxml_cache,split=DEFAULT_SPLIT,jobs=builder.jobs)
+        objects = builder.add_module(spec.name,[os.path.join(build_dir,s) for s in generated],spec.includes)
+        objects += builder.add_sources([s for s in ext.sources if s not in specs])
+        if ext.extra_objects: objects.extend(ext.extra_objects)
+        builder.run()
+
+        ext_path = self.get_ext_fullpath(ext.name)
+        if not (self.force or newer_group(objects + ext.depends,ext_path,'newer')):
+            return
+        self.compiler.link_shared_object(
+            objects,ext_path,
+            libraries=self.get_libraries(ext),
+            library_dirs=ext.library_dirs,
+            runtime_library_dirs=ext.runtime_library_dirs,
+            extra_postargs=ext.extra_link_args or [],
+            export_symbols=self.get_export_symbols(ext),
+            debug=self.debug,
+            build_temp=self.build_temp,
+            target_lang='c++')
+
+
+def main(argv=None):
+    p = OptionParser(usage = "%prog build [options] spec-file...")
+    p.add_option("--gccxml",dest="gccxml",help="path to the gccxml executable",metavar="PATH")
+    p.add_option("-c","--compiler",dest="compiler",help="the compiler for gccxml to simulate",metavar="TYPE")
+    p.add_option("--cxxflags",dest="cxxflags",help="more CXXFLAGS passed to gccxml (the -I and -D options are passed to it already)",action="append",metavar="ARGS")
+    p.add_option("-I",dest="include_dirs",action="append",default=[],help="add DIR to the include path of gccxml and the compiler",metavar="DIR")
+    p.add_option("-D",dest="macros",action="append",default=[],help="define a macro for gccxml and the compiler",metavar="NAME[=VALUE]")
+    p.add_option("-L",dest="library_dirs",action="append",default=[],help="add DIR to the library path of the linker",metavar="DIR")
+    p.add_option("-l",dest="libraries",action="append",default=[],help="link with LIB",metavar="LIB")
+    p.add_option("--source",dest="sources",action="append",default=[],help="compile FILE and link it into every module",metavar="FILE")
+    p.add_option("-b","--build-dir",dest="build_dir",default="build",help="where to put the generated files and object files (default: %default)",metavar="DIR")
+    p.add_option("-o","--output-dir",dest="output_dir",default=".",help="where to put the extension modules (default: %default)",metavar="DIR")
+    p.add_option("-j","--jobs",dest="jobs",type="int",help="the number of compilers to run at once (default: the number of CPUs)",metavar="N")
+    p.add_option("--split-classes",dest="split",type="int",default=DEFAULT_SPLIT,help="put the code of every N classes in a separate source file (default: %default)",metavar="N")
+    p.add_option("--object-cache",dest="object_cache",help="cache object files in DIR and reuse them when the preprocessed source and the compiler's arguments are the same",metavar="DIR")
+    p.add_option("--cache-dir",dest="cache_dir",help="cache the output of gccxml in DIR",metavar="DIR")
+    p.add_option("--cache-size",dest="cache_size",type="int",default=DEFAULT_MAX_SIZE//(1024*1024),help="the maximum size of each cache in megabytes (default: %default)",metavar="MB")
+    p.add_option("--instrument",dest="instrument",action="store_true",default=False,help="build modules that count the calls of each overload (see the --instrument option of pyexpose)")
+    p.add_option("--call-profile",dest="call_profile",help="order the checks that choose an overload by the counts in FILE (see the --call-profile option of pyexpose)",metavar="FILE")
+    p.add_option("--no-pch",dest="pch",action="store_false",default=True,help="don't precompile the headers that every generated source includes")
+
+    options,args = p.parse_args(argv)
+
+    if not args:
+        p.error("at least 1 spec-file must be specified")
+    if options.split < 1:
+        p.error("--split-classes must be at least 1")
+    if options.jobs is not None and options.jobs < 1:
+        p.error("--jobs must be at least 1")
+
+    call_counts = None
+    if options.call_profile:
+        try:
+            call_counts = read_call_profile(options.call_profile)
+        except (IOError,ValueError) as e:
+            p.error("cannot read the call profile: {0}".format(e))
+
+    include_dirs = ['.'] + options.include_dirs
+    macros = [tuple(m.split('=',1)) if '=' in m else (m,None) for m in options.macros]
+    common = common_include_dir()
+    if common:
+        include_dirs.append(common)
+        macros.append(('LOCAL_PYEXPOSE_COMMON',None))
+
+    cc = ccompiler.new_compiler()
+    sysconfig.customize_compiler(cc)
+    cc.add_include_dir(sysconfig.get_python_inc())
+    plat_inc = sysconfig.get_python_inc(True)
+    if plat_inc not in cc.include_dirs: cc.add_include_dir(plat_inc)
+
+    flags = ccompiler.gen_preprocess_options(macros,include_dirs + cc.include_dirs)
+    if options.cxxflags: flags.extend(options.cxxflags)
+
+    builder = Builder(cc,options.build_dir,options.jobs,options.object_cache,options.cache_size*1024*1024,options.pch,include_dirs,macros)
+    try:
+        outputs = build_modules([getspec(a) for a in args],builder,options.output_dir,options.sources,options.libraries,options.library_dirs,options.split,
+            gccxml=options.gccxml,
+            compiler=options.compiler,
+            cxxflags=' '.join(flags),
+            cache_dir=options.cache_dir,
+            cache_size=options.cache_size*1024*1024,
+            instrument=options.instrument,
+            call_counts=call_counts)
+    except (CompileError,LinkError) as e:
+        print >> sys.stderr, e
+        return 1
+
+    for o in outputs: print 'built', o
+    print '{0} object file(s) compiled, {1} taken from the cache, {2} up to date'.format(builder.compiled,builder.cached,builder.current)
+    return 0
@@ -0,0 +1,254 @@
+"""On-disk caches for the output of GCCXML and of the compiler.
+
+ParseCache entries are keyed by everything that goes into a GCCXML invocation
+(the generated input file, the command line and the working directory) and are
+only considered valid while every header the input depends on still has the
+same content (see expose.header_dependencies). ObjectCache entries are keyed the same way by the preprocessed
+source and the command line of the compiler.
+
+"""
+
+import os
+import os.path
+import hashlib
+import shutil
+import tempfile
+import cPickle as pickle
+
+
+# increment this whenever the format of the cached data or the classes in
+# gccxml.py change in an incompatible way
+CACHE_VERSION = 2
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+ENTRY_SUFFIX = '.parsetree'
+OBJECT_SUFFIX = '.o'
+
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path,'rb') as f:
+        while True:
+            data = f.read(0x10000)
+            if not data: break
+            h.update(data)
+    return h.hexdigest()
+
+
+class DirectoryCache(object):
+    """A directory of files, named after their keys, that is kept under a
+    maximum size by deleting the least recently used files.
+
+    directory -- where to store the cache entries (created if needed)
+    max_size -- the total size in bytes that the entries may occupy before the
+        least recently used ones are deleted
+
+    """
+    suffix = None
+
+    def __init__(self,directory,max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self,gccinput,args):
+        """Compute the key of an invocation of GCCXML (or of the compiler).
+
+        gccinput -- the contents of the file passed to GCCXML (or the
+            preprocessed source passed to the compiler)
+        args -- the rest of the command line
+
+        """
+        h = hashlib.sha1(str(CACHE_VERSION))
+        for a in args:
+            h.update('\0')
+            h.update(a)
+        h.update('\0')
+        h.update(os.getcwd())
+        h.update('\0')
+        h.update(gccinput)
+        return h.hexdigest()
+
+    def entry_path(self,key):
+        return os.path.join(self.directory,key + self.suffix)
+
+    def touch(self,path):
+        try:
+            os.utime(path,None)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Delete the least recently used entries until the cache is no larger
+        than max_size."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix) or name.startswith('tmp'): continue
+            path = os.path.join(self.directory,name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime,st.st_size,path))
+            total += st.st_size
+
+        entries.sort()
+        for mtime,size,path in entries:
+            if total <= self.max_size: break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class ParseCache(DirectoryCache):
+    """A directory of pickled, unlinked GCCXML parse trees."""
+
+    suffix = ENTRY_SUFFIX
+
+    def get(self,key):
+        """Return the tuple previously stored under key, as returned by
+        gccxml.parse_tree, or None if there isn't one or any of the files it
+        depends on has changed."""
+        path = self.entry_path(key)
+        try:
+            f = open(path,'rb')
+        except IOError:
+            return None
+
+        with f:
+            try:
+                deps = pickle.load(f)
+                for dep,digest in deps:
+                    if file_digest(dep) != digest: return None
+
+                r = pickle.load(f)
+            except (IOError,EOFError,pickle.UnpicklingError):
+                return None
+
+        self.touch(path)
+        return r
+
+    def put(self,key,tree,exclude=()):
+        """Store the return value of gccxml.parse_tree under key.
+
+        Every file in tree that exists (except the ones in exclude) is treated
+        as a dependency of the entry.
+
+        """
+        exclude = set(os.path.abspath(e) for e in exclude)
+        deps = [(f,file_digest(f)) for f in tree[1]
+            if os.path.isfile(f) and os.path.abspath(f) not in exclude]
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        fd,tmpname = tempfile.mkstemp(ENTRY_SUFFIX,'tmp',self.directory)
+        try:
+            with os.fdopen(fd,'wb') as f:
+                pickle.dump(deps,f,2)
+                pickle.dump(tree,f,2)
+            os.rename(tmpname,self.entry_path(key))
+        except:
+            os.remove(tmpname)
+            raise
+
+        self.evict()
+
+
+class ObjectCache(DirectoryCache):
+    """A directory of object files (and precompiled headers) produced by the
+    compiler, like ccache."""
+
+    suffix = OBJECT_SUFFIX
+
+    def get(self,key,dest):
+        """Copy the file stored under key to dest and return True, or return
+        False if there isn't one."""
+        path = self.entry_path(key)
+        try:
+            shutil.copyfile(path,dest)
+        except IOError:
+            return False
+
+        self.touch(path)
+        return True
+
+    def put(self,key,src):
+        """Store a copy of the file src under key."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        fd,tmpname = tempfile.mkstemp(OBJECT_SUFFIX,'tmp',self.directory)
+        try:
+            os.close(fd)
+            shutil.copyfile(src,tmpname)
+            os.rename(tmpname,self.entry_path(key))
+        except:
+            os.remove(tmpname)
+            raise
+
+        self.evict()
+
+
+def file_stamp(path):
+    """Return the modification time and size of the file at path, or None if
+    it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime,st.st_size
+
+
+class MemoryCache(object):
+    """Linked parse trees kept in memory, for a process that generates the same
+    modules again and again (see watch.py).
+
+    max_entries -- the number of trees to keep. They can be large, so only the
+        most recently used ones are kept.
+
+    Unlike with ParseCache, the trees are stored after being linked, so a hit
+    skips gccxml.link_tree as well. An entry is only used while every file it
+    depends on has the same modification time and size.
+
+    """
+    def __init__(self,max_entries=2):
+        self.max_entries = max_entries
+        self.entries = [] # (key,scope,files,stamps,names) tuples, most recent last
+
+    def get(self,key,names=None):
+        """Return the tuple (scope,files) stored under key, or None.
+
+        names -- if not None, the tree was filtered (see
+            gccxml.reachable_items) and has to have kept at least these names
+
+        """
+        for i,e in enumerate(self.entries):
+            if e[0] == key:
+                filtered_enough = e[4] is None or (names is not None and names <= e[4])
+                if not filtered_enough or any(file_stamp(f) != s for f,s in e[3]):
+                    del self.entries[i]
+                    return None
+
+                self.entries.append(self.entries.pop(i))
+                return e[1],e[2]
+        return None
+
+    def put(self,key,scope,files,names=None,exclude=()):
+        """Store the root namespace scope, linked from a tree that was read
+        from the files in files and filtered by names (if not None).
+
+        Every file in files that exists (except the ones in exclude) is
+        treated as a dependency of the entry.
+
+        """
+        exclude = set(os.path.abspath(e) for e in exclude)
+        stamps = [(f,file_stamp(f)) for f in files
+            if os.path.isfile(f) and os.path.abspath(f) not in exclude]
+
+        self.entries = [e for e in self.entries if e[0] != key]
+        self.entries.append((key,scope,files,stamps,names and frozenset(names)))
+        del self.entries[:-self.max_entries]
@@ -4,6 +4,7 @@ import itertools
 
 from . import gccxml
 from . import espectmpl as tmpl
+from . import timing
 from .cpptypes import *
 from .err import SpecificationError
 
@@ -29,17 +30,77 @@ CHECK_LONG = 0b001
 
 # A table specifying what checks to make when matching a Python number to a specific C++ overload
 coercion = [
-    (None,             None,             None            ),
-    (None,             None,             'PyNumber_Check'),
-    (None,             'PyNumber_Check', None            ),
-    (None,             'PyInt_Check',    'PyNumber_Check'),
-    ('PyNumber_Check', None,             None            ),
-    ('PyFloat_Check',  None,             'PyNumber_Check'),
-    ('PyFloat_Check',  'PyNumber_Check', None            ),
-    ('PyFloat_Check',  'PyInt_Check',    'PyLong_Check'  )
+    (None,           None,           None          ),
+    (None,           None,           'number_check'),
+    (None,           'number_check', None          ),
+    (None,           'PyInt_Check',  'number_check'),
+    ('number_check', None,           None          ),
+    ('float_check',  None,           'number_check'),
+    ('float_check',  'number_check', None          ),
+    ('float_check',  'PyInt_Check',  'PyLong_Check')
 ]
 
 
+def tuple_item(i):
+    return 'PyTuple_GET_ITEM(args,{0})'.format(i)
+
+def read_call_profile(path):
+    """Read a file of call counts written by modules generated with
+    Conversion.instrument set to True and return a dict mapping the key of
+    each overload (see ArgBranchNode.profile_key) to the number of times it was
+    called. Every module appends its counts to the file when the process
+    exits, so the counts of the same overload are added together."""
+    counts = {}
+    with open(path) as f:
+        for n,line in enumerate(f):
+            parts = line.rstrip('\n').split(' ',1)
+            if len(parts) != 2 or not parts[0].isdigit():
+                raise ValueError('{0}:{1}: expected a count and the name of an overload'.format(path,n + 1))
+            counts[parts[1]] = counts.get(parts[1],0) + int(parts[0])
+    return counts
+
+def descendants(cdef):
+    r = set([cdef])
+    pending = [cdef]
+    while pending:
+        for d in pending.pop().derived:
+            if d not in r:
+                r.add(d)
+                pending.append(d)
+    return r
+
+def can_swap(a,b):
+    """Return True if no object can satisfy the conditions of both branch a and
+    branch b, so that their order doesn't matter."""
+    if a is None or b is None: return False
+    if a == 'exact' or b == 'exact':
+        # an exposed class can't be combined with a built-in type because of
+        # their instance layouts
+        return True
+
+    # classes involved in multiple inheritance share a layout, so a class
+    # defined in Python could derive from both
+    if any(c.multi_inherit or c.has_multi_inherit_subclass() for c in (a,b)): return False
+    return not (descendants(a) & descendants(b))
+
+def hottest_first(branches,counts):
+    """Reorder branches (as made by ArgBranchNode.write_basic_and_objects_code)
+    so that the ones leading to the most calls according to counts come
+    first, without moving a branch ahead of one whose condition could also be
+    true for the same object. Branches with the same count keep their
+    order."""
+    weight = lambda b: sum(counts.get(n.profile_key(),0) for n in b[1].call_nodes())
+
+    r = []
+    pending = list(branches)
+    while pending:
+        best = None
+        for i,b in enumerate(pending):
+            if all(can_swap(a[3],b[3]) for a in pending[:i]):
+                if best is None or weight(b) > weight(pending[best]): best = i
+        r.append(pending.pop(best))
+    return r
+
 class ArgBranchNode:
     def __init__(self):
         self.basic = dict.fromkeys(TYPES_LIST)
@@ -48,9 +109,19 @@ class ArgBranchNode:
         # an overloaded function is available if and only if self.call is not None
         self.call = None
 
+        # if not None, the call is recorded in an overload_cache named "cache"
+        # under this index
+        self.cache_index = None
+
     def child_nodes(self):
         return itertools.chain(filter(None,self.basic.itervalues()),(val for k,val in self.objects))
 
+    def call_nodes(self):
+        """Yield this node and every descendant node that calls a function."""
+        if self.call: yield self
+        for n in self.child_nodes():
+            for c in n.call_nodes(): yield c
+
     def min_arg_length(self):
         if self.call:
             return 0
@@ -88,7 +159,9 @@ class ArgBranchNode:
             otherobj = dict(b.objects)
             for k,val in self.objects:
                 val.merge(otherobj.pop(k,None))
-            self.objects.extend(otherobj.iteritems())
+
+            # keep the order of b.objects instead of the order of the dict
+            self.objects.extend(kv for kv in b.objects if kv[0] in otherobj)
 
         return self
 
@@ -104,17 +177,18 @@ class ArgBranchNode:
         self.objects.sort(key = (lambda x: base_count(strip_refptr(x[0]))),reverse = True)
         for n in self.child_nodes(): n.sort_objects()
 
-    def basic_and_objects_code(self,conv,argconv,skipsize,ind,get_arg,exactlenchecked = False):
-        r = ''
+    def write_basic_and_objects_code(self,out,conv,argconv,skipsize,ind,get_arg,exactlenchecked = False):
+        # Each branch is a tuple of a condition, a node, a cast and what the
+        # condition tests, for hottest_first. The condition tests an exposed
+        # class (by its ClassDef), an exact Python type ('exact'), or
+        # anything else (None).
+        branches = []
 
         # check for general classes
         if self.objects:
-            for t,branch in self.objects:
+            for t,node in self.objects:
                 check,cast = conv.check_and_cast(t)
-                r += '{0}if({1}) {{\n{2}{0}}}\n'.format(
-                    ind,
-                    check.format(get_arg(len(argconv))),
-                    branch.get_code(conv,argconv + [cast],skipsize,ind + 1,get_arg,exactlenchecked))
+                branches.append((check.format(get_arg(len(argconv))),node,cast,conv.cppclasstopy[strip_refptr(t)][0]))
 
 
         # check for numeric types
@@ -125,52 +199,78 @@ class ArgBranchNode:
         if nums:
             for c,t in zip(coercion[nums],[TYPE_FLOAT,TYPE_INT,TYPE_LONG]):
                 if c:
-                    r += '{0}if({2}({1})) {{\n{3}{0}}}\n'.format(
-                        ind,
-                        get_arg(len(argconv)),
-                        c,
-                        self.basic[t].get_code(conv,argconv + [None],skipsize,ind + 1,get_arg,exactlenchecked))
+                    branches.append((
+                        '{0}({1})'.format(c,get_arg(len(argconv))),
+                        self.basic[t],
+                        None,
+                        None if c == 'number_check' else 'exact'))
 
 
         # check for string types
         if self.basic[TYPE_UNICODE]:
-            r += '{0}if(PyUnicode_Check({1}){2}) {{\n{3}{0}}}\n'.format(
-                ind,
-                get_arg(len(argconv)),
-                '' if self.basic[TYPE_STR] else ' && PyString_Check(o)',
-                self.basic[TYPE_UNICODE].get_code(conv,argconv + [None],skipsize,ind + 1,get_arg,exactlenchecked))
+            branches.append((
+                'PyUnicode_Check({0}){1}'.format(
+                    get_arg(len(argconv)),
+                    '' if self.basic[TYPE_STR] else ' && PyString_Check(o)'),
+                self.basic[TYPE_UNICODE],
+                None,
+                'exact'))
 
         if self.basic[TYPE_STR]:
-            r += '{0}if(PyString_Check({1})) {{\n{2}{0}}}\n'.format(
-                ind,
-                get_arg(len(argconv)),
-                self.basic[TYPE_STR].get_code(conv,argconv + [None],skipsize,ind + 1,get_arg,exactlenchecked))
+            branches.append(('PyString_Check({0})'.format(get_arg(len(argconv))),self.basic[TYPE_STR],None,'exact'))
+
+        if conv.call_counts is not None:
+            branches = hottest_first(branches,conv.call_counts)
 
-        return r
+        for cond,node,cast,tests in branches:
+            out.line(ind,'if({0}) {{'.format(cond))
+            node.write_code(out,conv,argconv + [cast],skipsize,ind + 1,get_arg,exactlenchecked)
+            out.line(ind,'}')
+
+    def basic_and_objects_code(self,conv,argconv,skipsize,ind,get_arg,exactlenchecked = False):
+        out = tmpl.CodeBuffer()
+        self.write_basic_and_objects_code(out,conv,argconv,skipsize,ind,get_arg,exactlenchecked)
+        return out.getvalue()
+
+    def profile_key(self):
+        """Return the name of the overload this node calls in a call
+        profile."""
+        func,args = self.call
+        return '{0}({1})'.format(func.name,','.join(a.type.typestr() for a in args))
+
+    def write_count_code(self,out,conv,ind):
+        if conv.instrument and self.call[0].name:
+            out.line(ind,'PYEXPOSE_COUNT_CALL({0});'.format(tmpl.quote_c(self.profile_key())))
 
     def call_code(self,conv,argconv,ind,get_arg):
         func,args = self.call
 
-        r = ind.line(
-            func.output(((c or conv.frompy(a.type)[0]).format(get_arg(i)) for
-                i,a,c in zip(itertools.count(),args,argconv)),ind+1))
+        return func.output(((c or conv.frompy(a.type)[0]).format(get_arg(i)) for
+            i,a,c in zip(itertools.count(),args,argconv)),ind+1)
+
+    def write_call_code(self,out,conv,argconv,ind,get_arg):
+        if self.cache_index is not None:
+            # the casts are needed again to make the call when the cache has
+            # the index
+            self.cached_argconv = argconv
+            out.line(ind,'cache.add(args,{0});'.format(self.cache_index))
 
-        return r
+        self.write_count_code(out,conv,ind)
+        out.line(ind,self.call_code(conv,argconv,ind,get_arg))
 
-    def get_code(self,conv,argconv = [],skipsize = 0,ind = tmpl.Tab(2),get_arg = lambda x: 'PyTuple_GET_ITEM(args,{0})'.format(x),exactlenchecked = False):
+    def write_code(self,out,conv,argconv = [],skipsize = 0,ind = tmpl.Tab(2),get_arg = tuple_item,exactlenchecked = False):
         anychildnodes = any(self.basic.itervalues()) or self.objects
 
         assert anychildnodes or self.call
 
-        r = ''
         get_size = ind.line('if(PyTuple_GET_SIZE(args) {0} {1}) {{')
 
         if skipsize > 0:
             assert anychildnodes
 
-            r += self.basic_and_objects_code(conv,argconv,skipsize-1,ind,get_arg,exactlenchecked)
+            self.write_basic_and_objects_code(out,conv,argconv,skipsize-1,ind,get_arg,exactlenchecked)
             if self.call:
-                r += self.call_code(conv,argconv,ind,get_arg)
+                self.write_call_code(out,conv,argconv,ind,get_arg)
 
         elif anychildnodes:
             # if the exact length was tested, "skipsize" should cover the rest of the arguments
@@ -180,37 +280,42 @@ class ArgBranchNode:
             max_args = self.max_arg_length()
 
             if min_args == max_args:
-                r += get_size.format('==',len(argconv) + min_args)
+                out.write(get_size.format('==',len(argconv) + min_args))
                 ind += 1
 
-                r += self.basic_and_objects_code(conv,argconv,min_args - 1,ind,get_arg,True)
+                self.write_basic_and_objects_code(out,conv,argconv,min_args - 1,ind,get_arg,True)
                 if self.call:
-                    r += self.call_code(conv,argconv,ind,get_arg)
+                    self.write_call_code(out,conv,argconv,ind,get_arg)
 
                 ind -= 1
-                r += ind.line('}')
+                out.line(ind,'}')
             else:
-                r += get_size.format('>',len(argconv))
+                # the branches below don't check the length again for their
+                # first min_args - 1 arguments
+                out.write(get_size.format('>',len(argconv) + max(min_args - 1,0)))
 
-                r += self.basic_and_objects_code(conv,argconv,min_args - 1,ind + 1,get_arg)
+                self.write_basic_and_objects_code(out,conv,argconv,min_args - 1,ind + 1,get_arg)
 
                 if self.call:
-                    r += ind.line('} else {')
-                    r += self.call_code(conv,argconv,ind+1,get_arg)
+                    out.line(ind,'} else {')
+                    self.write_call_code(out,conv,argconv,ind+1,get_arg)
 
-                r += ind.line('}')
+                out.line(ind,'}')
 
         elif exactlenchecked:
             assert self.call
-            r += self.call_code(conv,argconv,ind,get_arg)
+            self.write_call_code(out,conv,argconv,ind,get_arg)
 
         else:
             assert self.call
-            r += get_size.format('==',len(argconv))
-            r += self.call_code(conv,argconv,ind + 1,get_arg)
-            r += ind.line('}')
+            out.write(get_size.format('==',len(argconv)))
+            self.write_call_code(out,conv,argconv,ind + 1,get_arg)
+            out.line(ind,'}')
 
-        return r
+    def get_code(self,*args,**kwds):
+        out = tmpl.CodeBuffer()
+        self.write_code(out,*args,**kwds)
+        return out.getvalue()
 
 
 
@@ -345,6 +450,14 @@ class Conversion:
 
         self.cppclasstopy = {}
 
+        # if True, the generated code counts the calls of each overload (see
+        # read_call_profile)
+        self.instrument = False
+
+        # if not None, a dict from the output of read_call_profile, used to
+        # check for the most frequently called overloads first
+        self.call_counts = None
+
         self.__gcvarhandlers = {
             self.pyobject : (tmpl.traverse_pyobject,tmpl.clear_pyobject)
         }
@@ -441,7 +554,7 @@ class Conversion:
         if (feature == RET_UNMANAGED_REF and not temporary) or (isinstance(t,(gccxml.CPPPointerType,gccxml.CPPReferenceType)) and not self.__topy_base(t)):
             retc = self.cppclasstopy.get(strip_cvq(strip_refptr(t)))
             if retc:
-                retc[0].features.add(feature)
+                retc[0].add_feature(feature)
                 return True
         return False
 
@@ -559,8 +672,10 @@ class Conversion:
 
         namesvar = '0'
         if use_kwds and any(a.name for a in args):
-            prep += indent.line('const char *names[] = {{{0}}};'.format(
+            # the names are interned the first time the function is called
+            prep += indent.line('static const char *const name_strs[] = {{{0}}};'.format(
                 ','.join(('"{0}"'.format(a.name) if a.name else '0') for a in args)))
+            prep += indent.line('static PyObject *const *const names = intern_names(name_strs,{0});'.format(len(args)))
             namesvar = 'names'
 
         if args:
@@ -613,8 +728,9 @@ class Conversion:
 
         return ['_{0}'.format(i) for i in range(len(args))], prep
 
-    def function_call(self,calls,errval='0',use_kwds=True,ind=tmpl.Tab(2)):
-        """Generate code to call one function from a list of overloads.
+    def write_function_call(self,out,calls,errval='0',use_kwds=True,ind=tmpl.Tab(2)):
+        """Generate code to call one function from a list of overloads and
+        write it to out (an instance of espectmpl.CodeBuffer).
 
         calls -- A sequence of tuples containing a function (Conversion.Func)
             and a list of arguments
@@ -639,35 +755,92 @@ class Conversion:
         assert calls
 
         if len(calls) == 1:
-            args,prep = self.arg_parser(calls[0][1],use_kwds)
-            return prep + tmpl.Tab(2).line(calls[0][0].output(args,tmpl.Tab(2)))
+            if calls[0][1]:
+                # when every argument is given by position, they are converted
+                # straight from the tuple's item array, bypassing get_arg
+                out.line(tmpl.Tab(2),'if({0}PyTuple_GET_SIZE(args) == {1}) {{'.format(
+                    '!kwds && ' if use_kwds else '',len(calls[0][1])))
+                out.line(tmpl.Tab(3),calls[0][0].output(
+                    [self.frompy(a.type)[0].format('PyTuple_GET_ITEM(args,{0})'.format(i))
+                        for i,a in enumerate(calls[0][1])],
+                    tmpl.Tab(3)))
+                out.line(tmpl.Tab(2),'}')
 
-        r = (self.function_call_fallthrough(calls,ind) +
-            tmpl.no_such_overload.format(args='args',errval=errval))
-        if use_kwds: r = tmpl.no_keywords_check + r
-        return r
-
-    def function_call_fallthrough(self,calls,ind=tmpl.Tab(2)):
+            args,prep = self.arg_parser(calls[0][1],use_kwds)
+            out.write(prep)
+            out.line(tmpl.Tab(2),calls[0][0].output(args,tmpl.Tab(2)))
+            return
+
+        if use_kwds: out.write(tmpl.no_keywords_check)
+        self.write_function_call_fallthrough(out,calls,ind)
+        out.write(tmpl.no_such_overload.format(args='args',errval=errval))
+
+    def function_call(self,*args,**kwds):
+        """Same as write_function_call except the code is returned as a
+        string."""
+        out = tmpl.CodeBuffer()
+        self.write_function_call(out,*args,**kwds)
+        return out.getvalue()
+
+    def write_function_call_fallthrough(self,out,calls,ind=tmpl.Tab(2)):
         # turn default values into overloads
         ovlds = []
         for f,args in calls:
             ovlds.extend((f,newargs) for newargs in default_to_ov(args))
 
-        return self.generate_arg_tree(ovlds).get_code(self,ind=ind)
+        tree = self.generate_arg_tree(ovlds)
+        nodes = list(tree.call_nodes())
+        if len(nodes) < 2:
+            tree.write_code(out,self,ind=ind)
+            return
+
+        # The overload chosen for each combination of argument types is
+        # remembered, so that for a combination seen before, the checks of the
+        # tree are replaced by comparing the types.
+        for i,n in enumerate(nodes): n.cache_index = i
+        treecode = tree.get_code(self,ind=ind+1)
+
+        out.line(ind,'{')
+        out.line(ind+1,'static overload_cache<{0}> cache;'.format(tree.max_arg_length()))
+        out.line(ind+1,'switch(cache.find(args)) {')
+        for n in nodes:
+            out.line(ind+1,'case {0}:'.format(n.cache_index))
+            n.write_count_code(out,self,ind+2)
+            out.line(ind+2,n.call_code(self,n.cached_argconv,ind+2,tuple_item))
+        out.line(ind+1,'}')
+        out.write(treecode)
+        out.line(ind,'}')
 
-    def function_call_narg_fallthrough(self,calls,vars,ind=tmpl.Tab(2)):
+    def function_call_fallthrough(self,calls,ind=tmpl.Tab(2)):
+        out = tmpl.CodeBuffer()
+        self.write_function_call_fallthrough(out,calls,ind)
+        return out.getvalue()
+
+    def write_function_call_narg_fallthrough(self,out,calls,vars,ind=tmpl.Tab(2)):
         assert calls
-        return self.generate_arg_tree(calls).basic_and_objects_code(
-            self,[],len(vars)-1,ind,lambda x: vars[x],True)
+        self.generate_arg_tree(calls).write_basic_and_objects_code(
+            out,self,[],len(vars)-1,ind,lambda x: vars[x],True)
 
-    def function_call_narg(self,calls,vars,errval='0',ind=tmpl.Tab(2)):
+    def function_call_narg_fallthrough(self,calls,vars,ind=tmpl.Tab(2)):
+        out = tmpl.CodeBuffer()
+        self.write_function_call_narg_fallthrough(out,calls,vars,ind)
+        return out.getvalue()
+
+    def write_function_call_narg(self,out,calls,vars,errval='0',ind=tmpl.Tab(2)):
         if len(calls) == 1:
-            return ind + calls[0][0].output(
+            out.write(str(ind))
+            out.write(calls[0][0].output(
                 [self.frompy(a.type)[0].format(v) for a,v in zip(calls[0][1],vars)],
-                ind)
+                ind))
+            return
+
+        self.write_function_call_narg_fallthrough(out,calls,vars,ind)
+        out.write(tmpl.no_such_overload.format(args=','.join(vars),errval=errval))
 
-        return (self.function_call_narg_fallthrough(calls,vars,ind) +
-            tmpl.no_such_overload.format(args=','.join(vars),errval=errval))
+    def function_call_narg(self,calls,vars,errval='0',ind=tmpl.Tab(2)):
+        out = tmpl.CodeBuffer()
+        self.write_function_call_narg(out,calls,vars,errval,ind)
+        return out.getvalue()
 
     def add_conv(self,t,to=None,from_=None):
         if to: self.__topy[t] = to
@@ -681,8 +854,9 @@ class Conversion:
         return (t in s) or isinstance(t,(gccxml.CPPPointerType,gccxml.CPPReferenceType)) and (strip_cvq(t.type) in s)
 
     def generate_arg_tree(self,calls):
-        tree = self._generate_arg_tree([(x[1],x) for x in calls])
-        tree.sort_objects()
+        with timing.phase('overload trees'):
+            tree = self._generate_arg_tree([(x[1],x) for x in calls])
+            tree.sort_objects()
         return tree
 
     def _generate_arg_tree(self,argss):
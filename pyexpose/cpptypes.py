@@ -5,11 +5,11 @@ import operator
 import copy
 
 from . import gccxml
-from .err import SpecificationError
+from .err import SpecificationError, SymbolNotFoundError
 
 __all__ = ('RET_MANAGED_REF','RET_MANAGED_PTR','RET_UNMANAGED_REF','RET_COPY',
            'RET_SELF','mandatory_args','compatible_args','accepts_args',
-           'always_true','BaseMembers','base_count','cconst','cptr','strip_cvq',
+           'always_true','BaseMembers','BaseCacheItem','base_count','cconst','cptr','strip_cvq',
            'strip_refptr','is_const','can_throw','default_to_ov','real_type')
 
 
@@ -87,8 +87,30 @@ gccxml.CPPClass.getDestructor = getDestructor
 def always_true(x):
     return True
 
+def member_index(x):
+    """Return a dict that maps names to lists of the direct members of x (a
+    namespace, class or union) with those names.
+
+    The dict is created on first use and kept, so members must not be added
+    to x afterwards. The members of classes are indexed by the names of
+    real_type(member), which is what inherited_member_lookup compares against.
+
+    """
+    try:
+        return x.member_index
+    except AttributeError:
+        index = {}
+        if isinstance(x,gccxml.CPPClass):
+            for m in x.members:
+                index.setdefault(getattr(real_type(m),"canon_name",None),[]).append(m)
+        else:
+            for m in x.members:
+                index.setdefault(getattr(m,"canon_name",None),[]).append(m)
+        x.member_index = index
+        return index
+
 def simple_member_lookup(x,name,test = always_true):
-    return (real_type(m) for m in x.members if getattr(m,"canon_name",None) == name and test(m))
+    return (real_type(m) for m in member_index(x).get(name,()) if test(m))
 
 def min_access(m,min_access):
     if getattr(m,'access',sys.maxint) >= min_access:
@@ -163,10 +185,30 @@ class BaseMembers(object):
 
 
 def inherited_member_lookup(c,name,test = always_true,access = gccxml.ACCESS_PUBLIC):
-    """Look up a class member name the same way C++ does"""
+    """Look up a class member name the same way C++ does.
+
+    When test is always_true, the result is remembered by c for the given name
+    and access.
+
+    """
+    if test is always_true:
+        try:
+            cache = c.lookup_cache
+        except AttributeError:
+            cache = c.lookup_cache = {}
+
+        r = cache.get((name,access))
+        if r is None:
+            r = _inherited_member_lookup(c,name,test,access)
+            cache[(name,access)] = r
+        return r[:]
 
+    return _inherited_member_lookup(c,name,test,access)
+
+def _inherited_member_lookup(c,name,test,access):
     def generate(bm):
-        return list(m for m in bm.members() if getattr(m,"canon_name",None) == name and test(m)) or \
+        members = (min_access(real_type(m),bm.access) for m in member_index(bm.c).get(name,()))
+        return list(m for m in members if getattr(m,"canon_name",None) == name and test(m)) or \
             bm.just_base_members()
 
     return BaseMembers(c,generate,access)()
@@ -190,10 +232,29 @@ def _namespace_find(self,x,test):
     return []
 
 def raise_not_found_error(x):
-    raise SpecificationError('could not find "{0}"'.format(x))
+    raise SymbolNotFoundError(x)
 
 def namespace_find(self,x,test = always_true):
-    """Find symbol x in this object's scope"""
+    """Find symbol x in this object's scope.
+
+    When test is always_true, the result is remembered by this object.
+
+    """
+    if test is always_true:
+        try:
+            cache = self.find_cache
+        except AttributeError:
+            cache = self.find_cache = {}
+
+        r = cache.get(x)
+        if r is None:
+            r = _namespace_find_outer(self,x,test)
+            cache[x] = r
+        return r[:]
+
+    return _namespace_find_outer(self,x,test)
+
+def _namespace_find_outer(self,x,test):
     if x.startswith('::'): # explicit global namespace
         while self.context: self = self.context
         r = _namespace_find(self,x[2:],test)
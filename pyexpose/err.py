@@ -1,7 +1,7 @@
 import sys
 
 
-__all__ = 'Error','SpecificationError','WARN_ERROR','WARN_NORMAL','WARN_MINOR','emit_warning'
+__all__ = 'Error','SpecificationError','SymbolNotFoundError','WARN_ERROR','WARN_NORMAL','WARN_MINOR','emit_warning'
 
 
 class Error(Exception):
@@ -25,6 +25,20 @@ class SpecificationError(Error):
         return 'Specification Error: ' + super(SpecificationError,self).__str__()
 
 
+class SymbolNotFoundError(SpecificationError):
+    """A C++ symbol referred to by the spec could not be found.
+
+    The symbol is available as the attribute "symbol".
+
+    """
+    def __init__(self,symbol,info=None):
+        super(SymbolNotFoundError,self).__init__('could not find "{0}"'.format(symbol),info)
+        self.symbol = symbol
+
+    def __reduce__(self):
+        return SymbolNotFoundError,(self.symbol,self.info)
+
+
 WARN_ERROR = 3 # it's wrong but we can still generate the code
 WARN_NORMAL = 2 # probably a mistake
 WARN_MINOR = 1 # could be a mistake
@@ -3,28 +3,34 @@ from future_builtins import filter, map, zip
 
 
 import re
+import errno
 import itertools
+import os
 import os.path
 import copy
+import multiprocessing
 import sys
 import textwrap
 import functools
 import operator
+from cStringIO import StringIO
 
 from .xmlparse import *
 from .err import *
 from . import gccxml
 from . import espectmpl as tmpl
+from . import timing
 from .cpptypes import *
 from .conversion import Conversion
+from .outfile import OutputFile
 
 
 TEST_NS = "___gccxml_types_test_ns___"
 UNINITIALIZED_ERR_TYPE = "PyExc_RuntimeError"
 
-tmpl.env.globals['MANAGED_REF'] = RET_MANAGED_REF
-tmpl.env.globals['MANAGED_PTR'] = RET_MANAGED_PTR
-tmpl.env.globals['UNMANAGED_REF'] = RET_UNMANAGED_REF
+tmpl.env_globals['MANAGED_REF'] = RET_MANAGED_REF
+tmpl.env_globals['MANAGED_PTR'] = RET_MANAGED_PTR
+tmpl.env_globals['UNMANAGED_REF'] = RET_UNMANAGED_REF
 
 GETTER = 1
 SETTER = 2
@@ -69,6 +75,22 @@ def get_unique_num():
     return get_unique_num.nextnum
 get_unique_num.nextnum = 0
 
+def reset_unique_num():
+    """Make get_unique_num start over, so that reading the same spec again
+    produces the same input for GCCXML. Specs read before calling this must not
+    be used together with specs read afterwards."""
+    get_unique_num.nextnum = 0
+
+
+def by_name(d):
+    """Return the values of the dictionary d ordered by their keys.
+
+    The generated code must not depend on the order of a dictionary, which can
+    change from one run to the next.
+
+    """
+    return [d[k] for k in sorted(d)]
+
 
 
 def varargs(x):
@@ -118,10 +140,11 @@ class MultiInheritNode:
             other = self.main_type.name)
         return r
 
-    def downcast_func(self):
+    def downcast_func(self,declared=False):
         r = tmpl.typecheck_start.render(
             name = self.main_type.name,
-            type = self.main_type.type.canon_name)
+            type = self.main_type.type.canon_name,
+            declared = declared)
 
         for d in self.derived_nodes:
             r += d.output(self)
@@ -134,14 +157,17 @@ class MultiInheritNode:
 
 
 class Output:
-    def __init__(self,code,header,conv):
+    def __init__(self,code,header,conv,split=False):
         self.cpp = code
         self.h = header
         self.conv = conv
 
+        # whether the code is spread across more than one source file
+        self.split = split
+
 
 class Overload:
-    def __init__(self,func=None,retsemantic=None,args=None,static=False,arity=None,assign=False,bridge_virt=True,binds=None,raw=False):
+    def __init__(self,func=None,retsemantic=None,args=None,static=False,arity=None,assign=False,bridge_virt=True,binds=None,raw=False,keywords=True):
         self.func = func
         self.retsemantic = retsemantic
         self.args = args
@@ -152,6 +178,7 @@ class Overload:
         self.binds = binds or {}
         self.uniquenum = get_unique_num()
         self.raw = raw
+        self.keywords = keywords
 
     def gccxml_input(self,outfile):
         if self.args:
@@ -182,6 +209,9 @@ class CallCode(object):
         self.binds = binds or []
         self.divided = divided
 
+        # the name of the function, for call profiles (see overload_calls)
+        self.name = None
+
     def output(self,args,ind):
         args = list(args)
         for i,val in self.binds:
@@ -195,6 +225,7 @@ class CallCode(object):
 class PureVirtualCallCode(object):
     def __init__(self,errval):
         self.errval = errval
+        self.name = None
 
     def output(self,args,ind):
         return '{0}PyErr_SetString(PyExc_NotImplementedError,not_implemented_msg);\n{0}return {1};'.format(ind,self.errval)
@@ -217,6 +248,7 @@ class TypedOverload:
         self._returns = None
         self.assign = overload and overload.assign
         self.raw = overload and overload.raw
+        self.keywords = overload.keywords if overload else True
 
         if overload:
             for i,b in overload.binds.items():
@@ -321,8 +353,19 @@ def check_callable(items):
     return items
 
 
+def overload_calls(conv,overloads,make_cc):
+    """Return a list of (CallCode,args) tuples, one for each overload, for the
+    methods of Conversion. Each CallCode is named after the function it
+    calls."""
+    r = []
+    for ov in overloads:
+        cc = make_cc(conv,ov)
+        cc.name = ov.func.full_name
+        r.append((cc,ov.args))
+    return r
+
 def function_call_var_args(conv,overloads,raw_overload,make_cc,use_kwds,errval='0'):
-    argss = [(make_cc(conv,ov),ov.args) for ov in overloads]
+    argss = overload_calls(conv,overloads,make_cc)
     if raw_overload:
         ind = tmpl.Tab(2)
         vars = ['args']
@@ -334,19 +377,19 @@ def function_call_var_args(conv,overloads,raw_overload,make_cc,use_kwds,errval='
             # be updated
             assert mandatory_args(raw_overload) <= 2 <= len(raw_overload.args)
 
-        r = make_cc(conv,raw_overload).output(vars,ind)
+        out = tmpl.CodeBuffer()
         if argss:
             if use_kwds:
-                r = (ind.line('if(!(kwds && PyDict_Size(kwds))) {') +
-                     conv.function_call_fallthrough(argss,ind+1) +
-                     ind.line('}') + r)
+                out.line(ind,'if(!(kwds && PyDict_Size(kwds))) {')
+                conv.write_function_call_fallthrough(out,argss,ind+1)
+                out.line(ind,'}')
             else:
-                r = conv.function_call_fallthrough(argss,ind) + r
-    else:
-        assert overloads
-        r = conv.function_call(argss,errval,use_kwds)
+                conv.write_function_call_fallthrough(out,argss,ind)
+        out.write(make_cc(conv,raw_overload).output(vars,ind))
+        return out.getvalue()
 
-    return r
+    assert overloads
+    return conv.function_call(argss,errval,use_kwds)
 
 
 class TypedDefDef(object):
@@ -404,7 +447,7 @@ class TypedDefDef(object):
         return cc
 
     def make_argss(self,conv):
-        return [(self.call_code(conv,ov),ov.args) for ov in self.overloads]
+        return overload_calls(conv,self.overloads,self.call_code)
 
     def function_call_var_args(self,conv,use_kwds,errval='0'):
         return function_call_var_args(
@@ -426,15 +469,16 @@ class TypedDefDef(object):
         return self.function_call_narg_fallthrough(conv,[var],ind)
 
     def function_call_narg(self,conv,vars,ind=tmpl.Tab(2),errval='0'):
+        out = tmpl.CodeBuffer()
         if self.raw_overload:
-            r = self.call_code(conv,self.raw_overload).output(vars,ind)
             if self.overloads:
-                r = conv.function_call_narg_fallthrough(self.make_argss(conv),vars,ind) + r
+                conv.write_function_call_narg_fallthrough(out,self.make_argss(conv),vars,ind)
+            out.write(self.call_code(conv,self.raw_overload).output(vars,ind))
         else:
             assert self.overloads
-            r = conv.function_call_narg(self.make_argss(conv),vars,errval,ind)
+            conv.write_function_call_narg(out,self.make_argss(conv),vars,errval,ind)
 
-        return r
+        return out.getvalue()
 
     def function_call_narg_fallthrough(self,conv,vars,ind=tmpl.Tab(2)):
         assert self.raw_overload is None
@@ -449,6 +493,12 @@ class TypedDefDef(object):
                 self.overloads[0] if self.overloads else self.raw_overload
             ).output([],ind))
 
+    def named_args(self):
+        """Return True if the arguments can be given by name, which requires
+        METH_KEYWORDS."""
+        return (len(self.overloads) == 1 and self.overloads[0].keywords and
+            any(a.name for a in self.overloads[0].args))
+
     @append_except
     def _output(self,conv,prolog,type_extra,need_self,funcnameprefix):
         raw_args = None
@@ -471,12 +521,12 @@ class TypedDefDef(object):
             type = 'METH_NOARGS'
             funcargs = ',PyObject *'
             code = self.function_call_0arg(conv)
-        elif raw_args is None and maxargs == 1 and minargs == 1 and not self.overloads[0].args[0].name:
+        elif raw_args is None and maxargs == 1 and minargs == 1 and not (
+                self.overloads[0].keywords and self.overloads[0].args[0].name):
             type = 'METH_O'
             funcargs = ',PyObject *arg'
             code = self.function_call_1arg(conv)
-        elif raw_args == 2 or (len(self.overloads) == 1 and
-                    any(a.name for a in self.overloads[0].args)): # is there a named argument?
+        elif raw_args == 2 or self.named_args():
             type = 'METH_VARARGS|METH_KEYWORDS'
             funcargs = ',PyObject *args,PyObject *kwds'
             code = self.function_call_var_args(conv,True)
@@ -541,6 +591,10 @@ class TypedMethodDef(TypedDefDef):
     what = 'method'
     selfvar = 'reinterpret_cast<PyObject*>(self)'
 
+    # True for the copies that re-expose a method of a base class in a derived
+    # class (see ModuleDef.analyze)
+    inherited = False
+
     def __init__(self,classdef,defdef,tns):
         super(TypedMethodDef,self).__init__(classdef.type,defdef,tns)
         self.classdef = classdef
@@ -1028,7 +1082,7 @@ class MethodDict(object):
         return self.data.get(MethodDict.aliases.get(key,key),default)
 
     def itervalues(self):
-        return self.data.itervalues()
+        return iter(by_name(self.data))
 
 
 class _NoInit:
@@ -1245,6 +1299,20 @@ def qf_handle(fields,target,handle):
 
 
 def qualified_fields(c,classdefs):
+    # The fields of exposed base classes are taken from their TypedClassDef
+    # instances, so put them in the cache to keep BaseMembers from computing
+    # them again.
+    cache = {}
+    pending = [b.type for b in c.bases]
+    while pending:
+        t = pending.pop()
+        if t in cache: continue
+        typed = classdefs.get(t)
+        if typed:
+            cache[t] = BaseCacheItem(False,typed[0].gc_fields)
+        else:
+            pending.extend(b.type for b in t.bases)
+
     def generate(bm):
         fields = list(QualifiedFieldHandling(m.canon_name,m.type,m.access,m.offset) for m in bm.members() if isinstance(m,gccxml.CPPField) and not m.static)
         for b,subfields in bm.base_members():
@@ -1256,7 +1324,7 @@ def qualified_fields(c,classdefs):
             fields.extend(m.derived(b.type.name,b.offset,typed) for m in subfields)
         return sorted(fields,key=(lambda x: x.offset))
 
-    return BaseMembers(c,generate)()
+    return BaseMembers(c,generate,cache=cache)()
 
 
 BinaryIOpMethod = functools.partial(SpecialMethod,argtype=SF_ONE_ARG,defretsemantic=RET_SELF)
@@ -1400,12 +1468,15 @@ class TypedClassDef:
         if '__new__' in classdef.methods.data:
             raise SpecificationError('__new__ cannot be defined using <def>. Use <new>.')
 
+        # copy the methods so the spec can be used again
+        methods = classdef.methods.data.copy()
+
         self.special_methods = {}
         for key,mtype in special_method_forms:
-            m = classdef.methods.data.pop(key,None)
+            m = methods.pop(key,None)
             if m: self.special_methods[key] = mtype(self,m,tns)
 
-        self.methods = [TypedMethodDef(self,dd,tns) for dd in classdef.methods.data.itervalues()]
+        self.methods = [TypedMethodDef(self,dd,tns) for dd in by_name(methods)]
 
         self.properties = [TypedPropertyDef(self,pd,tns) for pd in classdef.properties]
         self.vars = [TypedMemberDef(self,mdef) for mdef in classdef.vars]
@@ -1423,7 +1494,13 @@ class TypedClassDef:
 
         self.gc_fields = None # this is computed later
 
+        # these are computed by analyze_hierarchy
+        self._basecount = None
+        self._multi_inherit_subclass = None
+        self._indirect_features = None
+
     def basecount(self):
+        if self._basecount is not None: return self._basecount
         return sum(1 + b.basecount() for b in self.bases)
 
     @property
@@ -1439,6 +1516,7 @@ class TypedClassDef:
         return len(self.bases) == 1 and self.bases[0].dynamic
 
     def has_multi_inherit_subclass(self):
+        if self._multi_inherit_subclass is not None: return self._multi_inherit_subclass
         return any(c.multi_inherit or c.has_multi_inherit_subclass() for c in self.derived)
 
     def variable_storage(self):
@@ -1491,7 +1569,7 @@ class TypedClassDef:
             features = self.indirect_features(),
             mode_var = self.needs_mode_var)
 
-    def get_base_func(self,module):
+    def get_base_func(self,module,declared=False):
         """Generate the get_base_X(PyObject o) function.
 
         This function checks if the supplied object is the correct type and
@@ -1500,9 +1578,12 @@ class TypedClassDef:
         wrapped type is one of the derived types and casts to it first, to allow
         the proper pointer fix-up to happen.
 
+        If declared is true, the function has already been declared in the
+        header (with its default arguments).
+
         """
         if self.has_multi_inherit_subclass():
-            return self.heirarchy_chain().downcast_func()
+            return self.heirarchy_chain().downcast_func(declared)
         else:
             return tmpl.get_base.format(
                 type = self.type.typestr(),
@@ -1747,29 +1828,41 @@ class TypedClassDef:
 
     def indirect_features(self):
         """returns a union of features for this class and all derived classes"""
+        if self._indirect_features is not None: return self._indirect_features
         return reduce(set.union,(d.indirect_features() for d in self.derived),self.features)
 
+    def add_feature(self,feature):
+        """Add feature to self.features.
+
+        This must be used instead of modifying self.features directly, after
+        analyze_hierarchy is called.
+
+        """
+        self.features.add(feature)
+        if self._indirect_features is not None:
+            pending = [self]
+            while pending:
+                c = pending.pop()
+                if feature not in c._indirect_features:
+                    c._indirect_features.add(feature)
+                    pending.extend(c.bases)
+
     def use_gc(self):
         return self._use_gc and self.can_exist()
 
-    def gc_code(self,out):
-        """Generate the garbage collection code if needed.
+    def find_gc_fields(self,conv):
+        """Populate self.gc_fields, which gc_code and the gc_code of every
+        derived class need.
 
-        This function also populates self.gc_fields which is needed by all
-        derived classes.
+        This must be called for the base classes first.
 
         """
-        use_t = False
-        use_c = False
-
-        gc_vars = []
         self.gc_fields = []
 
         if self.use_gc():
-            self.gc_fields = qualified_fields(self.type,out.conv.cppclasstopy)
+            self.gc_fields = qualified_fields(self.type,conv.cppclasstopy)
 
-            if out.conv.gcvarhandler(self.type):
-                gc_vars.append(('base',self.type))
+            if conv.gcvarhandler(self.type):
                 if self.gc_include:
                     emit_warning(WARN_NORMAL,'gc-include is ignored because <gc-handler> is defined for this type')
                 if self.gc_ignore:
@@ -1782,37 +1875,63 @@ class TypedClassDef:
             else:
                 for f in self.gc_include: qf_handle(self.gc_fields,True,f)
                 for f in self.gc_ignore: qf_handle(self.gc_fields,False,f)
-  
-                for f in recursive_qf_fields(self.gc_fields):
-                    if f.base_handler:
-                        gc_vars.append(('static_cast<{0}&>(base)'.format(f.base_handler.type.type_str()),f.base_handler.type))
-                    if f.handle_gc == GC_INCLUDE:
-                        if not conv.gcvarhandler(f.type):
-                            raise SpecificationError('There is no rule specifying how to garbage-collect an instance of "{0}". Please add one using <gc-handler>.'.format(f.type))
-                        if any(sub_f.handle_gc == GC_INCLUDE for sub_f in recursive_qf_fields(f.components)):
-                            emit_warning(WARN_NORMAL,'both "{0}" and one of its fields/items ("{1}") are marked as requiring garbage collection'.format(f.name,sub_f.name))
-                        #if f.access != gccxml.ACCESS_PUBLIC:
-                        #    raise SpecificationError('"{0}" cannot be accessed for garbage collection because it is not public')
+
+    def gc_vars(self,conv):
+        """Return a list of (expression,type) tuples of the parts of the C++
+        object that the traverse and clear functions have to visit.
+
+        find_gc_fields must be called first.
+
+        """
+        if not self.use_gc(): return []
+
+        gc_vars = []
+        if conv.gcvarhandler(self.type):
+            gc_vars.append(('base',self.type))
+        else:
+            for f in recursive_qf_fields(self.gc_fields):
+                if f.base_handler:
+                    gc_vars.append(('static_cast<{0}&>(base)'.format(f.base_handler.type.type_str()),f.base_handler.type))
+                if f.handle_gc == GC_INCLUDE:
+                    if not conv.gcvarhandler(f.type):
+                        raise SpecificationError('There is no rule specifying how to garbage-collect an instance of "{0}". Please add one using <gc-handler>.'.format(f.type))
+                    if any(sub_f.handle_gc == GC_INCLUDE for sub_f in recursive_qf_fields(f.components)):
+                        emit_warning(WARN_NORMAL,'both "{0}" and one of its fields/items ("{1}") are marked as requiring garbage collection'.format(f.name,sub_f.name))
+                    #if f.access != gccxml.ACCESS_PUBLIC:
+                    #    raise SpecificationError('"{0}" cannot be accessed for garbage collection because it is not public')
+                    gc_vars.append(('base.'+f.name,f.type))
+                elif f.handle_gc == GC_FUNCTION:
+                    base_handlers.add(f.base_handler)
+                elif (not f.handle_gc) and conv.gcvarhandler(f.type):
+                    # Members that are not explicitly accepted or rejected
+                    # are accepted if they are public.
+
+                    # We don't have to worry about this being a sub-field of
+                    # an accepted field because sub-fields are only added
+                    # when specified explicitly (ie: bool(f.handle_gc) is
+                    # True).
+                    if f.access == gccxml.ACCESS_PUBLIC:
                         gc_vars.append(('base.'+f.name,f.type))
-                    elif f.handle_gc == GC_FUNCTION:
-                        base_handlers.add(f.base_handler)
-                    elif (not f.handle_gc) and out.conv.gcvarhandler(f.type):
-                        # Members that are not explicitly accepted or rejected
-                        # are accepted if they are public.
-
-                        # We don't have to worry about this being a sub-field of
-                        # an accepted field because sub-fields are only added
-                        # when specified explicitly (ie: bool(f.handle_gc) is
-                        # True).
-                        if f.access == gccxml.ACCESS_PUBLIC:
-                            gc_vars.append(('base.'+f.name,f.type))
-                        # this doesn't work because of the way members are compared
-                        #else:
-                        #    emit_warning(WARN_MINOR,
-                        #        ('"{0}" may need garbage collection but cannot be '+
-                        #        'accessed because it is not public. Add "{0}" to ' +
-                        #        'gc-ignore to prevent this warning.').format(f.name))
+                    # this doesn't work because of the way members are compared
+                    #else:
+                    #    emit_warning(WARN_MINOR,
+                    #        ('"{0}" may need garbage collection but cannot be '+
+                    #        'accessed because it is not public. Add "{0}" to ' +
+                    #        'gc-ignore to prevent this warning.').format(f.name))
+
+        return gc_vars
+
+    def gc_code(self,out):
+        """Generate the garbage collection code if needed.
 
+        find_gc_fields must be called first.
+
+        """
+        use_t = False
+        use_c = False
+
+        if self.use_gc():
+            gc_vars = self.gc_vars(out.conv)
 
             if self._instance_dict or gc_vars:
                 t_body = ''
@@ -1943,7 +2062,8 @@ class TypedClassDef:
             instance_dict = self.instance_dict(),
             weakref = self.weakref(),
             mode_var = self.needs_mode_var,
-            gc = gc),
+            gc = gc,
+            split = out.split),
 
         if virtmethods:
             print >> out.h, tmpl.subclass_meth.render(name=self.name)
@@ -1977,9 +2097,11 @@ class TypedClassDef:
 
         methodsref = False
         if self.methods:
-            tentries,bodies = zip(*[m.output(out.conv) for m in self.methods])
-            for b in bodies:
-                print >> out.cpp, b,
+            tentries = []
+            for m in self.methods:
+                tentry,body = m.output(out.conv)
+                out.cpp.write(body)
+                tentries.append(tentry)
 
             print >> out.cpp, tmpl.method_table.format(
                 name = self.name,
@@ -2004,8 +2126,8 @@ class TypedClassDef:
                         type = self.type.typestr(),
                         args = forwarding_args(m.args),
                         argvals = forwarding_arg_vals(m.args),
-                        pyargvals = ''.join(out.conv.topy(a.type).format('_{0}'.format(i)) + ',' for i,a in enumerate(m.args)),
-                        retfrompy = frompy and frompy.format('ret'),
+                        pyargs = [out.conv.topy(a.type).format('_{0}'.format(i)) for i,a in enumerate(m.args)],
+                        retfrompy = frompy and frompy.format('ret.ptr'),
                         rettype = rettype and rettype.typestr())
                 except Error as e:
                     e.info['method'] = d.name
@@ -2036,9 +2158,36 @@ class TypedClassDef:
             instance_dict = self.instance_dict(),
             weakref = self.weakref(),
             gc = gc,
-            gc_clear = clear),
+            gc_clear = clear,
+            split = out.split),
+
 
 
+def analyze_hierarchy(classes):
+    """Compute the properties of each TypedClassDef in classes that depend on
+    its base and derived classes.
+
+    This must be called after findbases. Afterwards, basecount,
+    has_multi_inherit_subclass and indirect_features return the stored values
+    and add_feature keeps indirect_features up to date.
+
+    """
+    # order the classes so that each comes after its bases
+    remaining = dict((c,len(c.bases)) for c in classes)
+    order = [c for c,n in remaining.iteritems() if n == 0]
+    for c in order:
+        for d in c.derived:
+            remaining[d] -= 1
+            if remaining[d] == 0: order.append(d)
+    assert len(order) == len(classes)
+
+    for c in order:
+        c._basecount = sum(1 + b._basecount for b in c.bases)
+
+    for c in reversed(order):
+        c._multi_inherit_subclass = any(d.multi_inherit or d._multi_inherit_subclass for d in c.derived)
+        c._indirect_features = reduce(set.union,(d._indirect_features for d in c.derived),set(c.features))
+
 
 def methods_that_return(c):
     return itertools.chain(((m.name,m) for m in c.methods),((p.name,p.get) for p in c.properties if p.get))
@@ -2096,6 +2245,111 @@ def unambiguous_func(scope,name):
     return f[0]
 
 
+def chunk_ranges(count,size):
+    """Divide range(count) into consecutive (start,stop) pairs of at most size
+    items."""
+    return [(i,min(i + size,count)) for i in range(0,count,size)]
+
+
+# modules with fewer classes than this are always rendered in one process,
+# because starting the other processes would take longer
+PARALLEL_MIN_CLASSES = 32
+
+def output_class(c,out,module):
+    c.output(out,module)
+
+    # A print statement with a trailing comma makes the next one start with a
+    # space. Every class starts without one, so that classes rendered by
+    # different processes fit together the same way.
+    out.cpp.softspace = 0
+    out.h.softspace = 0
+
+# the Renderer whose classes and functions the processes of its pool render
+_renderer = None
+
+def _render_task(task):
+    kind,start,stop = task
+    r = _renderer
+    if kind == 'class':
+        out = Output(StringIO(),StringIO(),r.conv,r.split)
+        for c in r.classes[start:stop]:
+            output_class(c,out,r.module)
+        return out.cpp.getvalue(),out.h.getvalue()
+
+    return [f.output(r.conv) for f in r.functions[start:stop]]
+
+
+class Renderer(object):
+    """Produces the code of the classes and functions of a module, once
+    ModuleDef.write_file has analyzed them.
+
+    Rendering a class or function doesn't change anything another one depends
+    on, so when there are enough classes and jobs is greater than 1, they are
+    rendered by a pool of processes forked from this one, which inherit the
+    analyzed classes. Every range of classes in class_ranges is rendered as a
+    piece and the pieces are put back together in order, so the output is the
+    same as when rendering in this process.
+
+    """
+    def __init__(self,module,classes,functions,conv,split,class_ranges,jobs=1):
+        self.module = module
+        self.classes = classes
+        self.functions = functions
+        self.conv = conv
+        self.split = split
+
+        self.rendered = None
+        self.rendered_functions = None
+        if jobs > 1 and hasattr(os,'fork') and len(classes) >= PARALLEL_MIN_CLASSES:
+            self.render_in_pool(class_ranges,jobs)
+
+    def render_in_pool(self,class_ranges,jobs):
+        global _renderer
+
+        func_ranges = chunk_ranges(len(self.functions),max(1,-(-len(self.functions) // jobs)))
+        tasks = [('class',start,stop) for start,stop in class_ranges]
+        tasks.extend(('function',start,stop) for start,stop in func_ranges)
+
+        # the pool's processes are forked when it is created
+        _renderer = self
+        try:
+            pool = multiprocessing.Pool(min(jobs,len(tasks)))
+            try:
+                # map_async with a timeout lets KeyboardInterrupt through
+                results = pool.map_async(_render_task,tasks).get(0x7fffffff)
+            finally:
+                pool.terminate()
+        finally:
+            _renderer = None
+
+        self.rendered = dict(zip(class_ranges,results))
+        self.rendered_functions = [r for part in results[len(class_ranges):] for r in part]
+
+    def output_classes(self,out,start,stop):
+        """Write the code of classes[start:stop] to out (an instance of
+        Output). The range must be one of class_ranges."""
+        if self.rendered is not None:
+            cpp,h = self.rendered[start,stop]
+            out.cpp.write(cpp)
+            out.h.write(h)
+        else:
+            for c in self.classes[start:stop]:
+                with timing.item('class',c.name):
+                    output_class(c,out,self.module)
+
+    def output_functions(self):
+        """Return a list with the method table entry and the body of every
+        function."""
+        if self.rendered_functions is not None:
+            return self.rendered_functions
+
+        r = []
+        for f in self.functions:
+            with timing.item('function',f.name):
+                r.append(f.output(self.conv))
+        return r
+
+
 class ModuleDef:
     def __init__(self,name,includes=None):
         self.name = name
@@ -2110,21 +2364,36 @@ class ModuleDef:
         self.gchandlers = []
         self.init = None,None
 
-    def print_gccxml_input(self,out):
+        # the namespace that print_gccxml_input puts its typedefs in. Modules
+        # whose input is parsed by the same run of GCCXML need different ones.
+        self.test_ns = TEST_NS
+
+    def print_gccxml_input(self,out,seen=None):
+        """Write the input for GCCXML to the file-like object out.
+
+        seen -- if not None, a set shared by all the modules whose input is
+            written to the same file. Includes and template instantiations
+            that are already in it are left out, and the others are added.
+
+        """
+        if seen is None: seen = set()
+        includes = [i for i in self.includes if ('include',i) not in seen]
+        seen.update(('include',i) for i in includes)
+
         # In addition to the include files, declare certain typedefs so they can
         # be matched against types used elsewhere
-        print >> out, tmpl.gccxmlinput_start.format(self._formatted_includes(),TEST_NS)
+        print >> out, tmpl.gccxmlinput_start.format(self._formatted_includes(includes),self.test_ns)
 
         for c in self.classes:
             c.gccxml_input(out)
 
-        for f in self.functions.itervalues():
+        for f in by_name(self.functions):
             f.gccxml_input(out)
 
         for s in self.smartptrs:
             s.gccxml_input(out,self.classes)
 
-        for v in self.vars.itervalues():
+        for v in by_name(self.vars):
             v.gccxml_input(out)
 
         for i,conv in enumerate(self.topy):
@@ -2140,14 +2409,82 @@ class ModuleDef:
 
         for c in self.classes:
             # instantiate templates
-            if c.template:
+            if c.template and ('template',c.type) not in seen:
+                seen.add(('template',c.type))
                 print >> out, 'template class {0};\n'.format(c.type)
 
-    def _formatted_includes(self):
-        return "\n".join('#include "{0}"'.format(i) for i in self.includes)
+    def _formatted_includes(self,includes=None):
+        if includes is None: includes = self.includes
+        return "\n".join('#include "{0}"'.format(i) for i in includes)
+
+    name_re = re.compile(r'\boperator\b\s*(\w+|[^\w\s:]+(?:\s*[^\w\s:])*)|[A-Za-z_]\w*')
+
+    def referenced_names(self):
+        """Return the set of names, at any scope, that write_file may look up
+        outside of test_ns.
+
+        This is an over-approximation; every identifier in every function and
+        variable reference is included.
+
+        """
+        defs = self.functions.values()
+        for c in self.classes:
+            defs.extend(c.methods.itervalues())
+            defs.extend(p.get for p in c.properties)
+            defs.extend(p.set for p in c.properties)
+            defs.append(c.constructor)
+            defs.append(c.newconstructor)
+        # skip unset accessors and constructors and NoInit
+        defs = [d for d in defs if isinstance(d,DefDef)]
+
+        exprs = [ov.func for d in defs for ov in d.overloads if ov.func]
+        exprs.extend(i for i in self.init if i)
+        exprs.extend(v.value for v in self.vars.itervalues())
+
+        names = set()
+        for e in exprs:
+            for m in self.name_re.finditer(e):
+                if m.group(1):
+                    names.add('operator ' + ''.join(m.group(1).split()))
+                else:
+                    names.add(m.group(0))
+        return names
+
+    start_re = re.compile(r'(?:::)?[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*$')
+
+    def gccxml_start_names(self):
+        """Return the set of names to pass to GCCXML's -fxml-start option.
+
+        Only test_ns and the names of module-level functions and variables are
+        included. Names found by looking outside of a class's scope are not, so
+        the caller has to be prepared for write_file to fail to find a name (see
+        err.SymbolNotFoundError) and run GCCXML again without -fxml-start.
+
+        """
+        names = set([self.test_ns])
+        exprs = [ov.func for d in self.functions.itervalues() for ov in d.overloads]
+        exprs.extend(self.init)
+        exprs.extend(v.value for v in self.vars.itervalues())
+        for e in exprs:
+            if e and self.start_re.match(e):
+                names.add(e.lstrip(':'))
+        return names
+
+    def analyze(self,scope):
+        """Build the typed model of the module from the parsed GCCXML output
+        and analyze it.
+
+        Returns an object with these attributes:
+        conv -- the Conversion instance for the module
+        classes -- a list of TypedClassDef objects, with base classes before
+            derived classes
+        functions -- a list of TypedDefDef objects
+        vars -- a list of TypedVarDef objects
+        bases_needed -- a list of four booleans, telling which internal base
+            types, indexed like EXTRA_VARS_SUFFIXES, are needed
 
-    def write_file(self,path,scope):
-        tns = scope.find(TEST_NS)[0]
+        """
+        tns = scope.find(self.test_ns)[0]
         conv = Conversion(tns)
 
         for i,to in enumerate(self.topy):
@@ -2163,10 +2500,159 @@ class ModuleDef:
                 tns.find('gchandler_type_{0}'.format(i))[0],
                 handler[1:])
 
+        with timing.phase('typed model'):
+            # the classes are kept in the order of the spec, so that the output
+            # doesn't depend on how the types hash
+            classes = []
+            by_type = {}
+
+            for cdef in self.classes:
+                with timing.item('class',cdef.name):
+                    c = TypedClassDef(scope,cdef,tns)
+                classes.append(c)
+                by_type[c.type] = c
+
+                # these assume the class has copy constructors
+                conv.add_conv(c.type,'reinterpret_cast<PyObject*>(new obj_{0}({{0}}))'.format(c.name),(True,'get_base_{0}({{0}})'.format(c.name)))
+                conv.cppclasstopy[c.type] = c,c.cast_base_expr()
+
+            for s in self.smartptrs:
+                for c in classes:
+                    t = s.get_type(tns,c)
+                    conv.add_conv(
+                        t,
+                        s.to and s.to.format('{0}',c.type.typestr()),
+                        s.from_ and (False,s.from_.format('get_base_{0}({{0}})'.format(c.name),c.type.typestr(),'{0}')))
+                    if s.from_:
+                        conv.cppclasstopy[t] = c,s.from_.format(c.cast_base_expr(),c.type.typestr(),'{0}')
+
+            for c in classes:
+                c.findbases(by_type)
+
+            analyze_hierarchy(classes)
+
+
+            # Sort classes by heirarchy. Base classes need to be declared before
+            # derived classes. The sort is stable, so classes with the same
+            # number of bases stay in the order of the spec.
+            classes.sort(key=TypedClassDef.basecount)
+
+            functions = []
+            for f in by_name(self.functions):
+                with timing.item('function',f.name):
+                    functions.append(TypedDefDef(scope,f,tns))
+            vars = [TypedVarDef(scope,v,tns) for v in by_name(self.vars)]
+
+
+        with timing.phase('analysis'):
+            # find all methods and functions that return objects that require special storage
+            for c in classes:
+                for name,m in methods_that_return(c):
+                    for ov in m.overloads:
+                        if ov.retsemantic in (RET_MANAGED_REF,RET_MANAGED_PTR,RET_UNMANAGED_REF):
+                            conv.requires_ret_semantic(ov.func.returns,ov.retsemantic)
+
+                for v in c.vars:
+                    if v.really_a_property(conv):
+                        try:
+                            conv.requires_ret_semantic(v.getter_type(conv),RET_MANAGED_REF)
+                        except Error as e:
+                            e.info['attr'] = v.name
+
+            for f in functions:
+                for ov in f.overloads:
+                    if ov.retsemantic in (RET_MANAGED_PTR,RET_UNMANAGED_REF):
+                        conv.requires_ret_semantic(ov.func.returns,ov.retsemantic)
+
+            for v in vars:
+                if v.ref in (RET_MANAGED_PTR,RET_UNMANAGED_REF):
+                    conv.requires_ret_semantic(v.type,v.ref,v.temporary)
+
+
+            bases_needed = [False] * 4
+            method_names = dict((c,set(m.name for m in c.methods)) for c in classes)
+
+            for c in classes:
+                c.check_needs_mode_var()
+
+                # any method that is redefined in a subclass needs to be re-exposed
+                # (even virtual methods because they are always called with a
+                # type-qualifier).
+                for m in c.methods:
+                    for d in c.derived:
+                        if m.name not in method_names[d]:
+                            newm = False
+                            newo = []
+                            for o in m.overloads:
+                                if isinstance(o.func,gccxml.CPPMethod) and o.func.context is not d.type.find(o.name)[0].context:
+                                    newm = True
+                                    no = copy.copy(o)
+                                    no.func = copy.copy(o.func)
+                                    no.func.pure_virtual = False
+                                    newo.append(no)
+                                else:
+                                    newo.append(o)
+
+                            if newm:
+                                newm = copy.copy(m)
+                                newm.overloads = newo
+                                newm.classdef = d
+                                newm.inherited = True
+                                d.methods.append(newm)
+                                method_names[d].add(newm.name)
+
+                check_extra_vars(True,True,c,False,bases_needed)
+
+            # base classes come first
+            for c in classes:
+                c.find_gc_fields(conv)
+
+        return Scope(
+            conv = conv,
+            classes = classes,
+            functions = functions,
+            vars = vars,
+            bases_needed = bases_needed)
+
+    def write_file(self,path,scope,split=None,jobs=1,instrument=False,call_counts=None):
+        """Generate the source and header files of the module in the directory
+        path and return the list of source files written.
+
+        scope -- the root namespace of the parsed GCCXML output
+        split -- if not None, put the code of every "split" classes in a
+            separate source file, named "<module>_<n>.cpp", so that the files
+            can be compiled in parallel. "<module>.cpp" then only contains the
+            common code, the functions and the module's init function. The
+            names of all the source files are also written, one per line, to
+            "<module>.sources". Parts and a "<module>.sources" file left over
+            from a previous run that aren't part of this one are deleted.
+        jobs -- the number of processes to render the classes and functions
+            in (see Renderer). Unless it is 1, the time taken by each class
+            and function isn't recorded in the active timing.Profile.
+        instrument -- if True, the module counts how many times each overload
+            of an overloaded function is called and writes the counts to a
+            file when the process exits (see conversion.read_call_profile)
+        call_counts -- if not None, the counts of a profile (the return value
+            of conversion.read_call_profile). The overloads that were called
+            most are checked for first, where the order of the checks doesn't
+            change which overload is chosen.
+
+        """
+        model = self.analyze(scope)
+        conv = model.conv
+        conv.instrument = instrument
+        conv.call_counts = call_counts
+        classes = model.classes
+        functions = model.functions
+        vars = model.vars
+        bases_needed = model.bases_needed
+
+        sources = [self.name + '.cpp']
         out = Output(
-            open(os.path.join(path, self.name + '.cpp'),'w'),
-            open(os.path.join(path, self.name + '.h'),'w'),
-            conv)
+            OutputFile(os.path.join(path, sources[0])),
+            OutputFile(os.path.join(path, self.name + '.h')),
+            conv,
+            bool(split))
 
         print >> out.cpp, tmpl.module_start.format(
             includes = self._formatted_includes(),
@@ -2175,175 +2661,142 @@ class ModuleDef:
         print >> out.h, tmpl.header_start.render(module = self.name)
 
 
-        classes = {}
-
-        for cdef in self.classes:
-            c = TypedClassDef(scope,cdef,tns)
-            classes[c.type] = c
-
-            # these assume the class has copy constructors
-            conv.add_conv(c.type,'reinterpret_cast<PyObject*>(new obj_{0}({{0}}))'.format(c.name),(True,'get_base_{0}({{0}})'.format(c.name)))
-            conv.cppclasstopy[c.type] = c,c.cast_base_expr()
-
-        for s in self.smartptrs:
-            for c in classes.itervalues():
-                t = s.get_type(tns,c)
-                conv.add_conv(
-                    t,
-                    s.to and s.to.format('{0}',c.type.typestr()),
-                    s.from_ and (False,s.from_.format('get_base_{0}({{0}})'.format(c.name),c.type.typestr(),'{0}')))
-                if s.from_:
-                    conv.cppclasstopy[t] = c,s.from_.format(c.cast_base_expr(),c.type.typestr(),'{0}')
-
-        for c in classes.itervalues():
-            c.findbases(classes)
-
-
-        # Sort classes by heirarchy. Base classes need to be declared before derived classes.
-        classes = sorted(classes.itervalues(),key=TypedClassDef.basecount)
-
-        functions = [TypedDefDef(scope,f,tns) for f in self.functions.itervalues()]
-        vars = [TypedVarDef(scope,v,tns) for v in self.vars.itervalues()]
-
-
-        # find all methods and functions that return objects that require special storage
-        for c in classes:
-            for name,m in methods_that_return(c):
-                for ov in m.overloads:
-                    if ov.retsemantic in (RET_MANAGED_REF,RET_MANAGED_PTR,RET_UNMANAGED_REF):
-                        conv.requires_ret_semantic(ov.func.returns,ov.retsemantic)
-
-            for v in c.vars:
-                if v.really_a_property(conv):
-                    try:
-                        conv.requires_ret_semantic(v.getter_type(conv),RET_MANAGED_REF)
-                    except Error as e:
-                        e.info['attr'] = v.name
-
-        for f in functions:
-            for ov in f.overloads:
-                if ov.retsemantic in (RET_MANAGED_PTR,RET_UNMANAGED_REF):
-                    conv.requires_ret_semantic(ov.func.returns,ov.retsemantic)
+        with timing.phase('output'):
+            for combo,suffix in enumerate(EXTRA_VARS_SUFFIXES):
+                if bases_needed[combo]:
+                    print >> out.cpp, tmpl.obj_internal.render(
+                        module=self.name,
+                        weakref=combo & 2,
+                        instance_dict=combo & 1,
+                        suffix=suffix)
+                    if split:
+                        print >> out.h, tmpl.internal_decl.format(suffix)
+
+
+            # TODO: These functions result in the same machine code as long as the
+            # types have the same alignment. They can probably be replaced by a
+            # single function.
+            for c in classes:
+                print >> out.cpp, c.cast_base_func()
+
+            for c in classes:
+                print >> out.cpp, c.get_base_func(self,bool(split))
+
+            # without split, the pieces only serve to spread the work evenly
+            # over the processes
+            ranges = chunk_ranges(len(classes),split or max(1,-(-len(classes) // (jobs * 4))))
+            render = Renderer(self,classes,functions,conv,bool(split),ranges,jobs)
+
+            parts = []
+            if split:
+                for n,(start,stop) in enumerate(ranges):
+                    sources.append('{0}_{1}.cpp'.format(self.name,n + 1))
+                    f = OutputFile(os.path.join(path,sources[-1]))
+                    parts.append(f)
+                    part = Output(f,out.h,conv,True)
+                    print >> f, tmpl.module_part_start.format(
+                        includes = self._formatted_includes(),
+                        module = self.name)
+                    render.output_classes(part,start,stop)
+                    print >> f, tmpl.module_part_end
+            else:
+                for start,stop in ranges:
+                    render.output_classes(out,start,stop)
 
-        for v in vars:
-            if v.ref in (RET_MANAGED_PTR,RET_UNMANAGED_REF):
-                conv.requires_ret_semantic(v.type,v.ref,v.temporary)
+            functable = []
+            for tentry,body in render.output_functions():
+                print >> out.cpp, body
+                functable.append(tentry)
 
+        
+            init_pre = ''
+            init_post = ''
+            throw = False
+
+            if self.init[0]:
+                f = unambiguous_func(scope,self.init[0])
+                if not accepts_args(f,[]):
+                    wrong_format(self.init[0])
+
+                if f.returns == conv.sint:
+                    init_pre = '    if(UNLIKELY({0}())) return INIT_ERR_VAL;'.format(self.init[0])
+                elif f.returns == conv.void:
+                    init_pre = '    {0}();'.format(self.init[0])
+                    throw = can_throw(f)
+                else:
+                    wrong_format(self.init[0])
+
+            if self.init[1]:
+                f = unambiguous_func(scope,self.init[1])
+
+                param = ''
+                if accepts_args(f,[conv.pyobject]):
+                    param = 'm'
+                elif not accepts_args(f,[]):
+                    wrong_format(self.init[1])
+
+                if f.returns == conv.sint:
+                    init_post = '    if(UNLIKELY({0}({1}))) return INIT_ERR_VAL;'.format(self.init[1],param)
+                elif f.returns == conv.void:
+                    init_post = '    {0}({1});'.format(self.init[1],param)
+                    throw = throw and can_throw(f)
+                else:
+                    wrong_format(self.init[1])
+
+
+            print >> out.cpp, tmpl.module.render(
+                init_pre = init_pre,
+                init_post = init_post,
+                wrap_in_trycatch = throw,
+                funclist = functable,
+                module = self.name,
+                doc = self.doc,
+                classes = [{
+                    'name' : c.name,
+                    'dynamic' : c.dynamic,
+                    'new_init' : bool(c.newconstructor),
+                    'no_init' : not c.constructor,
+                    'base' : c.static_from_dynamic and c.bases[0].name}
+                        for c in classes],
+                vars = ({'name' : v.name,'create' : v.creation_code(conv)} for v in vars),
+                internal_suffixes = [s for need,s in zip(bases_needed,EXTRA_VARS_SUFFIXES) if need]
+            )
 
-        bases_needed = [False] * 4
+        print >> out.h, tmpl.header_end
 
-        for c in classes:
-            c.check_needs_mode_var()
-
-            # any method that is redefined in a subclass needs to be re-exposed
-            # (even virtual methods because they are always called with a
-            # type-qualifier).
-            for m in c.methods:
-                for d in c.derived:
-                    if not any(m.name == dm.name for dm in d.methods):
-                        newm = False
-                        newo = []
-                        for o in m.overloads:
-                            if isinstance(o.func,gccxml.CPPMethod) and o.func.context is not d.type.find(o.name)[0].context:
-                                newm = True
-                                no = copy.copy(o)
-                                no.func = copy.copy(o.func)
-                                no.func.pure_virtual = False
-                                newo.append(no)
-                            else:
-                                newo.append(o)
-
-                        if newm:
-                            newm = copy.copy(m)
-                            newm.overloads = newo
-                            newm.classdef = d
-                            d.methods.append(newm)
-
-            check_extra_vars(True,True,c,False,bases_needed)
-
-
-        for combo,suffix in enumerate(EXTRA_VARS_SUFFIXES):
-            if bases_needed[combo]:
-                print >> out.cpp, tmpl.obj_internal.render(
-                    module=self.name,
-                    weakref=combo & 2,
-                    instance_dict=combo & 1,
-                    suffix=suffix)
-
-
-        # TODO: These functions result in the same machine code as long as the
-        # types have the same alignment. They can probably be replaced by a
-        # single function.
-        for c in classes:
-            print >> out.cpp, c.cast_base_func()
+        # nothing is written until the whole module has been generated, and
+        # files whose contents are the same as before are left alone, so that
+        # their modification times don't trigger a rebuild
+        for f in parts: f.close()
+        out.cpp.close()
+        out.h.close()
 
-        for c in classes:
-            print >> out.cpp, c.get_base_func(self)
+        if split:
+            with OutputFile(os.path.join(path,self.name + '.sources')) as f:
+                for name in sources: print >> f, name
 
-        for c in classes:
-            c.output(out,self)
+        remove_stale_parts(path,self.name,sources,bool(split))
 
-        functable = []
-        for f in functions:
-            tentry,body = f.output(conv)
-            print >> out.cpp, body
-            functable.append(tentry)
+        return sources
 
-        
-        init_pre = ''
-        init_post = ''
-        throw = False
-
-        if self.init[0]:
-            f = unambiguous_func(scope,self.init[0])
-            if not accepts_args(f,[]):
-                wrong_format(self.init[0])
-
-            if f.returns == conv.sint:
-                init_pre = '    if(UNLIKELY({0}())) return INIT_ERR_VAL;'.format(self.init[0])
-            elif f.returns == conv.void:
-                init_pre = '    {0}();'.format(self.init[0])
-                throw = can_throw(f)
-            else:
-                wrong_format(self.init[0])
-
-        if self.init[1]:
-            f = unambiguous_func(scope,self.init[1])
-
-            param = ''
-            if accepts_args(f,[conv.pyobject]):
-                param = 'm'
-            elif not accepts_args(f,[]):
-                wrong_format(self.init[1])
-
-            if f.returns == conv.sint:
-                init_post = '    if(UNLIKELY({0}({1}))) return INIT_ERR_VAL;'.format(self.init[1],param)
-            elif f.returns == conv.void:
-                init_post = '    {0}({1});'.format(self.init[1],param)
-                throw = throw and can_throw(f)
-            else:
-                wrong_format(self.init[1])
 
+def remove_stale_parts(path,module,sources,split):
+    """Delete the "<module>_<n>.cpp" files in the directory path that aren't
+    in sources, and "<module>.sources" if the module isn't split.
 
-        print >> out.cpp, tmpl.module.render(
-            init_pre = init_pre,
-            init_post = init_post,
-            wrap_in_trycatch = throw,
-            funclist = functable,
-            module = self.name,
-            doc = self.doc,
-            classes = [{
-                'name' : c.name,
-                'dynamic' : c.dynamic,
-                'new_init' : bool(c.newconstructor),
-                'no_init' : not c.constructor,
-                'base' : c.static_from_dynamic and c.bases[0].name}
-                    for c in classes],
-            vars = ({'name' : v.name,'create' : v.creation_code(conv)} for v in vars),
-            internal_suffixes = [s for need,s in zip(bases_needed,EXTRA_VARS_SUFFIXES) if need]
-        )
+    These are left over from a previous run that split the module into more
+    pieces, or at all, and would otherwise be compiled by any build that takes
+    every source file in the directory.
 
-        print >> out.h, tmpl.header_end
+    """
+    part = re.compile(re.escape(module) + r'_[0-9]+\.cpp$')
+    stale = [name for name in os.listdir(path) if part.match(name) and name not in sources]
+    if not split: stale.append(module + '.sources')
+    for name in stale:
+        try:
+            os.remove(os.path.join(path,name))
+        except OSError as e:
+            if e.errno != errno.ENOENT: raise
 
 
 class VarDef:
@@ -2712,7 +3165,8 @@ class tag_Def(tag):
             assign,
             parse_bool(args,'bridge-virtual',True),
             sa,
-            raw))
+            raw,
+            parse_bool(args,'keywords',True)))
 
 
     op_parse_re = re.compile(r'.*\boperator\b')
@@ -1,6 +1,8 @@
 # the template strings used by espec.py, put here to keep espec.py uncluttered
 
-import jinja2
+# jinja2 is imported by get_env, only once a template is rendered
+
+from . import timing
 
 
 
@@ -43,26 +45,99 @@ class Tab:
         return self.__str__() + x + '\n'
 
 
+class CodeBuffer:
+    """Collects generated code.
+
+    Fragments are kept in a list and only joined by getvalue, so code nested
+    inside other code is not copied again at every level. An instance can also
+    be the target of "print >>".
+
+    """
+    def __init__(self):
+        self.parts = []
+
+    def write(self,x):
+        self.parts.append(x)
+
+    def line(self,ind,x):
+        """Write x on its own line, indented by the Tab ind."""
+        self.parts.append(str(ind))
+        self.parts.append(x)
+        self.parts.append('\n')
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
 def quote_c(x):
     # python's non-unicode string syntax appears to be the same as C's
     return '"'+x.encode('utf_8').encode('string_escape')+'"'
 
-env = jinja2.Environment(
-    block_start_string = '<@',
-    block_end_string = '@>',
-    variable_start_string = '<%',
-    variable_end_string = '%>',
-    comment_start_string = '<#',
-    comment_end_string = '#>',
-    line_statement_prefix = '==',
-    line_comment_prefix = '=#',
-    autoescape = False)
+# Where the compiled templates are cached. If None, Jinja2 picks a private
+# directory under the system's temporary directory. If False, templates are
+# compiled every time.
+bytecode_cache_dir = None
+
+# global variables for the templates, added to the environment when it's created
+env_globals = {}
+
+_env = None
+
+def get_env():
+    """Return the Jinja2 environment that the templates are compiled with,
+    creating it the first time."""
+    global _env
+    if _env is None:
+        import jinja2
+
+        bcc = None
+        if bytecode_cache_dir is not False:
+            bcc = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+
+        _env = jinja2.Environment(
+            block_start_string = '<@',
+            block_end_string = '@>',
+            variable_start_string = '<%',
+            variable_end_string = '%>',
+            comment_start_string = '<#',
+            comment_end_string = '#>',
+            line_statement_prefix = '==',
+            line_comment_prefix = '=#',
+            autoescape = False,
+            loader = jinja2.FunctionLoader(_template_source),
+            bytecode_cache = bcc)
+
+        _env.filters['quote'] = quote_c
+        _env.globals.update(env_globals)
+    return _env
+
+def _template_source(name):
+    t = globals().get(name)
+    return t.source if isinstance(t,Template) else None
+
+
+class Template:
+    """A Jinja2 template that is compiled the first time it's rendered.
 
-env.filters['quote'] = quote_c
+    The compiled code is stored in the bytecode cache (keyed by the template's
+    name and checked against its source), so later runs of the generator only
+    have to load it.
+
+    """
+    def __init__(self,source):
+        self.source = source
+        self.name = None # set at the end of this module
+        self._template = None
+
+    def render(self,*args,**kwds):
+        with timing.phase('templates'):
+            if self._template is None:
+                self._template = get_env().get_template(self.name)
+            return self._template.render(*args,**kwds)
 
 
 
-property_get = env.from_string('''
+property_get = Template('''
 PyObject *obj_<% cname %>_get<% name %>(PyObject *self,void *) {
 <% prolog %>
     try {
@@ -71,7 +146,7 @@ PyObject *obj_<% cname %>_get<% name %>(PyObject *self,void *) {
 }
 ''')
 
-property_set = env.from_string('''
+property_set = Template('''
 int obj_<% cname %>_set<% name %>(PyObject *self,PyObject *arg,void *) {
     if(!arg) {
         PyErr_SetString(PyExc_TypeError,no_delete_msg);
@@ -84,13 +159,13 @@ int obj_<% cname %>_set<% name %>(PyObject *self,PyObject *arg,void *) {
 }
 ''')
 
-property_table = env.from_string('''<@
+property_table = Template('''<@
     macro _ter(x,what) @><@
         if x @>reinterpret_cast<<% what %>ter>(&obj_<% cname %>_<% what %><% name %>)<@
         else @>0<@ endif @><@
     endmacro @>{const_cast<char*>("<% name %>"),<% _ter(get,"get") %>,<% _ter(set,"set") %>,<@ if doc @>const_cast<char*>(<% doc|quote %>)<@ else @>0<@ endif @>,0}''')
 
-destruct = env.from_string('''
+destruct = Template('''
 void obj_<% name %>_dealloc(obj_<% name %> *self) {
 == if features or destructor or ((instance_dict or weakref) and not new_init)
     switch(self->mode) {
@@ -158,7 +233,7 @@ PyMethodDef obj_{name}_methods[] = {{
 # Although if all derived and inherited classes have the same combination of
 # these variables, they can be placed before 'base', which may be more space
 # efficient because the padding below would not be required.
-classdef = env.from_string('''
+classdef = Template('''
 extern PyTypeObject <% '*' if dynamic %>obj_<% name %>Type;
 inline PyTypeObject *get_obj_<% name %>Type() { return <% '&' if not dynamic %>obj_<% name %>Type; }
 
@@ -336,6 +411,16 @@ struct obj_<% name %><@ if common_base @> : _x_<% name %><@ endif @> {
 == endif
 };
 
+== if split
+<% original_type %> &cast_base_<% name %>(PyObject *o);
+#ifndef PYEXPOSE_TEMPLATE_HELPERS
+<% original_type %> &get_base_<% name %>(PyObject *o<% ',bool safe=true' if bool_arg_get %>);
+#endif
+==     if dynamic
+PyTypeObject *create_obj_<% name %>Type();
+==     endif
+
+== endif
 #ifdef PYEXPOSE_TEMPLATE_HELPERS
 template<> inline PyTypeObject *get_type<<% original_type %> >() {
     return get_obj_<% name %>Type();
@@ -358,7 +443,7 @@ template<> struct invariable_storage<<% original_type %> > {
 #endif
 ''')
 
-classtypedef = env.from_string('''
+classtypedef = Template('''
 == if initcode
 int obj_<% name %>_init(obj_<% name %> *self,PyObject *args,PyObject *kwds) {
 ==     if derived
@@ -459,7 +544,7 @@ success:
 == if dynamic
 PyTypeObject *obj_<% name %>Type;
 
-inline PyTypeObject *create_obj_<% name %>Type() {
+<% 'inline ' if not split %>PyTypeObject *create_obj_<% name %>Type() {
     PyObject *bases = PyTuple_New(<% bases|length %>);
     if(UNLIKELY(!bases)) return 0;
 ==     for base in bases
@@ -617,7 +702,7 @@ typedef visitproc type_visitproc;
 '''
 
 # the back-slashes will line up after the double curly braces are replaced with single curly braces
-module_start = '''
+module_head = '''
 #include <Python.h>
 #include <structmember.h>
 #include <exception>
@@ -648,7 +733,9 @@ module_start = '''
 
 #pragma GCC visibility push(hidden)
 
-const char *no_delete_msg = "This attribute cannot be deleted";
+'''
+
+module_messages = '''const char *no_delete_msg = "This attribute cannot be deleted";
 const char *not_init_msg = "This object has not been initialized. Its __init__ method must be called first.";
 const char *unspecified_err_msg = "unspecified error";
 const char *no_keywords_msg = "keyword arguments are not accepted";
@@ -656,7 +743,9 @@ const char *init_on_derived_msg = "__init__ cannot be used directly on a derived
 const char *not_implemented_msg = "This method is not implemented";
 
 
-struct get_arg {{
+'''
+
+module_get_arg = '''struct get_arg {{
     PyObject *args, *kwds;
     unsigned int tcount, kcount;
     get_arg(PyObject *args,PyObject *kwds) : args(args), kwds(kwds), tcount(0), kcount(0) {{
@@ -664,21 +753,28 @@ struct get_arg {{
         assert(kwds == 0 || PyDict_Check(kwds));
     }}
 
-    PyObject *operator()(const char *name,bool required);
-    void finished(const char *names[]);
+    PyObject *operator()(PyObject *name,bool required);
+    void finished(PyObject *const names[]);
 }};
 
-PyObject *get_arg::operator()(const char *name,bool required) {{
+PyObject **intern_names(const char *const strs[],int n);
+
+'''
+
+module_helpers = '''/* The names are interned strings, which the compiler also uses for the keywords
+   of a call, so the dictionary look-ups usually succeed by comparing pointers
+   and don't create any strings. */
+PyObject *get_arg::operator()(PyObject *name,bool required) {{
     if(tcount < PyTuple_GET_SIZE(args)) {{
         PyObject *r = PyTuple_GET_ITEM(args,tcount++);
-        if(UNLIKELY(name && kwds && PyDict_GetItemString(kwds,name))) {{
-            PyErr_Format(PyExc_TypeError,"got multiple values for keyword argument \\"%s\\"",name);
+        if(UNLIKELY(name && kwds && PyDict_Size(kwds) && PyDict_GetItem(kwds,name))) {{
+            PyErr_Format(PyExc_TypeError,"got multiple values for keyword argument \\"%s\\"",PyString_AS_STRING(name));
             throw py_error_set();
         }}
         return r;
     }}
     if(name && kwds) {{
-        PyObject *r = PyDict_GetItemString(kwds,name);
+        PyObject *r = PyDict_GetItem(kwds,name);
         if(r) {{
             ++kcount;
             return r;
@@ -686,7 +782,7 @@ PyObject *get_arg::operator()(const char *name,bool required) {{
     }}
 
     if(UNLIKELY(required)) {{
-        if(name) PyErr_Format(PyExc_TypeError,"a value for keyword argument \\"%s\\" is required",name);
+        if(name) PyErr_Format(PyExc_TypeError,"a value for keyword argument \\"%s\\" is required",PyString_AS_STRING(name));
         else PyErr_Format(PyExc_TypeError,"a value for positional argument # %d is required",tcount);
         throw py_error_set();
     }}
@@ -694,19 +790,35 @@ PyObject *get_arg::operator()(const char *name,bool required) {{
     return 0;
 }}
 
-void get_arg::finished(const char *names[]) {{
+void get_arg::finished(PyObject *const names[]) {{
     // TODO: check for unused arguments
 }}
 
+/* Return an array of the interned versions of the first n strings of strs. A
+   null string gives a null entry. The strings are never released. */
+PyObject **intern_names(const char *const strs[],int n) {{
+    PyObject **r = new PyObject*[n];
+    for(int i = 0; i < n; ++i) {{
+        if(!strs[i]) {{
+            r[i] = 0;
+            continue;
+        }}
+        r[i] = PyString_InternFromString(strs[i]);
+        if(UNLIKELY(!r[i])) {{
+            while(i--) Py_XDECREF(r[i]);
+            delete[] r;
+            throw py_error_set();
+        }}
+    }}
+    return r;
+}}
 
 
-long narrow(long x,long max,long min) {{
-    if(UNLIKELY(x > max || x < min)) {{
-        if(min == 0 && x < 0) PyErr_SetString(PyExc_TypeError,"value cannot be negative");
-        else PyErr_SetString(PyExc_OverflowError,"value is out of range");
-        throw py_error_set();
-    }}
-    return x;
+
+void narrow_failed(long x,long min) {{
+    if(min == 0 && x < 0) PyErr_SetString(PyExc_TypeError,"value cannot be negative");
+    else PyErr_SetString(PyExc_OverflowError,"value is out of range");
+    throw py_error_set();
 }}
 
 
@@ -743,7 +855,45 @@ void NoSuchOverload(PyObject *args) {{
 
 '''
 
-obj_internal = env.from_string('''
+module_start = module_head + module_messages + module_get_arg + module_helpers
+
+# the start of the parts of a module split into multiple source files
+module_part_start = module_head + '''extern const char *no_delete_msg;
+extern const char *not_init_msg;
+extern const char *unspecified_err_msg;
+extern const char *no_keywords_msg;
+extern const char *init_on_derived_msg;
+extern const char *not_implemented_msg;
+
+
+'''+ module_get_arg + '''void NoSuchOverload(PyObject *args);
+'''
+
+module_part_end = '''
+#pragma GCC visibility pop
+'''
+
+# everything a generated source file includes before its own header, for
+# build.Builder to precompile
+precompiled_header = '''
+#include <Python.h>
+#include <structmember.h>
+#include <exception>
+#include <assert.h>
+{includes}
+
+#ifdef LOCAL_PYEXPOSE_COMMON
+    #include "pyexpose_common.h"
+#else
+    #include <PyExpose/pyexpose_common.h>
+#endif
+'''
+
+internal_decl = '''
+extern PyTypeObject _obj_Internal{0}Type;
+'''
+
+obj_internal = Template('''
 struct _obj_Internal<% suffix %> {
     PyObject_HEAD
     storage_mode mode;
@@ -798,7 +948,7 @@ PyTypeObject _obj_Internal<% suffix %>Type = {
 ''')
 
 
-module = env.from_string('''
+module = Template('''
 PyMethodDef func_table[] = {
 == for f in funclist
     <% f %>,
@@ -895,7 +1045,7 @@ extern "C" SHARED(void) init<% module %>(void) {
 #pragma GCC visibility pop
 ''')
 
-cast_base = env.from_string('''
+cast_base = Template('''
 <% type %> &cast_base_<% name %>(PyObject *o) {
 == if mode_var
     switch(reinterpret_cast<obj_<% name %>*>(o)->mode) {
@@ -938,7 +1088,7 @@ get_base = '''
 }}
 '''
 
-header_start = env.from_string('''
+header_start = Template('''
 #pragma once
 #ifndef <% module %>_h
 #define <% module %>_h
@@ -972,12 +1122,16 @@ no_such_overload = '''
         return {errval};
 '''
 
-typecheck_start = env.from_string('''
+typecheck_start = Template('''
+== if declared
+<% type %> &get_base_<% name %>(PyObject *x,bool safe) {
+== else
 #ifdef PYEXPOSE_TEMPLATE_HELPERS
 <% type %> &get_base_<% name %>(PyObject *x,bool safe) {
 #else
 <% type %> &get_base_<% name %>(PyObject *x,bool safe=true) {
 #endif
+== endif
 ''')
 
 # The
@@ -1049,7 +1203,7 @@ richcompare_end = '''
 }
 '''
 
-number_methods = env.from_string('''
+number_methods = Template('''
 <@ macro exact(fname) @><@ if fname in specialmethods @>&obj_<% name %>_<% fname %><@ else @>0<@ endif @><@ endmacro @>
 <@ macro cast(fname,type) @><@ if fname in specialmethods @>reinterpret_cast<<% type %>>(&obj_<% name %>_<% fname %>)<@ else @>0<@ endif @><@ endmacro @>
 PyNumberMethods obj_<% name %>_number_methods = {
@@ -1100,7 +1254,7 @@ ret_notimplemented = '''
     return Py_NotImplemented;
 '''
 
-mapping_methods = env.from_string('''
+mapping_methods = Template('''
 PyMappingMethods obj_<% name %>_mapping_methods = {
     <@ if '__mapping__len__' in specialmethods @>reinterpret_cast<lenfunc>(&obj_<% name %>___mapping__len__)<@ else @>0<@ endif @>,
     <@ if '__mapping__getitem__' in specialmethods @>reinterpret_cast<binaryfunc>(&obj_<% name %>___mapping__getitem__)<@ else @>0<@ endif @>,
@@ -1108,7 +1262,7 @@ PyMappingMethods obj_<% name %>_mapping_methods = {
 };
 ''')
 
-sequence_methods = env.from_string('''
+sequence_methods = Template('''
 PySequenceMethods obj_<% name %>_sequence_methods = {
     <@ if '__sequence__len__' in specialmethods @>reinterpret_cast<lenfunc>(&obj_<% name %>___sequence__len__)<@ else @>0<@ endif @>,
     <@ if '__concat__' in specialmethods @>reinterpret_cast<binaryfunc>(&obj_<% name %>___concat__)<@ else @>0<@ endif @>,
@@ -1123,7 +1277,7 @@ PySequenceMethods obj_<% name %>_sequence_methods = {
 };
 ''')
 
-subclass = env.from_string('''
+subclass = Template('''
 class <% name %>_virt_handler : public <% type %> {
 public:
 == for con in constructors
@@ -1139,27 +1293,31 @@ protected:
 };
 ''')
 
-subclass_meth = env.from_string('''
+subclass_meth = Template('''
 inline PyObject *<% name %>_virt_handler::self() const {
     return reinterpret_cast<PyObject*>(reinterpret_cast<size_t>(this) - offsetof(obj_<% name %>,base));
 }
 ''')
 
-virtmethod = env.from_string('''
+virtmethod = Template('''
 <% ret %> <% cname %>_virt_handler::<% func %>(<% args %>)<% ' const' if const %> {
-    PyObject *f = PyObject_GetAttrString(self(),"<% name %>");
-    if(!f) throw py_error_set();
-    if(PyCFunction_Check(f) && PyCFunction_GET_FUNCTION(f) == reinterpret_cast<PyCFunction>(&obj_<% cname %>_method_<% name %>)) {
+    owned_ref f(PyObject_GetAttrString(self(),"<% name %>"));
+    if(!f.ptr) throw py_error_set();
+    if(PyCFunction_Check(f.ptr) && PyCFunction_GET_FUNCTION(f.ptr) == reinterpret_cast<PyCFunction>(&obj_<% cname %>_method_<% name %>)) {
 == if pure
         PyErr_SetString(PyExc_NotImplementedError,not_implemented_msg);
+        throw py_error_set();
 == else
         <% 'return ' if ret != 'void' %><% type %>::<% func %>(<% argvals %>);
 == endif
     } else {
-        PyObject *ret = PyObject_CallFunctionObjArgs(f,<% pyargvals %>NULL);
-        if(!ret) throw py_error_set();
+== for a in pyargs
+        owned_ref a<% loop.index0 %>(<% a %>);
+        if(!a<% loop.index0 %>.ptr) throw py_error_set();
+== endfor
+        owned_ref ret(PyObject_CallFunctionObjArgs(f.ptr,<@ for a in pyargs @>a<% loop.index0 %>.ptr,<@ endfor @>NULL));
+        if(!ret.ptr) throw py_error_set();
         <@ if ret != 'void' @><% rettype %> cret = <% retfrompy %>;<@ endif @>
-        Py_DECREF(ret);
         <@ if ret != 'void' @>return cret;<@ endif @>
     }
 }
@@ -1207,3 +1365,8 @@ field_offset_and_type = '''
 const unsigned long class_{0}_field_offset_{1} = __builtin_offsetof(class_type_{0},{2});
 typedef __typeof__(reinterpret_cast<class_type_{0}*>(1)->{2}) class_{0}_field_type_{1};
 '''
+
+
+for _name,_t in globals().items():
+    if isinstance(_t,Template): _t.name = _name
+del _name,_t
@@ -2,35 +2,367 @@
 
 
 import subprocess
+import multiprocessing
 import os
 import os.path
+import re
+import shlex
+import time
+from cStringIO import StringIO
 
-from .gccxml import getinterface
-from .espec import getspec
+from .gccxml import parse_tree, link_tree, reachable_items
+from .espec import getspec, TEST_NS
+from .cache import ParseCache, DEFAULT_MAX_SIZE
+from .err import SymbolNotFoundError, emit_warning, WARN_NORMAL
+from .outfile import OutputFile
+from . import timing
+from . import perflint
 
 
 
-def generate_module(spec,path,gccxml=None,compiler=None,cxxflags=None):
-    """Run gccxml and save the results in outfile.
+def gccxml_args(gccinname,gccxml=None,compiler=None,cxxflags=None,start=None):
+    args = [gccxml or "gccxml",'-I.']
+    if compiler: args.extend(["--gccxml-compiler",compiler])
+    if cxxflags: args.extend(["--gccxml-cxxflags",cxxflags])
+    if start: args.append("-fxml-start="+','.join(sorted(start)))
+    args.append(gccinname)
+    return args
+
+def parse_make_rule(text):
+    """Return the prerequisites of the makefile rule in text, as written by the
+    compiler's -M option."""
+    text = text.replace('\\\n',' ')
+    target,sep,prereqs = text.partition(': ')
+    return [re.sub(r'\\(.)',r'\1',p).replace('$$','$') for p in re.findall(r'(?:\\.|[^\s\\])+',prereqs)]
+
+def header_dependencies(gccinname,compiler=None,cxxflags=None):
+    """Return every file the preprocessor reads for the gccxml input at
+    gccinname, by running the compiler with -M and the flags gccxml gets.
+
+    Unlike the files gccxml lists, this includes headers that only define
+    macros and headers none of whose declarations reach gccxml's output. If the
+    compiler can't list them (e.g. because it isn't GCC or compatible), a
+    warning is shown and an empty list returned.
+
+    """
+    args = [compiler or os.environ.get('CXX') or 'c++','-M','-D__GCCXML__','-I.']
+    if cxxflags: args.extend(shlex.split(cxxflags))
+    args.extend(['-x','c++',gccinname])
+    try:
+        p = subprocess.Popen(args,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        out,err = p.communicate()
+    except OSError as e:
+        out,err = None,str(e)
+    if out is None or p.returncode:
+        emit_warning(WARN_NORMAL,'could not list the headers "{0}" depends on: {1}'.format(gccinname,err.strip()))
+        return []
+    return parse_make_rule(out)
+
+def merge_files(*lists):
+    """Concatenate the lists of file names, leaving out any name that refers to
+    the same path as an earlier one."""
+    seen = set()
+    r = []
+    for l in lists:
+        for f in l:
+            a = os.path.abspath(f)
+            if a not in seen:
+                seen.add(a)
+                r.append(f)
+    return r
+
+def generate_intermediate(spec,outname,gccxml=None,compiler=None,cxxflags=None):
+    """Run gccxml on the input generated from spec and save its output in
+    outname.
+
+    The parameters are the same as in generate_module.
+
+    """
+    gccinname = outname + '.cpp'
+    with open(gccinname,'w') as gccin:
+        spec.print_gccxml_input(gccin)
+
+    try:
+        subprocess.check_call(gccxml_args(gccinname,gccxml,compiler,cxxflags) + ["-fxml="+outname])
+    finally:
+        os.remove(gccinname)
+
+# resolved on import because __file__ can be relative to a directory that is no
+# longer the current one when generator_files is called
+GENERATOR_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def generator_files():
+    """Return the source files of the generator itself (the templates and the
+    code that fills them in)."""
+    return sorted(os.path.join(GENERATOR_DIR,f) for f in os.listdir(GENERATOR_DIR) if f.endswith('.py'))
+
+def depfile_escape(name):
+    return name.replace('$','$$').replace('#','\\#').replace(' ','\\ ')
+
+def write_depfile(path,targets,deps):
+    """Write a Makefile rule to path, in the format of GCC's -MD option,
+    stating that every file in targets depends on every file in deps."""
+    seen = set()
+    with OutputFile(path) as f:
+        f.write(' '.join(depfile_escape(t) for t in targets) + ':')
+        for d in deps:
+            if d not in seen:
+                seen.add(d)
+                f.write(' \\\n  ' + depfile_escape(d))
+        f.write('\n')
+
+def generate_module(spec,path,gccxml=None,compiler=None,cxxflags=None,cache_dir=None,cache_size=DEFAULT_MAX_SIZE,filtered=True,fxml_start=True,profile=None,split=None,deps=None,memo=None,jobs=1,lint=False,instrument=False,call_counts=None):
+    """Run gccxml and generate the module's source and header files in path.
+    Returns the list of source files written.
 
     spec -- an instance of espec.ModuleDef
     path -- the path to write temporary files in
     gccxml -- the path to gccxml
     compiler -- the compiler for gccxml to mimic (see the --gccxml-compiler flag)
     cxxflags -- compiler flags
+    cache_dir -- if not None, the directory to cache the output of gccxml in
+        (see cache.ParseCache)
+    cache_size -- the maximum size of the cache in bytes
+    filtered -- if True, only load the declarations that the spec can refer
+        to (see gccxml.reachable_items)
+    fxml_start -- if True, have gccxml only output the declarations the spec
+        refers to (see the -fxml-start flag). If a symbol turns out to be
+        missing, gccxml is run once more without -fxml-start.
+    profile -- if not None, an instance of timing.Profile to record the time
+        and memory used by each phase in
+    split -- if not None, spread the code over multiple source files with this
+        many classes each (see espec.ModuleDef.write_file)
+    deps -- if not None, a list to append the name of every header the module
+        depends on to (see header_dependencies)
+    memo -- if not None, an instance of cache.MemoryCache to look for the
+        parsed interface in before running gccxml, and to store it in
+        afterwards
+    jobs -- the number of processes to render the module's classes and
+        functions in (see espec.ModuleDef.write_file)
+    lint -- if True, nothing is generated and the list of perflint.Finding
+        objects for the module is returned instead
+    instrument -- if True, the module counts the calls of each overload (see
+        espec.ModuleDef.write_file)
+    call_counts -- if not None, the counts of a call profile to order the
+        checks that choose an overload by (see espec.ModuleDef.write_file)
 
     """
-    gccinname = os.path.join(path,'in.cpp')
-    gccoutname = os.path.join(path,'parsetree')
+    with timing.activate(profile):
+        return generate_together([spec],path,'in.cpp','parsetree',gccxml,compiler,cxxflags,cache_dir,cache_size,filtered,fxml_start,split,deps,memo,jobs,lint,instrument,call_counts)[0]
 
-    with open(gccinname,'w') as gccin:
-        spec.print_gccxml_input(gccin)
+def generate_together(specs,path,gccinname,gccoutname,gccxml=None,compiler=None,cxxflags=None,cache_dir=None,cache_size=DEFAULT_MAX_SIZE,filtered=True,fxml_start=True,split=None,deps=None,memo=None,jobs=1,lint=False,instrument=False,call_counts=None):
+    """Generate the modules of every spec in specs from a single run of gccxml
+    and return a list with the list of source files of each module (or with
+    lint, the list of perflint.Finding objects of each module).
 
-    args = [gccxml or "gccxml",'-I.']
-    if compiler: args.extend(["--gccxml-compiler",compiler])
-    if cxxflags: args.extend(["--gccxml-cxxflags",cxxflags])
-    args.extend([gccinname,"-fxml="+gccoutname])
-    subprocess.check_call(args)
-    spec.write_file(path,getinterface(gccoutname))
+    The specs must have the same includes and different values of test_ns.
+    gccinname and gccoutname are the names of the temporary files to use,
+    relative to path. The other parameters are the same as in generate_module.
+
+    """
+    gccinname = os.path.join(path,gccinname)
+    gccoutname = os.path.join(path,gccoutname)
+
+    with timing.phase('gccxml input'):
+        gccin = StringIO()
+        seen = set()
+        for spec in specs:
+            spec.print_gccxml_input(gccin,seen)
+        gccin = gccin.getvalue()
+        with open(gccinname,'w') as f:
+            f.write(gccin)
+
+    cache = cache_dir and ParseCache(cache_dir,cache_size)
+    start = None
+    if fxml_start:
+        start = set()
+        for spec in specs: start.update(spec.gccxml_start_names())
+
+    names = None
+    if filtered:
+        names = set()
+        for spec in specs: names.update(spec.referenced_names())
+
+    while True:
+        args = gccxml_args(gccinname,gccxml,compiler,cxxflags,start)
+
+        scope = None
+        if memo is not None:
+            mkey = gccin,tuple(args)
+            scope,files = memo.get(mkey,names) or (None,None)
+
+        if scope is None:
+            tree = None
+            if cache:
+                with timing.phase('cache lookup'):
+                    # a filtered tree is only good for the names it was
+                    # filtered by
+                    key = cache.key(gccin,(args + ['-filtered=' + ','.join(sorted(names))]) if filtered else args)
+                    tree = cache.get(key)
+
+            if tree is None:
+                with timing.phase('gccxml'):
+                    subprocess.check_call(args + ["-fxml="+gccoutname])
+                with timing.phase('parse'):
+                    tree = parse_tree(gccoutname)
+                with timing.phase('dependencies'):
+                    tree = tree[0],merge_files(tree[1],header_dependencies(gccinname,compiler,cxxflags))
+                if filtered:
+                    with timing.phase('filter'):
+                        tree = reachable_items(tree[0],names,[spec.test_ns for spec in specs]),tree[1]
+                if cache:
+                    with timing.phase('cache store'):
+                        cache.put(key,tree,[gccinname])
+
+            with timing.phase('link'):
+                scope = link_tree(tree[0])
+            files = tree[1]
+            if memo is not None:
+                memo.put(mkey,scope,files,names,[gccinname])
+
+        try:
+            sources = []
+            with timing.phase('generate'):
+                for spec in specs:
+                    with timing.item('module',spec.name):
+                        if lint:
+                            sources.append(perflint.lint(spec.analyze(scope)))
+                        else:
+                            sources.append(spec.write_file(path,scope,split,jobs,instrument,call_counts))
+        except SymbolNotFoundError:
+            if start is None: raise
+
+            # adding the missing symbol to the start list would only reveal
+            # the next one, costing a run of gccxml per symbol, so the whole
+            # interface is read instead
+            start = None
+        else:
+            if deps is not None:
+                exclude = os.path.abspath(gccinname)
+                deps.extend(f for f in files
+                    if os.path.isfile(f) and os.path.abspath(f) != exclude)
+            return sources
+
+
+class BatchResult(object):
+    """The outcome of generating one module with generate_modules.
+
+    name -- the name of the module
+    group -- the index of the run of gccxml the module was parsed by. Modules
+        with the same group share the parsed interface.
+    sources -- the list of source files written, or None if it failed
+    headers -- the names of the headers gccxml read for the group
+    shared_seconds -- the time spent on the group apart from generating
+        modules (running gccxml, parsing, ...)
+    generate_seconds -- the time spent generating this module
+    error -- if generating the group failed, a description of the error
+
+    """
+    def __init__(self,name,group):
+        self.name = name
+        self.group = group
+        self.sources = None
+        self.headers = []
+        self.shared_seconds = 0.0
+        self.generate_seconds = 0.0
+        self.error = None
+
+def _generate_group(args,profile=None):
+    index,specs,path,options = args
+    results = [BatchResult(spec.name,index) for spec in specs]
+    profile = profile or timing.Profile()
+    headers = []
+    start = time.time()
+    try:
+        with timing.activate(profile):
+            name = specs[0].name if len(specs) == 1 else 'group{0}'.format(index)
+            sources = generate_together(specs,path,'in-{0}.cpp'.format(name),'{0}.parsetree'.format(name),deps=headers,**options)
+    except Exception as e:
+        for r in results: r.error = '{0}: {1}'.format(type(e).__name__,e)
+        return results
+
+    total = time.time() - start
+    for r,s in zip(results,sources):
+        r.sources = s
+        r.headers = headers
+        r.generate_seconds = profile.items[('module',r.name)].wall
+    shared = total - sum(r.generate_seconds for r in results)
+    for r in results: r.shared_seconds = shared
+    return results
+
+def generate_modules(specs,path,gccxml=None,compiler=None,cxxflags=None,cache_dir=None,cache_size=DEFAULT_MAX_SIZE,filtered=True,fxml_start=True,profile=None,split=None,jobs=None,instrument=False,call_counts=None):
+    """Generate the modules of many specs at once and return a list with a
+    BatchResult for each spec, in the same order.
+
+    Specs with the same includes are parsed by a single run of gccxml (their
+    test_ns attributes are changed to keep them apart) and the parsed interface
+    is used to generate all of them. The groups of specs are processed in
+    parallel by "jobs" processes (by default, one per CPU), or if there is only
+    one group, the classes of its modules are rendered by that many processes
+    (see espec.Renderer). A group that fails doesn't stop the others; its error
+    is stored in the results.
+
+    profile -- if not None, an instance of timing.Profile to record the phases
+        in. This only works if the groups are processed in this process, i.e.
+        if jobs is 1 or there is only one group.
+
+    The other parameters are the same as in generate_module.
+
+    """
+    groups = {}
+    order = []
+    for spec in specs:
+        key = tuple(spec.includes)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(spec)
+
+    options = dict(
+        gccxml=gccxml,
+        compiler=compiler,
+        cxxflags=cxxflags,
+        cache_dir=cache_dir,
+        cache_size=cache_size,
+        filtered=filtered,
+        fxml_start=fxml_start,
+        split=split,
+        instrument=instrument,
+        call_counts=call_counts)
+
+    tasks = []
+    for i,key in enumerate(order):
+        group = groups[key]
+        if len(group) > 1:
+            for j,spec in enumerate(group):
+                spec.test_ns = '{0}{1}'.format(TEST_NS,j)
+        tasks.append((i,group,path,options))
+
+    if jobs is None: jobs = multiprocessing.cpu_count()
+
+    # the processes of a pool can't start more processes, so the classes of a
+    # module are only rendered in parallel when there is a single group
+    options['jobs'] = jobs if len(tasks) == 1 else 1
+
+    jobs = min(jobs,len(tasks))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            # map_async with a timeout lets KeyboardInterrupt through
+            done = pool.map_async(_generate_group,tasks).get(0x7fffffff)
+        finally:
+            pool.terminate()
+    else:
+        done = [_generate_group(t,profile) for t in tasks]
 
+    results = dict((id(spec),r) for group,rs in zip(tasks,done) for spec,r in zip(group[1],rs))
+    return [results[id(spec)] for spec in specs]
 
+def write_batch_report(results,out):
+    """Write a table of the per-module timings in results (a list of
+    BatchResult objects) to the file-like object out."""
+    row = '{0:<30}{1:>7}{2:>12.3f}{3:>14.3f}  {4}\n'
+    out.write('{0:<30}{1:>7}{2:>12}{3:>14}  {4}\n'.format('module','group','shared (s)','generate (s)','result'))
+    for r in results:
+        out.write(row.format(r.name,r.group,r.shared_seconds,r.generate_seconds,
+            r.error or '{0} source file(s)'.format(len(r.sources))))
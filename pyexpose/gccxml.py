@@ -1,4 +1,5 @@
 import itertools
+import xml.parsers.expat
 
 from .xmlparse import *
 
@@ -24,13 +25,19 @@ def link_list(arg):
 def find_link(d,id):
     return d.get(id,gccxml_missing)
 
-class ArgList(list):
+class ArgList(tuple):
+    __slots__ = ()
+
+    def __getslice__(self,i,j):
+        return ArgList(tuple.__getslice__(self,i,j))
+
     def __str__(self):
         return ','.join(map(str,self))
 
     def __repr__(self):
         return 'ArgList(({0}))'.format(','.join(map(repr,self)))
 
+no_args = ArgList() # shared by every function that takes no arguments
 
 
 class CPPSymbol(object):
@@ -49,20 +56,54 @@ class CPPSymbol(object):
 
         return '::'.join(filter(None,n))
 
+# slots that only hold values derived from the other slots
+CACHE_SLOTS = frozenset(['typestr_cache','type_id_cache','member_index','lookup_cache','find_cache'])
+
+def slots_state(self):
+    """A __getstate__ method that leaves out the slots in CACHE_SLOTS."""
+    state = {}
+    for cls in type(self).__mro__:
+        slots = getattr(cls,'__slots__',())
+        if isinstance(slots,basestring): slots = (slots,)
+        for s in slots:
+            if s not in CACHE_SLOTS and hasattr(self,s):
+                state[s] = getattr(self,s)
+    return None,state
+
+# maps the result of CPPType.typestr() to an integer
+type_ids = {}
+
 class CPPType(object):
-    __slots__ = 'typestr_cache'
+    __slots__ = 'typestr_cache','type_id_cache'
+
+    def type_id(self):
+        """Return an integer that is the same for every type that has the same
+        typestr()."""
+        try:
+            return self.type_id_cache
+        except AttributeError:
+            s = self.typestr()
+            r = type_ids.get(s)
+            if r is None:
+                r = len(type_ids)
+                type_ids[s] = r
+            self.type_id_cache = r
+            return r
 
     def __hash__(self):
-        return hash(self.typestr())
+        return self.type_id()
 
     def __eq__(self,b):
-        if isinstance(b,CPPType): return self.typestr() == b.typestr()
+        if isinstance(b,CPPType): return self.type_id() == b.type_id()
         return NotImplemented
 
     def __ne__(self,b):
-        if isinstance(b,CPPType): return self.typestr() != b.typestr()
+        if isinstance(b,CPPType): return self.type_id() != b.type_id()
         return NotImplemented
 
+    # type IDs are only meaningful inside the process that assigned them
+    __getstate__ = slots_state
+
     def typestr(self,deriv=''):
         if deriv:
             return self._typestr(deriv)
@@ -83,7 +124,7 @@ class CPPBasicType(CPPType,CPPSymbol):
         return '{0} {1}'.format(self.full_name,deriv) if deriv else self.full_name
 
 class CPPClass(CPPBasicType):
-    __slots__ = 'bases','members','size'
+    __slots__ = 'bases','members','size','member_index','lookup_cache','find_cache'
 
     def __init__(self,name = None):
         self.name = name
@@ -125,6 +166,10 @@ class CPPEllipsis(object):
     def __str__(self):
         return '...'
 
+    def __reduce__(self):
+        # preserve the identity of the single instance when pickled
+        return 'cppellipsis'
+
     def link(self,items):
         pass
 
@@ -134,7 +179,7 @@ class CPPFunctionType(CPPType):
     __slots__ = 'args','returns'
 
     def __init__(self):
-        self.args = ArgList()
+        self.args = no_args
 
     def link(self,items):
         self.returns = find_link(items,self.returns)
@@ -147,7 +192,7 @@ class CPPFunction(CPPSymbol):
     __slots__ = 'name','returns','args','context','throw','attributes'
 
     def __init__(self):
-        self.args = ArgList()
+        self.args = no_args
 
     def link(self,items):
         self.returns = find_link(items,self.returns)
@@ -181,7 +226,8 @@ class CPPFundamentalType(CPPBasicType):
         pass
 
 class CPPNamespace(CPPSymbol):
-    __slots__ = 'name','members','context'
+    __slots__ = 'name','members','context','member_index','find_cache'
+    __getstate__ = slots_state
 
     def __init__(self):
         self.members = []
@@ -197,7 +243,7 @@ class CPPConstructor(CPPSymbol):
     __slots__ = 'name','access','args','artificial','context'
 
     def __init__(self):
-        self.args = ArgList()
+        self.args = no_args
 
     def link(self,items):
         for a in self.args: a.link(items)
@@ -206,7 +252,7 @@ class CPPMethod(CPPSymbol):
     __slots__ = 'name','returns','access','const','virtual','pure_virtual','static','args','context','throw','attributes'
 
     def __init__(self):
-        self.args = ArgList()
+        self.args = no_args
 
     def link(self,items):
         self.returns = find_link(items,self.returns)
@@ -216,7 +262,7 @@ class CPPMethodType(CPPType):
     __slots__ = 'basetype','returns','args','const'
 
     def __init__(self):
-        self.args = ArgList()
+        self.args = no_args
 
     def link(self,items):
         self.returns = find_link(items,self.returns)
@@ -281,7 +327,7 @@ class CPPCvQualifiedType(CPPType):
         return self.type.typestr(' '.join(a))
 
 class CPPUnion(CPPBasicType):
-    __slots__ = 'size','members'
+    __slots__ = 'size','members','member_index','find_cache'
     def __init__(self):
         self.members = []
 
@@ -343,36 +389,72 @@ no_default = _no_default()
 def zero_one(x):
     return bool(int(x))
 
-def space_sep_set(x):
-    return frozenset(x.split())
+def space_sep_set(x,cache={}):
+    # there are only a few distinct values, so they are shared
+    r = cache.get(x)
+    if r is None:
+        r = frozenset(x.split())
+        cache[x] = r
+    return r
 
+def intern_id(x):
+    # the generic parser (xmlparse.parse) passes unicode strings, which can't
+    # be interned
+    return intern(x) if x.__class__ is str else x
 
-def common_init(keys):
-    def inner(self,args):
-        o = self.OType()
-        self.r = args['id'],o
-
-        for k in keys:
-            default = no_default
-            if isinstance(k,tuple):
-                attr = k[0]
-                f = k[1]
-                if len(k) > 2: default = k[2]
-            else:
-                attr = k
-                f = None
+def id_list(x):
+    return [intern(str(id)) for id in x.split()]
 
-            input = args.get(attr)
-            if input is None:
-                if default is no_default:
-                    raise ParseError('The required attribute "{0}" was not found'.format(attr))
-                input = default
-            elif f:
-                input = f(input)
+# attributes that contain the ID of another element, or a name
+INTERN_ATTRS = frozenset(['context','type','returns','basetype','name'])
 
-            setattr(o,attr,input)
 
-    return inner
+def common_init(keys):
+    """Create an __init__ method for a tag class that copies the attributes
+    named by keys to a new instance of the class's OType.
+
+    Each key is either the name of a required attribute or a tuple containing
+    the name, a conversion function or None and, optionally, a default value.
+    An attribute without a default value is required.
+
+    Since __init__ is called for every element, it is compiled into a function
+    with one statement per key instead of interpreting keys each time.
+
+    """
+    ns = {'ParseError' : ParseError, 'intern_id' : intern_id}
+    code = [
+        'def __init__(self,args):',
+        '    o = self.OType()',
+        "    self.r = intern_id(args['id']),o",
+        '    get = args.get']
+
+    for i,k in enumerate(keys):
+        default = no_default
+        f = None
+        if isinstance(k,tuple):
+            attr = k[0]
+            f = k[1]
+            if len(k) > 2: default = k[2]
+        else:
+            attr = k
+
+        value = 'v'
+        if f is None and attr in INTERN_ATTRS:
+            value = 'intern_id(v)'
+        elif f:
+            ns['f{0}'.format(i)] = f
+            value = 'f{0}(v)'.format(i)
+
+        code.append('    v = get({0!r})'.format(attr))
+        if default is no_default:
+            code.append('    if v is None: raise ParseError({0!r})'.format('The required attribute "{0}" was not found'.format(attr)))
+            code.append('    o.{0} = {1}'.format(attr,value))
+        else:
+            ns['d{0}'.format(i)] = default
+            code.append('    o.{0} = d{1} if v is None else {2}'.format(attr,i,value))
+
+    exec '\n'.join(code) in ns
+    return ns['__init__']
 
 def bool_keys(*keys):
     return [(k,zero_one,False) for k in keys]
@@ -380,9 +462,10 @@ def bool_keys(*keys):
 
 class tag_Argument(tag):
     def __init__(self,args):
+        name = args.get("name")
         self.r = CPPArgument(
-            args["type"],
-            args.get("name"),
+            intern_id(args["type"]),
+            name and intern_id(name),
             args.get("default"))
 
 class tag_Ellipsis(tag):
@@ -390,7 +473,13 @@ class tag_Ellipsis(tag):
         self.r = cppellipsis
 
 def function_handle_child(self,data):
-    self.r[1].args.append(data)
+    if self.args is None: self.args = []
+    self.args.append(data)
+
+def function_end(self):
+    if self.args: self.r[1].args = ArgList(self.args)
+    return self.r
+
 function_handlers = {
     'Argument' : (tag_Argument,function_handle_child),
     'Ellipsis' : (tag_Ellipsis,function_handle_child)}
@@ -399,7 +488,7 @@ function_handlers = {
 class tag_Base(tag):
     def __init__(self,args):
         self.r = CPPBase()
-        self.r.type = args['type']
+        self.r.type = intern_id(args['type'])
         self.r.access = parse_access(args['access'])
         self.r.offset = int(args['offset'])
         v = args.get('virtual')
@@ -417,6 +506,8 @@ class tag_Function(tag):
     OType = CPPFunction
     __init__ = common_init(["name","returns",'context',('throw',None,None),('attributes',space_sep_set,frozenset())])
     tag_handlers = function_handlers
+    args = None
+    end = function_end
 
 class tag_PointerType(tag):
     OType = CPPPointerType
@@ -432,6 +523,8 @@ class tag_FunctionType(tag):
     OType = CPPFunctionType
     __init__ = common_init(["returns"])
     tag_handlers = function_handlers
+    args = None
+    end = function_end
 
 class tag_Namespace(tag):
     OType = CPPNamespace
@@ -445,11 +538,15 @@ class tag_Method(tag):
     OType = CPPMethod
     __init__ = common_init(["name","returns",("access",parse_access),'context',('throw',None,None),('attributes',space_sep_set,frozenset())] + bool_keys("const","virtual","pure_virtual","static"))
     tag_handlers = function_handlers
+    args = None
+    end = function_end
 
 class tag_Constructor(tag):
     OType = CPPConstructor
     __init__ = common_init([('name',None,None),("access",parse_access),'context'] + bool_keys('artificial'))
     tag_handlers = function_handlers
+    args = None
+    end = function_end
 
 class tag_OperatorMethod(tag_Method):
     OType = CPPOperatorMethod
@@ -470,13 +567,15 @@ class tag_MethodType(tag):
     OType = CPPMethodType
     __init__ = common_init(["basetype","returns"] + bool_keys("const"))
     tag_handlers = function_handlers
+    args = None
+    end = function_end
 
 class tag_OperatorFunction(tag_Function):
     OType = CPPOperatorFunction
 
 class tag_Union(tag):
     OType = CPPUnion
-    __init__ = common_init([('size',int),("name",None,None),("members",unicode.split),'context'])
+    __init__ = common_init([('size',int),("name",None,None),("members",id_list),'context'])
 
 class tag_Destructor(tag):
     OType = CPPDestructor
@@ -507,9 +606,14 @@ class tag_Unimplemented(tag):
     OType = GCCXMLUnimplemented
     __init__ = common_init([])
 
+class tag_File(tag):
+    def __init__(self,args):
+        self.r = args['name']
+
 class tag_root(tag):
     def __init__(self,args):
         self.r = {}
+        self.files = []
 
     @tag_handler('Class',tag_Class)
     @tag_handler('Struct',tag_Class)
@@ -537,21 +641,104 @@ class tag_root(tag):
     def child(self,data):
         self.r[data[0]] = data[1]
 
+    @tag_handler("File",tag_File)
+    def filechild(self,data):
+        self.files.append(data)
+
     # don't care about these (yet):
     @tag_handler("Converter",tag)
     @tag_handler("NamespaceAlias",tag)
-    @tag_handler("File",tag)
     def otherchild(self,data):
         pass
 
-
-
-def getinterface(path):
+    def end(self):
+        return self.r,self.files
+
+
+
+CHUNK_SIZE = 0x100000
+
+def parse_tree(path):
+    """Read the output of GCCXML without linking it.
+
+    Returns a tuple containing a dict that maps GCCXML IDs to unlinked objects
+    and a list of the names of every file GCCXML read.
+
+    This does the same thing as xmlparse.parse(path,'GCC_XML',tag_root) but is
+    specialized for GCCXML's output, which can be very large: the attributes
+    are passed to the tag classes as plain dicts of byte strings, IDs are
+    interned, text is ignored (GCCXML only emits whitespace) and the file is
+    fed to expat in large chunks.
+
+    """
+    # maps each tag class to a dict that maps the names of the tags it accepts
+    # to a tag class and the function that receives its result
+    tables = {}
+    def add_table(cls):
+        if cls not in tables:
+            t = dict((name,h[0:2]) for name,h in getattr(cls,'tag_handlers',{}).iteritems())
+            tables[cls] = t
+            for c,f in t.itervalues(): add_table(c)
+    add_table(tag_root)
+
+    # each item is a tuple containing a tag object, the function to pass the
+    # result of the tag object to and the handlers for the tag's children
+    stack = [(None,None,{'GCC_XML' : (tag_root,None)})]
+    result = []
+
+    def start_tag(name,attr):
+        try:
+            c,f = stack[-1][2][name]
+        except KeyError:
+            raise ParseError('unexpected tag "{0}"'.format(name))
+
+        try:
+            t = c(attr)
+        except KeyError as e:
+            raise ParseError('Required attribute "{0}" is missing'.format(e.args[0]))
+
+        stack.append((t,f,tables[c]))
+
+    def end_tag(name):
+        t,f,h = stack.pop()
+        if f is None:
+            result.append(t.end())
+        else:
+            f(stack[-1][0],t.end())
+
+    p = xml.parsers.expat.ParserCreate()
+    p.returns_unicode = False
+    p.StartElementHandler = start_tag
+    p.EndElementHandler = end_tag
+
+    with open(path,'rb') as f:
+        try:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                p.Parse(data,not data)
+                if not data: break
+        except ParseError as e:
+            e.info['file'] = path
+            e.info['line #'] = p.CurrentLineNumber
+            raise
+
+    assert len(result) == 1
+    return result[0]
+
+def id_order(id):
+    """A sort key that puts "_9" before "_10"."""
+    return len(id),id
+
+def link_tree(items):
+    """Replace the IDs in the items returned by parse_tree with the objects
+    they refer to and return the root namespace."""
     rootnamespace = None
-    items = parse(path,'GCC_XML',tag_root)
 
-    # fill "members" using context, because the "members" list doesn't seem to list all members
-    for item in items.itervalues():
+    # fill "members" using context, because the "members" list doesn't seem to
+    # list all members (in the order of the IDs, which GCCXML assigns
+    # sequentially, so that the order doesn't depend on how the dict hashes)
+    for id in sorted(items,key=id_order):
+        item = items[id]
         item.link(items)
         if hasattr(item,'context'):
             if item.context is None:
@@ -561,4 +748,81 @@ def getinterface(path):
                 c.members.append(item)
                 item.context = c
 
+    # assign the type IDs now, so comparing types later is cheap
+    for item in items.itervalues():
+        if isinstance(item,CPPType):
+            try:
+                item.type_id()
+            except AttributeError:
+                # the type refers to something GCCXML never defined (see
+                # _GCCXMLMissing) and can't be used anyway
+                pass
+
     return rootnamespace
+
+def item_references(item):
+    """Yield the IDs of the items that an unlinked item refers to."""
+    for attr in ('context','type','returns','basetype'):
+        id = getattr(item,attr,None)
+        if id is not None: yield id
+
+    for a in getattr(item,'args',()):
+        if a is not cppellipsis: yield a.type
+
+    for b in getattr(item,'bases',()):
+        yield b.type
+
+    if isinstance(item,CPPUnion):
+        for id in item.members: yield id
+
+def reachable_items(items,names,scopes=()):
+    """Return the subset of items that the declarations named by names depend
+    on.
+
+    items is the dict returned by parse_tree. The starting points are every
+    declaration at namespace scope whose name is in names and every member of
+    the namespaces whose names are in scopes. From there, contexts, types, arguments,
+    bases and, for classes and unions, members are followed. Namespaces are
+    always kept but their members are not followed.
+
+    """
+    children = {}
+    for id,item in items.iteritems():
+        c = getattr(item,'context',None)
+        if c is not None:
+            children.setdefault(c,[]).append(id)
+
+    keep = {}
+    pending = []
+    for id,item in items.iteritems():
+        if isinstance(item,CPPNamespace):
+            keep[id] = item
+            if item.name in scopes:
+                pending.extend(children.get(id,()))
+        elif (getattr(item,'canon_name',None) in names and
+                isinstance(items.get(getattr(item,'context',None)),CPPNamespace)):
+            pending.append(id)
+
+    while pending:
+        id = pending.pop()
+        if id in keep: continue
+        item = items.get(id)
+        if item is None: continue
+        keep[id] = item
+
+        pending.extend(item_references(item))
+        if isinstance(item,(CPPClass,CPPUnion)):
+            pending.extend(children.get(id,()))
+
+    return keep
+
+def getinterface(path,names=None,scopes=()):
+    """Read the output of GCCXML and return the root namespace.
+
+    If names is not None, only the declarations that reachable_items returns
+    for names and scopes are loaded.
+
+    """
+    items = parse_tree(path)[0]
+    if names is not None: items = reachable_items(items,names,scopes)
+    return link_tree(items)
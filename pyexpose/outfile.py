@@ -0,0 +1,78 @@
+"""Write generated files without touching the ones that haven't changed.
+
+Build tools decide what to recompile by comparing modification times, so
+rewriting a file with the same contents forces everything that depends on it
+to be rebuilt. An OutputFile collects what is written to it and, when it is
+closed, only replaces the file on disk if the contents differ. The file is
+replaced by renaming a temporary file, so a build never sees it half-written.
+
+"""
+
+import os
+import os.path
+import tempfile
+from cStringIO import StringIO
+
+
+def same_contents(path,data):
+    """Return True if the file at path exists and contains exactly data."""
+    try:
+        if os.path.getsize(path) != len(data): return False
+        with open(path,'rb') as f:
+            return f.read() == data
+    except (IOError,OSError):
+        return False
+
+def replace_file(path,data):
+    """Atomically replace the contents of the file at path with data."""
+    fd,tmpname = tempfile.mkstemp('.tmp',os.path.basename(path) + '.',os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd,'wb') as f:
+            f.write(data)
+        os.chmod(tmpname,0666 & ~current_umask())
+        os.rename(tmpname,path)
+    except:
+        os.remove(tmpname)
+        raise
+
+def current_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+class OutputFile(object):
+    """A file-like object for writing the file at path.
+
+    Nothing is written to disk until close is called. If the body of a with
+    statement using an OutputFile raises an exception, the file is left
+    untouched.
+
+    """
+    def __init__(self,path):
+        self.path = path
+        self.buffer = StringIO()
+        self.changed = None
+
+    def write(self,data):
+        self.buffer.write(data)
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+    def close(self):
+        """Write the contents to path if they differ from what is already
+        there and return True if the file was written."""
+        if self.changed is None:
+            data = self.buffer.getvalue()
+            self.changed = not same_contents(self.path,data)
+            if self.changed: replace_file(self.path,data)
+            self.buffer.close()
+        return self.changed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,type,value,traceback):
+        if type is None: self.close()
+        return False
@@ -0,0 +1,234 @@
+"""Find the parts of a module spec that put calls on slow paths.
+
+lint takes the typed model of a module (see espec.ModuleDef.analyze) and
+returns a Finding for each choice in the spec that makes the generated code
+slower than it could be, along with the change to the spec that avoids it.
+
+The costs are rough estimates for CPython 2.7 on a current x86-64 machine, only
+meant to tell the findings apart by importance. pyexpose.bench.runtime measures
+the real overhead of the generated code.
+
+"""
+
+from . import gccxml
+from .cpptypes import *
+from .espec import methods_that_return
+
+
+# estimated costs, in nanoseconds
+COST_ARG_TUPLE = 40 # building and unpacking a tuple instead of using METH_O
+COST_KEYWORD = 10 # a dictionary look-up, per argument given by name
+COST_TYPECHECK = 10 # PyObject_TypeCheck of an instance of a derived type
+COST_MODE_SWITCH = 2 # the switch on the mode variable
+COST_GC_TRACK = 20 # tracking and untracking an object
+COST_NEW_OBJECT = 60 # allocating and initializing a new object
+COST_COPY_PER_BYTE = 0.1
+
+# return-semantic="copy" is only reported for classes at least this big
+LARGE_CLASS_BYTES = 64
+
+# sizeof(PyGC_Head) with 64-bit pointers
+GC_HEAD_BYTES = 32
+
+RET_SEMANTIC_NAMES = {
+    RET_MANAGED_REF : 'managedref',
+    RET_MANAGED_PTR : 'managedptr',
+    RET_UNMANAGED_REF : 'unmanagedref'}
+
+
+class Finding(object):
+    """A slow path in the generated code.
+
+    where -- the class, method or function it affects
+    problem -- what makes it slow
+    cost -- the estimated cost, as text
+    fix -- the change to the spec that avoids it
+    ns -- the estimated cost per call in nanoseconds, used to sort the findings
+
+    """
+    def __init__(self,where,problem,cost,fix,ns):
+        self.where = where
+        self.problem = problem
+        self.cost = cost
+        self.fix = fix
+        self.ns = ns
+
+    def __repr__(self):
+        return '<Finding: {0}: {1}>'.format(self.where,self.problem)
+
+
+def func_where(f,c=None):
+    if c: return '{0}.{1}'.format(c.name,f.name)
+    return f.name
+
+def keyword_findings(f,c=None):
+    if f.raw_overload or not f.named_args(): return []
+
+    ov = f.overloads[0]
+    names = [a.name for a in ov.args if a.name]
+    if len(ov.args) == 1 and mandatory_args(ov) == 1:
+        return [Finding(
+            func_where(f,c),
+            'the argument "{0}" has a name, so it can be given as a keyword and METH_O can\'t be used'.format(names[0]),
+            '~{0} ns per call for the argument tuple'.format(COST_ARG_TUPLE),
+            'add keywords="false" to <def name="{0}">'.format(f.name),
+            COST_ARG_TUPLE)]
+
+    return [Finding(
+        func_where(f,c),
+        'the arguments have names, so METH_KEYWORDS and name look-ups are used',
+        '~{0} ns per argument given by name, for the dictionary look-up'.format(COST_KEYWORD),
+        'add keywords="false" to <def name="{0}"> if the arguments are never given by name'.format(f.name),
+        COST_KEYWORD)]
+
+def copy_findings(f,c=None):
+    r = []
+    for ov in f.overloads:
+        # a class returned by value has to be copied whatever the
+        # return-semantic is
+        if ov.retsemantic != RET_COPY or not isinstance(strip_cvq(ov.returns),(gccxml.CPPPointerType,gccxml.CPPReferenceType)):
+            continue
+        t = strip_refptr(ov.returns)
+        if not (isinstance(t,gccxml.CPPClass) and t.size): continue
+        size = t.size // 8
+        if size < LARGE_CLASS_BYTES: continue
+
+        if c:
+            fix = 'use return-semantic="managedref", which refers to the object inside {0} instead of copying it'.format(c.name)
+        else:
+            fix = 'use return-semantic="unmanagedref" if the object outlives every reference to it from Python'
+        ns = COST_NEW_OBJECT + int(size * COST_COPY_PER_BYTE)
+        r.append(Finding(
+            func_where(f,c),
+            'return-semantic="copy" copies {0} ({1} bytes) on every call'.format(t.typestr(),size),
+            '~{0} ns per call for the new object and the copy'.format(ns),
+            fix,
+            ns))
+    return r
+
+def gc_findings(c,conv):
+    # instances of classes without a dictionary and without anything to visit
+    # aren't tracked anyway
+    if not (c.use_gc() and c._instance_dict) or c.gc_vars(conv): return []
+
+    # a class can't omit the dictionary if its bases have one, and classes
+    # involved in multiple inheritance must all agree on it
+    if c.multi_inherit or c.has_multi_inherit_subclass(): return []
+    if any(b._instance_dict for b in ancestors(c)): return []
+
+    return [Finding(
+        c.name,
+        'the garbage collector tracks every instance only for the sake of the instance dictionary; the C++ object has nothing to visit',
+        '~{0} ns per instance created and {1} extra bytes per instance, and the instances are visited in every collection'.format(COST_GC_TRACK,GC_HEAD_BYTES),
+        'add instance-dict="false" use-gc="false" to <class name="{0}"> if instances never need attributes set from Python'.format(c.name),
+        COST_GC_TRACK)]
+
+def ancestors(c):
+    for b in c.bases:
+        yield b
+        for a in ancestors(b): yield a
+
+def connected(c):
+    """Return the classes connected to c by inheritance, including c."""
+    seen = set([c])
+    pending = [c]
+    while pending:
+        x = pending.pop()
+        for y in x.bases + x.derived:
+            if y not in seen:
+                seen.add(y)
+                pending.append(y)
+    return seen
+
+def mode_var_reason(c):
+    """Return a (reason,fix) tuple telling why c needs the mode variable by
+    itself, None if it doesn't, or (reason,None) if the spec can't avoid it.
+    This follows TypedClassDef.check_needs_mode_var."""
+    if c._needs_mode_var:
+        return 'require-mode-var="true" is set','remove require-mode-var="true" from <class name="{0}">'.format(c.name)
+    if c.features:
+        sems = ', '.join(sorted(RET_SEMANTIC_NAMES[f] for f in c.features))
+        return ('some methods return {0} with return-semantic {1}'.format(c.type.typestr(),sems),
+            'return {0} with return-semantic="copy" instead'.format(c.type.typestr()))
+    if (c.newconstructor and c.no_destruct) or c.uninstantiatable():
+        return None
+    if c.no_destruct:
+        return ('it is constructed in __init__, so an instance can exist before its C++ object',
+            'construct {0} with <new> instead of <init>'.format(c.name))
+    return 'it has a destructor that must not run before the constructor',None
+
+def mode_var_findings(classes):
+    r = []
+    done = set()
+    for c in classes:
+        if not c.needs_mode_var or c in done: continue
+
+        group = connected(c)
+        done.update(group)
+        reasons = [(x,mode_var_reason(x)) for x in classes if x in group]
+        reasons = [(x,reason) for x,reason in reasons if reason]
+
+        # if any class needs the variable regardless, changing the others
+        # doesn't help
+        if not reasons or any(reason[1] is None for x,reason in reasons): continue
+
+        affected = ', '.join(x.name for x in classes if x in group)
+        for x,(reason,fix) in reasons:
+            r.append(Finding(
+                x.name,
+                'the objects of {0} have a mode variable because {1}'.format(affected,reason),
+                '~{0} ns per access to the C++ object for the switch in cast_base, and 4 bytes per instance'.format(COST_MODE_SWITCH),
+                fix,
+                COST_MODE_SWITCH))
+    return r
+
+def count_nodes(node):
+    return sum(1 + count_nodes(d) for d in node.derived_nodes)
+
+def multi_inherit_findings(c):
+    if not c.has_multi_inherit_subclass(): return []
+
+    node = c.heirarchy_chain()
+    checks = count_nodes(node)
+    subclasses = sorted(d.name for d in connected(c) if d.multi_inherit and c in ancestors(d))
+    ns = checks * COST_TYPECHECK
+    return [Finding(
+        c.name,
+        'because {0} inherit{1} from more than one class, get_base_{2} checks for each of them before using the object'.format(
+            ', '.join(subclasses),'s' if len(subclasses) == 1 else '',c.name),
+        '~{0} ns per method call and attribute access ({1} type check{2}, for instances of derived types)'.format(
+            ns,checks,'s' if checks != 1 else ''),
+        'leave out the <class> of {0}, or of {1} other bases, if they don\'t need to be exposed'.format(
+            ' and '.join(subclasses),'their' if len(subclasses) > 1 else 'its'),
+        ns)]
+
+def lint(model):
+    """Return a list of Finding objects for the module whose typed model is
+    model (the return value of espec.ModuleDef.analyze), costliest first."""
+    r = []
+    for c in model.classes:
+        for m in c.methods:
+            if not m.inherited: r.extend(keyword_findings(m,c))
+        for name,m in methods_that_return(c):
+            if not getattr(m,'inherited',False): r.extend(copy_findings(m,c))
+        r.extend(gc_findings(c,model.conv))
+        r.extend(multi_inherit_findings(c))
+    r.extend(mode_var_findings(model.classes))
+    for f in model.functions:
+        r.extend(keyword_findings(f))
+        r.extend(copy_findings(f))
+
+    # the sort is stable, so findings with the same cost stay in the order of
+    # the module
+    r.sort(key=lambda f: -f.ns)
+    return r
+
+def write_report(name,findings,out):
+    """Write findings to the file-like object out, one after another, each
+    starting with name (e.g. the name of the spec-file)."""
+    if not findings:
+        out.write('{0}: no slow paths found\n'.format(name))
+        return
+
+    for f in findings:
+        out.write('{0}: {1}: {2}\n    cost: {3}\n    fix: {4}\n'.format(name,f.where,f.problem,f.cost,f.fix))
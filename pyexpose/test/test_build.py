@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+from distutils import ccompiler, sysconfig
+
+from pyexpose.build import Builder, read_dependencies
+
+
+def write_file(file,data):
+    with open(file,'w') as f:
+        f.write(data)
+
+def new_compiler():
+    cc = ccompiler.new_compiler()
+    sysconfig.customize_compiler(cc)
+    return cc
+
+
+class TestBuilder(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.build_dir = os.path.join(self.dir,'build')
+        self.header = os.path.join(self.dir,'a.h')
+        self.source = os.path.join(self.dir,'a.cpp')
+        write_file(self.header,'int a();\n')
+        write_file(self.source,'#include "a.h"\nint a() { return 1; }\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def build(self,macros=(),cache_dir=None):
+        b = Builder(new_compiler(),self.build_dir,1,cache_dir,macros=macros)
+        objects = b.add_sources([self.source])
+        b.run()
+        return b,objects[0]
+
+    def test_object_name(self):
+        b = Builder(new_compiler(),self.build_dir,1)
+        names = [
+            os.path.join(self.build_dir,'m.cpp'),
+            os.path.join(self.build_dir,'m_1.cpp'),
+            os.path.join('a','m.cpp'),
+            os.path.join('b','m.cpp'),
+            os.path.join(os.pardir,'m.cpp')]
+        objects = [b.object_name(n) for n in names]
+        self.assertEqual(len(set(objects)),len(objects))
+        self.assertEqual(objects[0],os.path.join(self.build_dir,'m.o'))
+        for o in objects:
+            self.assertFalse(os.path.relpath(o,self.build_dir).startswith(os.pardir))
+
+    def test_up_to_date(self):
+        b,obj = self.build()
+        self.assertEqual((b.compiled,b.current),(1,0))
+        self.assertIn(os.path.realpath(self.header),[os.path.realpath(d) for d in read_dependencies(obj + '.d')])
+
+        mtime = int(os.path.getmtime(obj)) - 10
+        os.utime(obj,(mtime,mtime))
+        os.utime(obj + '.cmd',(mtime,mtime))
+        os.utime(self.source,(mtime - 10,mtime - 10))
+        os.utime(self.header,(mtime - 10,mtime - 10))
+        b,obj = self.build()
+        self.assertEqual((b.compiled,b.current),(0,1))
+        self.assertEqual(os.path.getmtime(obj),mtime)
+
+        # a header the source includes changed
+        os.utime(self.header,(mtime + 5,mtime + 5))
+        b,obj = self.build()
+        self.assertEqual((b.compiled,b.current),(1,0))
+
+        # the command changed
+        b,obj = self.build([('A_MACRO',None)])
+        self.assertEqual((b.compiled,b.current),(1,0))
+
+    def test_cached_same_object(self):
+        cache_dir = os.path.join(self.dir,'cache')
+        b,obj = self.build(cache_dir=cache_dir)
+        self.assertEqual((b.compiled,b.cached),(1,0))
+
+        # touching the source doesn't change the object file, which is left
+        # alone, but the next build has to know that it's up to date
+        mtime = int(os.path.getmtime(obj)) - 10
+        os.utime(obj,(mtime,mtime))
+        os.utime(obj + '.cmd',(mtime,mtime))
+        os.utime(self.source,(mtime + 5,mtime + 5))
+        b,obj = self.build(cache_dir=cache_dir)
+        self.assertEqual((b.compiled,b.cached,b.current),(0,1,0))
+        self.assertEqual(os.path.getmtime(obj),mtime)
+
+        b,obj = self.build(cache_dir=cache_dir)
+        self.assertEqual((b.compiled,b.cached,b.current),(0,0,1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import os.path
+import tempfile
+import shutil
+
+
+from pyexpose import gccxml
+from pyexpose.cache import ParseCache, ObjectCache, MemoryCache
+
+
+parsetree = '''<?xml version="1.0"?>
+<GCC_XML cvs_revision="1.135">
+  <Namespace id="_1" name="::" members="_3 _4 _5 " mangled="_Z2::" demangled="::"/>
+  <Class id="_3" name="MyClass" context="_1" mangled="7MyClass" demangled="MyClass" location="f1:2" file="f1" line="2" members="_6 _7 " bases="" size="32" align="32"/>
+  <Function id="_4" name="func" returns="_8" context="_1" location="f1:7" file="f1" line="7" extern="1">
+    <Argument name="a" type="_8" location="f1:7" file="f1" line="7"/>
+    <Ellipsis/>
+  </Function>
+  <Typedef id="_5" name="type_sint" type="_8" context="_1" location="f1:9" file="f1" line="9"/>
+  <Field id="_6" name="value" type="_8" offset="0" context="_3" access="public" location="f1:4" file="f1" line="4"/>
+  <Constructor id="_7" name="MyClass" explicit="1" context="_3" access="public" location="f1:5" file="f1" line="5" extern="1">
+    <Argument name="value" type="_8" location="f1:5" file="f1" line="5"/>
+  </Constructor>
+  <FundamentalType id="_8" name="int" size="32" align="32"/>
+  <File id="f1" name="{header}"/>
+</GCC_XML>
+'''
+
+header = '''
+class MyClass {
+public:
+    int value;
+    explicit MyClass(int value);
+};
+
+int func(int a,...);
+
+typedef int type_sint;
+'''
+
+def write_file(file,data):
+    with open(file,'w') as f:
+        f.write(data)
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.header = os.path.join(self.dir,'main.h')
+        self.tree = os.path.join(self.dir,'parsetree')
+        write_file(self.header,header)
+        write_file(self.tree,parsetree.format(header=self.header))
+        self.cache = ParseCache(os.path.join(self.dir,'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_files(self):
+        items,files = gccxml.parse_tree(self.tree)
+        self.assertEqual(files,[self.header])
+
+    def test_roundtrip(self):
+        key = self.cache.key('input',['gccxml','in.cpp'])
+        self.assertIsNone(self.cache.get(key))
+
+        self.cache.put(key,gccxml.parse_tree(self.tree))
+        items,files = self.cache.get(key)
+        root = gccxml.link_tree(items)
+
+        c = root.find('MyClass')[0]
+        self.assertEqual(sorted(m.name for m in c.members),['MyClass','value'])
+        f = root.find('func')[0]
+        self.assertIs(f.args[1],gccxml.cppellipsis)
+        self.assertEqual(f.returns,c.find_member('value')[0].type)
+
+    def test_key(self):
+        k = self.cache.key('input',['gccxml','in.cpp'])
+        self.assertEqual(k,self.cache.key('input',['gccxml','in.cpp']))
+        self.assertNotEqual(k,self.cache.key('input2',['gccxml','in.cpp']))
+        self.assertNotEqual(k,self.cache.key('input',['gccxml','-DX','in.cpp']))
+
+    def test_header_changed(self):
+        key = self.cache.key('input',[])
+        self.cache.put(key,gccxml.parse_tree(self.tree))
+        write_file(self.header,header + '\nint func2();\n')
+        self.assertIsNone(self.cache.get(key))
+
+    def test_evict(self):
+        self.cache.max_size = 0
+        key = self.cache.key('input',[])
+        self.cache.put(key,gccxml.parse_tree(self.tree))
+        self.assertIsNone(self.cache.get(key))
+
+
+class TestMemoryCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.header = os.path.join(self.dir,'main.h')
+        write_file(self.header,header)
+        self.cache = MemoryCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get(self):
+        scope = object()
+        self.cache.put('a',scope,[self.header],set(['x','y']))
+        self.assertIs(self.cache.get('a',set(['x']))[0],scope)
+        self.assertIsNone(self.cache.get('b'))
+
+        # a tree filtered for fewer names is no longer usable
+        self.assertIsNone(self.cache.get('a',set(['x','z'])))
+        self.assertIsNone(self.cache.get('a',set(['x'])))
+
+    def test_header_changed(self):
+        self.cache.put('a',object(),[self.header])
+        os.utime(self.header,(1000,1000))
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_max_entries(self):
+        for key in 'abc': self.cache.put(key,object(),[])
+        self.assertEqual([e[0] for e in self.cache.entries],['b','c'])
+
+
+class TestObjectCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.obj = os.path.join(self.dir,'a.o')
+        write_file(self.obj,'object code')
+        self.cache = ObjectCache(os.path.join(self.dir,'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_roundtrip(self):
+        key = self.cache.key('preprocessed',['g++','-c'])
+        dest = os.path.join(self.dir,'b.o')
+        self.assertFalse(self.cache.get(key,dest))
+
+        self.cache.put(key,self.obj)
+        self.assertTrue(self.cache.get(key,dest))
+        with open(dest) as f:
+            self.assertEqual(f.read(),'object code')
+
+    def test_evict(self):
+        self.cache.max_size = 0
+        key = self.cache.key('preprocessed',[])
+        self.cache.put(key,self.obj)
+        self.assertFalse(self.cache.get(key,os.path.join(self.dir,'b.o')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from pyexpose import gccxml
+from pyexpose import espec
+from pyexpose.conversion import hottest_first, read_call_profile
+from pyexpose.bench.synth import module
+
+
+class Node(object):
+    def __init__(self,key):
+        self.key = key
+
+    def call_nodes(self):
+        yield self
+
+    def profile_key(self):
+        return self.key
+
+class ClassDef(object):
+    multi_inherit = False
+
+    def __init__(self,*bases):
+        self.derived = []
+        for b in bases: b.derived.append(self)
+
+    def has_multi_inherit_subclass(self):
+        return False
+
+def branch(key,tests):
+    return key,Node(key),None,tests
+
+def keys(branches):
+    return [b[0] for b in branches]
+
+
+class TestCallProfile(unittest.TestCase):
+    def test_exact(self):
+        b = [branch('float','exact'),branch('int','exact'),branch('long','exact')]
+        self.assertEqual(keys(hottest_first(b,{'long' : 10,'int' : 5})),['long','int','float'])
+        self.assertEqual(keys(hottest_first(b,{})),['float','int','long'])
+
+    def test_number_check(self):
+        # number_check can be true for anything, so nothing passes it
+        b = [branch('float','exact'),branch('number',None),branch('str','exact')]
+        self.assertEqual(keys(hottest_first(b,{'str' : 10,'number' : 5})),['float','number','str'])
+
+    def test_classes(self):
+        base = ClassDef()
+        derived = ClassDef(base)
+        other = ClassDef()
+        b = [branch('derived',derived),branch('base',base),branch('other',other)]
+        self.assertEqual(keys(hottest_first(b,{'base' : 10,'other' : 5})),['other','derived','base'])
+
+        # a class derived from both could be an instance of either
+        ClassDef(base,other)
+        self.assertEqual(keys(hottest_first(b,{'base' : 10,'other' : 5})),['derived','base','other'])
+
+    def test_instrument(self):
+        d = tempfile.mkdtemp()
+        try:
+            espec.reset_unique_num()
+            tree = os.path.join(d,'parsetree')
+            with open(tree,'w') as f:
+                spec = module(f,classes=1,methods=1,overloads=2,args=1,functions=0)
+            spec.write_file(d,gccxml.getinterface(tree),instrument=True)
+            with open(os.path.join(d,spec.name + '.cpp')) as f:
+                code = f.read()
+            self.assertIn('PYEXPOSE_COUNT_CALL("synth::c0::m0(int,double)")',code)
+
+            with open(os.path.join(d,'calls'),'w') as f:
+                f.write('4 synth::c0::m0(int,double)\n1 synth::c0::m0(int)\n2 synth::c0::m0(int,double)\n')
+            self.assertEqual(
+                read_call_profile(os.path.join(d,'calls')),
+                {'synth::c0::m0(int,double)' : 6,'synth::c0::m0(int)' : 1})
+        finally:
+            shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    unittest.main()
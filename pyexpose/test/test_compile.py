@@ -5,6 +5,7 @@ import os.path
 import sys
 import shutil
 import tempfile
+import subprocess
 import unittest
 from distutils import ccompiler, sysconfig
 import gc
@@ -23,6 +24,7 @@ except Exception:
 
 from pyexpose import expose
 from pyexpose import espec
+from pyexpose import conversion
 
 
 def write_file(file,data):
@@ -73,6 +75,9 @@ class TestCompile(unittest.TestCase):
 
     templates = False
 
+    # extra keyword arguments for expose.generate_module
+    generate_options = {}
+
     @classmethod
     def modname(cls):
         return cls.__name__.lower()
@@ -102,7 +107,7 @@ class TestCompile(unittest.TestCase):
 
             spec = espec.getspec('spec.xml')
             spec.name = self.modname() # give the new module a unique name
-            expose.generate_module(spec,'.',None,'g++',gccxml_flags)
+            expose.generate_module(spec,'.',None,'g++',gccxml_flags,**self.generate_options)
 
             self.comp = ccompiler.new_compiler()
             sysconfig.customize_compiler(self.comp)
@@ -290,16 +295,153 @@ class TestOverloading(TestCompile):
     def runTest(self):
         tm = self.compile()
 
-        self.assertEqual(tm.overloaded(1.0,2.0,3.0,4.0),3)
-        self.assertAlmostEqual(tm.overloaded(1),2e50)
-        self.assertEqual(tm.overloaded(1,2.0,"3"),"yellow submarine")
-        self.assertAlmostEqual(tm.overloaded(1,2.0,3,4),6.0)
-        self.assertEqual(tm.overloaded(1,2,"3"),9)
+        class SubFloat(float): pass
+
+        # the second time through, the overloads are found in the cache
+        for i in range(2):
+            self.assertEqual(tm.overloaded(1.0,2.0,3.0,4.0),3)
+            self.assertAlmostEqual(tm.overloaded(1),2e50)
+            self.assertEqual(tm.overloaded(1,2.0,"3"),"yellow submarine")
+            self.assertAlmostEqual(tm.overloaded(1,2.0,3,4),6.0)
+            self.assertEqual(tm.overloaded(1,2,"3"),9)
+            self.assertEqual(tm.overloaded(SubFloat(1.0),2.0,3.0,4.0),3)
+
+        self.assertRaises(TypeError,tm.overloaded,1.0,2.0)
+        self.assertRaises(TypeError,tm.overloaded,1,2.0,3)
 
         self.assertEqual(tm.overload_1arg(1),None)
         self.assertAlmostEqual(tm.overload_1arg(1.0),2.0)
 
 
+class TestInstrument(TestCompile):
+    header_file = '''
+        int overloaded(int) { return 1; }
+        int overloaded(const char*) { return 2; }
+    '''
+
+    spec_file = '''<?xml version="1.0"?>
+        <module name="testmodule" include="main.h">
+            <def func="overloaded"/>
+        </module>
+    '''
+
+    generate_options = {'instrument' : True}
+
+    def runTest(self):
+        self.compile()
+
+        # the counts are written when the process exits
+        profile = os.path.join(self.dir,'calls')
+        subprocess.check_call([sys.executable,'-c',
+                'import {0} as m\nfor i in range(3): m.overloaded(i)\nm.overloaded("a")'.format(self.modname())],
+            env=dict(os.environ,PYEXPOSE_CALL_PROFILE=profile,PYTHONPATH=self.dir))
+        self.assertEqual(
+            conversion.read_call_profile(profile),
+            {'overloaded(int)' : 3,'overloaded(char const *)' : 1})
+
+
+class TestKeywords(TestCompile):
+    header_file = '''
+        int combine(int a,int b,int c=3) { return a*100 + b*10 + c; }
+
+        class Counter {
+        public:
+            int base;
+            Counter() : base(1000) {}
+            int add(int a,int b=1) { return base + a*10 + b; }
+        };
+    '''
+
+    spec_file = '''<?xml version="1.0"?>
+        <module name="testmodule" include="main.h">
+            <def func="combine"/>
+            <class name="Counter" type="Counter">
+                <def func="add"/>
+            </class>
+        </module>
+    '''
+
+    def runTest(self):
+        tm = self.compile()
+
+        self.assertEqual(tm.combine(1,2),123)
+        self.assertEqual(tm.combine(1,2,4),124)
+        self.assertEqual(tm.combine(a=1,b=2),123)
+        self.assertEqual(tm.combine(b=2,a=1),123)
+        self.assertEqual(tm.combine(1,b=2,c=5),125)
+        self.assertEqual(tm.combine(*(1,),**{'b' : 2}),123)
+
+        # a name that isn't interned is found by comparing the strings
+        self.assertEqual(tm.combine(**{''.join(['a']) : 1,''.join(['b']) : 2}),123)
+
+        with self.assertRaisesRegexp(TypeError,'multiple values for keyword argument "a"'):
+            tm.combine(1,2,a=5)
+        with self.assertRaisesRegexp(TypeError,'multiple values for keyword argument "b"'):
+            tm.combine(1,2,b=5)
+        with self.assertRaisesRegexp(TypeError,'keyword argument "b" is required'):
+            tm.combine(1)
+        with self.assertRaisesRegexp(TypeError,'keyword argument "a" is required'):
+            tm.combine(b=2)
+        with self.assertRaisesRegexp(TypeError,'keyword argument "a" is required'):
+            tm.combine(**{})
+
+        c = tm.Counter()
+        self.assertEqual(c.add(2),1021)
+        self.assertEqual(c.add(b=5,a=2),1025)
+        with self.assertRaisesRegexp(TypeError,'multiple values for keyword argument "a"'):
+            c.add(2,a=3)
+        with self.assertRaisesRegexp(TypeError,'keyword argument "a" is required'):
+            c.add(b=3)
+
+
+class TestNumbers(TestCompile):
+    header_file = '''
+        short to_short(short x) { return x; }
+        unsigned short to_ushort(unsigned short x) { return x; }
+        long to_long(long x) { return x; }
+        unsigned long to_ulong(unsigned long x) { return x; }
+        double to_double(double x) { return x; }
+    '''
+
+    spec_file = '''<?xml version="1.0"?>
+        <module name="testmodule" include="main.h">
+            <def func="to_short"/>
+            <def func="to_ushort"/>
+            <def func="to_long"/>
+            <def func="to_ulong"/>
+            <def func="to_double"/>
+        </module>
+    '''
+
+    def runTest(self):
+        tm = self.compile()
+
+        class SubInt(int): pass
+        class HasInt(object):
+            def __int__(self): return 7
+            def __float__(self): return 7.5
+
+        # int and long objects are read directly and anything else goes
+        # through the number protocol
+        for f in tm.to_short,tm.to_ushort,tm.to_long,tm.to_ulong:
+            self.assertEqual(f(5),5)
+            self.assertEqual(f(5L),5)
+            self.assertEqual(f(SubInt(5)),5)
+        self.assertEqual(tm.to_long(HasInt()),7)
+        self.assertEqual(tm.to_double(2.5),2.5)
+        self.assertEqual(tm.to_double(2),2.0)
+        self.assertEqual(tm.to_double(2L),2.0)
+        self.assertEqual(tm.to_double(HasInt()),7.5)
+
+        self.assertEqual(tm.to_short(-32768),-32768)
+        self.assertRaises(OverflowError,tm.to_short,32768)
+        self.assertRaises(TypeError,tm.to_ushort,-1)
+        self.assertRaises(OverflowError,tm.to_ushort,65536)
+        self.assertRaises(OverflowError,tm.to_ulong,-1)
+        self.assertRaises(OverflowError,tm.to_long,2**200)
+        self.assertRaises(OverflowError,tm.to_double,2**2000)
+
+
 class TestManagedRef(TestCompile):
     header_file = '''
         struct A {
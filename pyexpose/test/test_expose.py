@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+from distutils import sysconfig
+
+from pyexpose import espec
+from pyexpose import expose
+from pyexpose.bench import synth
+
+
+# Stands in for gccxml: copies the tree named after the first header the input
+# includes ("synth.h" -> "synth.xml", next to the input) and logs its command
+# line to "calls".
+FAKE_GCCXML = '''#!{0}
+import os, re, shutil, sys
+input = [a for a in sys.argv[1:] if not a.startswith('-')][-1]
+out = [a[6:] for a in sys.argv[1:] if a.startswith('-fxml=')][0]
+d = os.path.dirname(input)
+with open(os.path.join(d,'calls'),'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n')
+header = re.search(r'#include "(.+)\\.h"',open(input).read()).group(1)
+tree = os.path.join(d,header + '.xml')
+if not os.path.isfile(tree): sys.exit('no tree for ' + header)
+shutil.copyfile(tree,out)
+'''
+
+# what the real gccxml would need to find Python.h
+CXXFLAGS = '-I' + sysconfig.get_python_inc()
+
+def write_file(file,data):
+    with open(file,'w') as f:
+        f.write(data)
+
+
+class ExposeTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.gccxml = os.path.join(self.dir,'gccxml')
+        write_file(self.gccxml,FAKE_GCCXML.format(sys.executable))
+        os.chmod(self.gccxml,0755)
+        espec.reset_unique_num()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self,name):
+        return os.path.join(self.dir,name)
+
+    def calls(self):
+        try:
+            with open(self.path('calls')) as f:
+                return f.read().splitlines()
+        except IOError:
+            return []
+
+
+class TestDependencies(ExposeTest):
+    def setUp(self):
+        super(TestDependencies,self).setUp()
+        # cfg.h only defines a macro, so nothing in gccxml's output comes from it
+        write_file(self.path('cfg.h'),'#define ARG_T int\n')
+        with open(self.path('synth.h'),'w') as f:
+            f.write('#include "cfg.h"\n')
+            synth.header(f,classes=2,methods=1,functions=1)
+        with open(self.path('synth.xml'),'w') as f:
+            self.spec = synth.module(f,classes=2,methods=1,functions=1)
+
+    def generate(self):
+        deps = []
+        expose.generate_module(self.spec,self.dir,self.gccxml,None,CXXFLAGS,cache_dir=self.path('cache'),deps=deps)
+        return [os.path.realpath(d) for d in deps]
+
+    def test_header_dependencies(self):
+        write_file(self.path('in.cpp'),'#include "synth.h"\n')
+        deps = [os.path.realpath(d) for d in expose.header_dependencies(self.path('in.cpp'))]
+        self.assertIn(os.path.realpath(self.path('cfg.h')),deps)
+        self.assertIn(os.path.realpath(self.path('synth.h')),deps)
+
+    def test_cache(self):
+        self.assertIn(os.path.realpath(self.path('cfg.h')),self.generate())
+        self.assertEqual(len(self.calls()),1)
+
+        self.generate()
+        self.assertEqual(len(self.calls()),1)
+
+        write_file(self.path('cfg.h'),'#define ARG_T double\n')
+        self.generate()
+        self.assertEqual(len(self.calls()),2)
+
+
+
+class TestDepfile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.depfile = os.path.join(self.dir,'m.d')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_escape(self):
+        self.assertEqual(expose.depfile_escape('a b$c#d.h'),'a\\ b$$c\\#d.h')
+        self.assertEqual(expose.depfile_escape('plain/name.h'),'plain/name.h')
+
+    def test_write(self):
+        expose.write_depfile(self.depfile,['m.cpp','m.h'],['m.xml','a.h','a.h','b.h'])
+        with open(self.depfile) as f:
+            self.assertEqual(f.read(),'m.cpp m.h: \\\n  m.xml \\\n  a.h \\\n  b.h\n')
+
+    def test_roundtrip(self):
+        deps = ['with space.h','dollar$.h','hash#.h','dir/plain.h']
+        expose.write_depfile(self.depfile,['m.cpp'],deps)
+        with open(self.depfile) as f:
+            self.assertEqual(expose.parse_make_rule(f.read()),deps)
+
+
+class TestFilteredCache(ExposeTest):
+    def setUp(self):
+        super(TestFilteredCache,self).setUp()
+        with open(self.path('synth.h'),'w') as f:
+            synth.header(f,classes=1,methods=1,functions=2)
+        self.spec,extra = synth.spec('synthmod',classes=1,methods=1,functions=1)
+        with open(self.path('synth.xml'),'w') as f:
+            synth.gccxml_tree(f,classes=1,methods=1,functions=2,test_ns_extra=extra)
+
+    def generate(self):
+        expose.generate_module(self.spec,self.dir,self.gccxml,None,CXXFLAGS,cache_dir=self.path('cache'),fxml_start=False)
+
+    def test_new_name(self):
+        self.generate()
+        self.generate()
+        self.assertEqual(len(self.calls()),1)
+
+        # func1 is only referred to from inside a class, so the input for gccxml
+        # stays the same, but the cached tree doesn't have it
+        d = espec.DefDef('h')
+        d.overloads.append(espec.Overload('synth::func1',static=True))
+        self.spec.classes[0].methods[d.name] = d
+        self.generate()
+        self.assertEqual(len(self.calls()),2)
+
+
+
+class TestGenerateModules(ExposeTest):
+    def setUp(self):
+        super(TestGenerateModules,self).setUp()
+        for name in 'synth','other':
+            with open(self.path(name + '.h'),'w') as f:
+                synth.header(f,classes=2,methods=1,functions=1)
+
+        # two modules parsed together
+        with open(self.path('synth.xml'),'w') as f:
+            self.together = synth.modules(f,2,classes=2,methods=1,functions=1)
+
+        self.other,extra = synth.spec('othermod',classes=2,methods=1,functions=1)
+        self.other.includes = ['other.h']
+        with open(self.path('other.xml'),'w') as f:
+            synth.gccxml_tree(f,classes=2,methods=1,functions=1,test_ns_extra=extra)
+
+        # there is no tree for this one, so gccxml fails
+        self.missing,extra = synth.spec('missingmod',classes=1,methods=1,functions=1)
+        self.missing.includes = ['missing.h']
+
+    def check(self,jobs):
+        specs = [self.together[0],self.missing,self.other,self.together[1]]
+        results = expose.generate_modules(specs,self.dir,self.gccxml,None,CXXFLAGS,jobs=jobs)
+
+        self.assertEqual([r.name for r in results],[s.name for s in specs])
+        self.assertEqual([r.group for r in results],[0,1,2,0])
+        self.assertEqual([s.test_ns for s in specs],[espec.TEST_NS + '0',espec.TEST_NS,espec.TEST_NS,espec.TEST_NS + '1'])
+
+        self.assertIsNone(results[1].sources)
+        self.assertIn('CalledProcessError',results[1].error)
+        for r in results[0],results[2],results[3]:
+            self.assertIsNone(r.error)
+            self.assertEqual(r.sources,[r.name + '.cpp'])
+            self.assertTrue(os.path.isfile(self.path(r.sources[0])))
+            self.assertTrue(os.path.isfile(self.path(r.name + '.h')))
+        self.assertIn(os.path.realpath(self.path('synth.h')),[os.path.realpath(h) for h in results[0].headers])
+        self.assertIn(os.path.realpath(self.path('other.h')),[os.path.realpath(h) for h in results[2].headers])
+
+        # one run of gccxml per group
+        self.assertEqual(len(self.calls()),3)
+
+    def test_serial(self):
+        self.check(1)
+
+    def test_parallel(self):
+        self.check(2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import tempfile
+
+
+from pyexpose import gccxml
+from pyexpose import cpptypes
+from pyexpose import espec
+from pyexpose.xmlparse import parse
+from pyexpose.bench.synth import gccxml_tree
+
+
+parsetree = '''<?xml version="1.0"?>
+<GCC_XML cvs_revision="1.135">
+  <Namespace id="_1" name="::" members="_2 _3 _4 _5 " mangled="_Z2::" demangled="::"/>
+  <Namespace id="_2" name="___gccxml_types_test_ns___" context="_1" members="_6 " mangled="_Z26___gccxml_types_test_ns___" demangled="___gccxml_types_test_ns___"/>
+  <Class id="_3" name="Used" context="_1" mangled="4Used" demangled="Used" location="f1:1" file="f1" line="1" members="_7 " bases="_9 " size="32" align="32">
+    <Base type="_9" access="public" virtual="0" offset="0"/>
+  </Class>
+  <Class id="_4" name="Unused" context="_1" mangled="6Unused" demangled="Unused" location="f1:2" file="f1" line="2" members="_8 " bases="" size="8" align="8"/>
+  <Function id="_5" name="func" returns="_10" context="_1" location="f1:3" file="f1" line="3" extern="1">
+    <Argument name="a" type="_11" location="f1:3" file="f1" line="3"/>
+  </Function>
+  <Typedef id="_6" name="class_type_0" type="_3" context="_2" location="f1:4" file="f1" line="4"/>
+  <Field id="_7" name="value" type="_10" offset="0" context="_3" access="public" location="f1:1" file="f1" line="1"/>
+  <Field id="_8" name="value" type="_12" offset="0" context="_4" access="public" location="f1:2" file="f1" line="2"/>
+  <Class id="_9" name="Base" context="_1" mangled="4Base" demangled="Base" location="f1:0" file="f1" line="0" members="" bases="" size="8" align="8"/>
+  <FundamentalType id="_10" name="int" size="32" align="32"/>
+  <PointerType id="_11" type="_4" size="32" align="32"/>
+  <FundamentalType id="_12" name="char" size="8" align="8"/>
+  <File id="f1" name="main.h"/>
+</GCC_XML>
+'''
+
+class TestReachable(unittest.TestCase):
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile('w',delete=False)
+        try:
+            f.write(parsetree)
+            f.close()
+            self.items = gccxml.parse_tree(f.name)[0]
+        finally:
+            os.remove(f.name)
+
+    def test_scopes(self):
+        r = gccxml.reachable_items(self.items,set(),[espec.TEST_NS])
+        self.assertEqual(sorted(r),['_1','_10','_2','_3','_6','_7','_9'])
+
+        root = gccxml.link_tree(r)
+        c = root.find('Used')[0]
+        self.assertEqual(c.bases[0].type.name,'Base')
+        self.assertEqual([m.name for m in c.members],['value'])
+        with self.assertRaises(espec.SymbolNotFoundError) as cm:
+            root.find('Unused')
+        self.assertEqual(cm.exception.symbol,'Unused')
+
+    def test_names(self):
+        r = gccxml.reachable_items(self.items,set(['func']))
+        self.assertEqual(sorted(r),['_1','_10','_11','_12','_2','_4','_5','_8'])
+
+    def test_referenced_names(self):
+        m = espec.ModuleDef('mod')
+        d = espec.DefDef('f')
+        d.overloads.append(espec.Overload('ns::func'))
+        d.overloads.append(espec.Overload('Cls::operator ()'))
+        m.functions['f'] = d
+        m.vars['v'] = espec.VarDef('&other_var','v',None)
+        self.assertEqual(m.referenced_names(),set(['ns','func','Cls','operator ()','other_var']))
+        self.assertEqual(m.gccxml_start_names(),set([espec.TEST_NS,'ns::func']))
+
+class TestParseTree(unittest.TestCase):
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile('w',delete=False)
+        try:
+            with f:
+                gccxml_tree(f,classes=2,methods=1,functions=1,overloads=2)
+            self.items = gccxml.parse_tree(f.name)[0]
+        finally:
+            os.remove(f.name)
+
+    def test_same_as_generic(self):
+        f = tempfile.NamedTemporaryFile('w',delete=False)
+        try:
+            with f:
+                gccxml_tree(f,classes=5,methods=2,overloads=2,depth=2)
+            fast = gccxml.parse_tree(f.name)
+            generic = parse(f.name,'GCC_XML',gccxml.tag_root)
+        finally:
+            os.remove(f.name)
+
+        self.assertEqual(fast[1],generic[1])
+        self.assertEqual(sorted(fast[0]),sorted(generic[0]))
+
+        fast = gccxml.link_tree(fast[0])
+        generic = gccxml.link_tree(generic[0])
+        a = fast.find('synth::c3')[0]
+        b = generic.find('synth::c3')[0]
+        self.assertEqual(a,b)
+        self.assertEqual(a.bases[0].type,b.bases[0].type)
+        self.assertEqual(
+            sorted(str(m.args) for m in a.find('m1')),
+            sorted(str(m.args) for m in b.find('m1')))
+
+    def test_type_ids(self):
+        root = gccxml.link_tree(self.items)
+        c = root.find('synth::c1')[0]
+        ref = [m for m in c.members if isinstance(m,gccxml.CPPConstructor) and len(m.args) == 1][0].args[0].type
+
+        self.assertEqual(ref,gccxml.CPPReferenceType(cpptypes.cconst(c)))
+        self.assertEqual(hash(ref),hash(gccxml.CPPReferenceType(cpptypes.cconst(c))))
+        self.assertNotEqual(ref,gccxml.CPPReferenceType(c))
+
+    def test_arglist(self):
+        root = gccxml.link_tree(self.items)
+        f = root.find('synth::func0')
+        f = [x for x in f if len(x.args) == 3][0]
+        self.assertIsInstance(f.args[0:2],gccxml.ArgList)
+        self.assertEqual(str(f.args[0:2]),'int,double')
+        cons = root.find('synth::c0')[0].find('c0')
+        self.assertIs(min(cons,key=lambda x: len(x.args)).args,gccxml.no_args)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from pyexpose.outfile import OutputFile
+
+
+class TestOutputFile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir,'out.cpp')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self,data):
+        with OutputFile(self.path) as f:
+            print >> f, data
+        return f.changed
+
+    def test_unchanged(self):
+        self.assertTrue(self.write('a'))
+
+        # make any rewrite visible even with a coarse timestamp resolution
+        os.utime(self.path,(1000,1000))
+        self.assertFalse(self.write('a'))
+        self.assertEqual(os.path.getmtime(self.path),1000)
+
+        self.assertTrue(self.write('b'))
+        with open(self.path) as f:
+            self.assertEqual(f.read(),'b\n')
+        self.assertEqual(os.listdir(self.dir),['out.cpp'])
+
+    def test_error(self):
+        try:
+            with OutputFile(self.path) as f:
+                print >> f, 'a'
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from pyexpose import gccxml
+from pyexpose import espec
+from pyexpose import perflint
+from pyexpose.bench.synth import module, start_tree
+
+
+def write_file(file,data):
+    with open(file,'w') as f:
+        f.write(data)
+
+def spec(big='',big_attrs='',ref='copy',derived=True):
+    return '''<?xml version="1.0"?>
+<module name="lintmod" include="lint.h">
+  <class name="Big" type="lint::Big"{0}>{1}</class>
+  <class name="Holder" type="lint::Holder">
+    <def func="ref" return-semantic="{2}"/>
+    <def func="ptr" return-semantic="copy"/>
+    <def func="value" return-semantic="copy"/>
+  </class>
+  <class name="A" type="lint::A"/>
+  <class name="B" type="lint::B"/>
+  {3}
+</module>
+'''.format(big_attrs,big,ref,'<class name="C" type="lint::C"/>' if derived else '')
+
+def lint_tree(out,spec):
+    """Write a tree for the header:
+
+        namespace lint {
+            struct Big { char data[128]; };
+            class Holder { public: ~Holder(); Big &ref(); const Big *ptr(); Big value(); };
+            struct A { int a; };
+            struct B { int b; };
+            struct C : A, B {};
+        }
+
+    with the TEST_NS typedefs that spec needs.
+
+    """
+    w,(tns,),(ns,),named = start_tree([espec.TEST_NS],['lint'])
+
+    def add_class(name,size,bases=()):
+        id = w.new_id()
+        children = [('Base',[('type',b),('access','public'),('virtual','0'),('offset',i*4)]) for i,b in enumerate(bases)]
+        w.add('Class',[('name',name),('context',ns),('size',size),('members',''),('bases',' '.join(bases))],children,id)
+        w.add('Constructor',[('name',name),('context',id),('access','public'),('artificial','1')])
+        w.add('Constructor',[('name',name),('context',id),('access','public'),('artificial','1')],
+            [('Argument',[('type',w.reference(w.const(id)))])])
+        named[name] = id
+        return id
+
+    big = add_class('Big',1024)
+    holder = add_class('Holder',8)
+    w.add('Destructor',[('name','Holder'),('context',holder),('access','public')])
+    for name,returns in [('ref',w.reference(big)),('ptr',w.pointer(w.const(big))),('value',big)]:
+        w.add('Method',[('name',name),('returns',returns),('context',holder),('access','public')])
+    add_class('C',64,[add_class('A',32),add_class('B',32)])
+
+    for c in spec.classes:
+        w.add('Typedef',[('name','class_type_{0}'.format(c.uniquenum)),('type',named[c.type.split('::')[1]]),('context',tns)])
+    w.write(out)
+
+
+class TestPerfLint(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        espec.reset_unique_num()
+        self.tree = os.path.join(self.dir,'parsetree')
+        with open(self.tree,'w') as f:
+            self.spec = module(f,classes=2,methods=1,overloads=1,args=1,depth=2,functions=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def lint(self):
+        return perflint.lint(self.spec.analyze(gccxml.getinterface(self.tree)))
+
+    def defs(self):
+        for c in self.spec.classes:
+            for d in c.methods.itervalues(): yield d
+        for d in self.spec.functions.itervalues(): yield d
+
+    def test_named_args(self):
+        where = set(f.where for f in self.lint() if 'METH_O' in f.problem)
+        self.assertEqual(where,set(['c0.m0','c1.m0','func0']))
+
+        for d in self.defs():
+            for ov in d.overloads: ov.keywords = False
+        self.assertFalse(any('METH_O' in f.problem for f in self.lint()))
+
+        self.spec.write_file(self.dir,gccxml.getinterface(self.tree))
+        with open(os.path.join(self.dir,self.spec.name + '.cpp')) as f:
+            code = f.read()
+        self.assertNotIn('METH_KEYWORDS',code)
+        self.assertIn('METH_O',code)
+
+    def test_gc(self):
+        # c1 derives from c0, so only c0 can drop its instance dictionary
+        where = [f.where for f in self.lint() if 'garbage collector' in f.problem]
+        self.assertEqual(where,['c0'])
+
+        self.spec.classes[0].instance_dict = False
+        self.spec.classes[1].instance_dict = False
+        self.assertFalse(any('garbage collector' in f.problem for f in self.lint()))
+
+
+
+class TestPerfLintFindings(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def lint(self,spec_text,problem):
+        """Return the "where" attributes of the findings whose problem contains
+        the text problem."""
+        espec.reset_unique_num()
+        path = os.path.join(self.dir,'lint.xml')
+        write_file(path,spec_text)
+        s = espec.getspec(path)
+        tree = os.path.join(self.dir,'parsetree')
+        with open(tree,'w') as f:
+            lint_tree(f,s)
+        return [f.where for f in perflint.lint(s.analyze(gccxml.getinterface(tree))) if problem in f.problem]
+
+    def test_copy(self):
+        # "value" returns Big by value, so it's copied whatever the
+        # return-semantic is
+        self.assertEqual(sorted(self.lint(spec(),'copies lint::Big')),['Holder.ptr','Holder.ref'])
+        self.assertEqual(self.lint(spec(ref='managedref'),'copies lint::Big'),['Holder.ptr'])
+
+    def test_mode_var(self):
+        # Holder needs the variable for its destructor, which the spec can't
+        # avoid
+        self.assertEqual(sorted(self.lint(spec(),'mode variable because it is constructed in __init__')),['A','B','Big','C'])
+        self.assertEqual(self.lint(spec(ref='managedref'),'mode variable because some methods return lint::Big'),['Big'])
+
+        self.assertEqual(sorted(self.lint(spec(big='<new/>'),'mode variable')),['A','B','C'])
+        self.assertEqual(self.lint(spec(big='<new/>',big_attrs=' require-mode-var="true"'),'require-mode-var'),['Big'])
+
+    def test_multi_inherit(self):
+        self.assertEqual(self.lint(spec(),'more than one class'),['A','B'])
+        self.assertEqual(self.lint(spec(derived=False),'more than one class'),[])
+
+
+if __name__ == '__main__':
+    unittest.main()
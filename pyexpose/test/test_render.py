@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from pyexpose import gccxml
+from pyexpose import espec
+from pyexpose.bench.synth import module
+
+
+def read_dir(path):
+    r = {}
+    for name in os.listdir(path):
+        with open(os.path.join(path,name)) as f:
+            r[name] = f.read()
+    return r
+
+
+class TestRenderer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.min_classes = espec.PARALLEL_MIN_CLASSES
+        espec.PARALLEL_MIN_CLASSES = 1
+
+    def tearDown(self):
+        espec.PARALLEL_MIN_CLASSES = self.min_classes
+        shutil.rmtree(self.dir)
+
+    def generate(self,split,jobs,out=None):
+        # the spec and the tree are created again each time because write_file
+        # modifies the classes
+        espec.reset_unique_num()
+        tree = os.path.join(self.dir,'parsetree')
+        with open(tree,'w') as f:
+            spec = module(f,classes=12,methods=2,overloads=2,args=1,depth=3,functions=3)
+        if out is None:
+            out = os.path.join(self.dir,'{0}-{1}'.format(split,jobs))
+            os.mkdir(out)
+        spec.write_file(out,gccxml.getinterface(tree),split,jobs)
+        return read_dir(out)
+
+    def test_same_output(self):
+        for split in (None,4):
+            self.assertEqual(self.generate(split,1),self.generate(split,3))
+
+    def test_stale_parts(self):
+        out = os.path.join(self.dir,'out')
+        os.mkdir(out)
+        names = lambda split: sorted(self.generate(split,1,out))
+
+        self.assertEqual(names(4),['synthmod.cpp','synthmod.h','synthmod.sources','synthmod_1.cpp','synthmod_2.cpp','synthmod_3.cpp'])
+        self.assertEqual(names(6),['synthmod.cpp','synthmod.h','synthmod.sources','synthmod_1.cpp','synthmod_2.cpp'])
+        self.assertEqual(names(None),['synthmod.cpp','synthmod.h'])
+
+    def test_error(self):
+        out = os.path.join(self.dir,'out')
+        os.mkdir(out)
+        before = self.generate(4,1,out)
+
+        def fail(self):
+            raise ValueError()
+            yield
+
+        # the classes are rendered into the parts before the functions fail,
+        # but none of the files may change
+        output_functions = espec.Renderer.output_functions
+        espec.Renderer.output_functions = fail
+        try:
+            self.assertRaises(ValueError,self.generate,2,1,out)
+        finally:
+            espec.Renderer.output_functions = output_functions
+        self.assertEqual(read_dir(out),before)
+
+
+if __name__ == '__main__':
+    unittest.main()
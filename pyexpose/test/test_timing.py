@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import unittest
+import json
+from cStringIO import StringIO
+
+from pyexpose import timing
+
+
+class TestProfile(unittest.TestCase):
+    def test_inactive(self):
+        # with no active profile, nothing is recorded and nothing fails
+        with timing.phase('a'):
+            with timing.item('class','A'):
+                pass
+
+    def test_nesting(self):
+        p = timing.Profile()
+        with timing.activate(p):
+            for i in range(2):
+                with timing.phase('outer'):
+                    with timing.phase('inner'):
+                        with timing.item('class','A'):
+                            pass
+            with timing.phase('inner'):
+                pass
+
+        self.assertEqual(p.phase_order,[('outer',),('outer','inner'),('inner',)])
+        self.assertEqual(p.phases[('outer',)].calls,2)
+        self.assertEqual(p.phases[('outer','inner')].calls,2)
+        self.assertEqual(p.items[('class','A')].calls,2)
+        self.assertTrue(p.phases[('outer',)].wall >= p.phases[('outer','inner')].wall)
+
+        # the profile is only active inside the with block
+        with timing.phase('after'):
+            pass
+        self.assertFalse(('after',) in p.phases)
+
+    def test_memory(self):
+        p = timing.Profile()
+        with timing.activate(p):
+            with timing.phase('big'):
+                x = ' ' * (64 * 1048576)
+                del x
+            with timing.phase('small'):
+                kept = ' ' * (16 * 1048576)
+
+        # the peak only grows during the phase that needed the memory first
+        self.assertGreater(p.phases[('big',)].peak_growth,32 * 1048576)
+        self.assertEqual(p.phases[('small',)].peak_growth,0)
+        if timing.current_rss() is not None:
+            self.assertLess(p.phases[('big',)].rss_change,32 * 1048576)
+            self.assertGreater(p.phases[('small',)].rss_change,8 * 1048576)
+        del kept
+
+    def test_output(self):
+        p = timing.Profile(True)
+        with timing.activate(p):
+            with timing.phase('fast'):
+                pass
+            with timing.phase('slow'):
+                sum(range(100000))
+
+        self.assertEqual(p.slowest_phase(),'slow')
+
+        out = StringIO()
+        p.report(out)
+        self.assertTrue('slow' in out.getvalue())
+
+        out = StringIO()
+        p.dump_json(out)
+        data = json.loads(out.getvalue())
+        self.assertEqual([x['name'] for x in data['phases']],['fast','slow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import os.path
+import unittest
+from cStringIO import StringIO
+
+from pyexpose import expose
+from pyexpose import watch
+from pyexpose.cache import MemoryCache
+from pyexpose.bench import synth
+from pyexpose.test.test_expose import ExposeTest, CXXFLAGS, write_file
+
+
+class StopWatching(Exception):
+    pass
+
+
+class TestWatch(ExposeTest):
+    def setUp(self):
+        super(TestWatch,self).setUp()
+        write_file(self.path('cfg.h'),'#define ARG_T int\n')
+        with open(self.path('synth.h'),'w') as f:
+            f.write('#include "cfg.h"\n')
+            synth.header(f,classes=2,methods=1,functions=1)
+        with open(self.path('synth.xml'),'w') as f:
+            synth.module(f,classes=2,methods=1,functions=1)
+        self.spec_path = self.path('synthmod.xml')
+        with open(self.spec_path,'w') as f:
+            synth.spec_file(f,'synthmod',classes=2,methods=1,functions=1)
+
+        self.memo = MemoryCache()
+        self.watched = []
+        self.wait_for_change = watch.wait_for_change
+        watch.wait_for_change = self.wait
+
+    def tearDown(self):
+        watch.wait_for_change = self.wait_for_change
+        super(TestWatch,self).tearDown()
+
+    def wait(self,paths,interval):
+        self.watched = [os.path.realpath(p) for p in paths]
+        raise StopWatching()
+
+    def generate(self,spec,deps):
+        expose.generate_module(spec,self.dir,self.gccxml,None,CXXFLAGS,cache_dir=self.path('cache'),deps=deps,memo=self.memo)
+
+    def test_macro_header(self):
+        out = StringIO()
+        self.assertRaises(StopWatching,watch.watch,self.spec_path,self.generate,out=out)
+        self.assertIn('generated synthmod',out.getvalue())
+        self.assertIn(os.path.realpath(self.path('cfg.h')),self.watched)
+        self.assertEqual(len(self.calls()),1)
+
+        # neither the parsed interface kept in memory nor the one in the cache
+        # directory may be used after the header changes
+        write_file(self.path('cfg.h'),'#define ARG_T double\n')
+        self.assertRaises(StopWatching,watch.watch,self.spec_path,self.generate,out=out)
+        self.assertEqual(len(self.calls()),2)
+
+        self.assertRaises(StopWatching,watch.watch,self.spec_path,self.generate,out=out)
+        self.assertEqual(len(self.calls()),2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+"""Measure where the generator spends its time.
+
+A Profile records the wall time, CPU time and memory use of each phase of the
+generator (running gccxml, parsing its output, building the typed model,
+rendering templates, ...) and of each class and function that is generated.
+
+The memory use is recorded two ways: by how much the process's peak resident
+set size grew during the phase, which shows the phases that needed more memory
+than any before them, and by how much the current resident set size changed
+between the start and the end of the phase, which shows what the phase left
+allocated. The latter is only available on Linux.
+
+The rest of the package reports to the active Profile through the functions
+phase and item, which do nothing unless a Profile has been activated with
+activate.
+
+"""
+
+import sys
+import time
+import resource
+import json
+import cProfile
+from contextlib import contextmanager
+
+
+def cpu_time():
+    """Return the CPU time used by this process and its finished children
+    (e.g. gccxml)."""
+    s = resource.getrusage(resource.RUSAGE_SELF)
+    c = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return s.ru_utime + s.ru_stime + c.ru_utime + c.ru_stime
+
+def peak_rss():
+    """Return the largest resident set size this process has had, in bytes."""
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, OS X reports bytes
+    return r if sys.platform == 'darwin' else r * 1024
+
+def current_rss():
+    """Return the current resident set size of this process in bytes, or None
+    if it can't be read (anywhere but Linux)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError,IndexError,ValueError):
+        return None
+
+
+class Record(object):
+    """The measurements of a phase, class or function.
+
+    peak_growth -- the most the peak resident set size grew during any one
+        call, in bytes
+    rss_change -- the total change of the current resident set size from the
+        start to the end of every call, in bytes, or None if it isn't known
+
+    """
+    __slots__ = 'calls','wall','cpu','peak_growth','rss_change'
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_growth = 0
+        self.rss_change = 0
+
+    def add(self,wall,cpu,peak_growth,rss_change):
+        self.calls += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.peak_growth = max(self.peak_growth,peak_growth)
+        if self.rss_change is not None:
+            self.rss_change = None if rss_change is None else self.rss_change + rss_change
+
+    def to_dict(self):
+        return {
+            'calls' : self.calls,
+            'wall_seconds' : self.wall,
+            'cpu_seconds' : self.cpu,
+            'peak_rss_growth' : self.peak_growth,
+            'rss_change' : self.rss_change}
+
+
+class Profile(object):
+    """Timing information for one run of the generator.
+
+    cprofile -- if True, also run cProfile during each top-level phase, so
+        that the statistics of the slowest one can be saved with dump_cprofile
+
+    Phases can nest. Nested phases are recorded separately for each enclosing
+    phase and their times are included in the times of the enclosing phase.
+    Entering the same phase more than once accumulates its times.
+
+    """
+    def __init__(self,cprofile=False):
+        self.phases = {} # maps a tuple of phase names to a Record
+        self.phase_order = []
+        self.items = {} # maps (kind,name) tuples to a Record
+        self.item_order = []
+        self.cprofile = cprofile
+        self.cprofiles = {}
+        self._stack = []
+
+    @contextmanager
+    def _measure(self,records,order,key):
+        r = records.get(key)
+        if r is None:
+            r = records[key] = Record()
+            order.append(key)
+
+        wall = time.time()
+        cpu = cpu_time()
+        peak = peak_rss()
+        rss = current_rss()
+        try:
+            yield
+        finally:
+            rss_end = current_rss()
+            r.add(
+                time.time() - wall,
+                cpu_time() - cpu,
+                peak_rss() - peak,
+                None if rss is None or rss_end is None else rss_end - rss)
+
+    @contextmanager
+    def phase(self,name):
+        key = tuple(self._stack) + (name,)
+        prof = None
+        if self.cprofile and not self._stack:
+            prof = self.cprofiles.get(name)
+            if prof is None:
+                prof = self.cprofiles[name] = cProfile.Profile()
+
+        self._stack.append(name)
+        try:
+            with self._measure(self.phases,self.phase_order,key):
+                if prof:
+                    prof.enable()
+                    try:
+                        yield
+                    finally:
+                        prof.disable()
+                else:
+                    yield
+        finally:
+            self._stack.pop()
+
+    def item(self,kind,name):
+        return self._measure(self.items,self.item_order,(kind,name))
+
+    def slowest_phase(self):
+        """Return the name of the top-level phase with the largest wall time,
+        or None if no phase was recorded."""
+        top = [k for k in self.phase_order if len(k) == 1]
+        if not top: return None
+        return max(top,key=lambda k: self.phases[k].wall)[0]
+
+    def dump_cprofile(self,path):
+        """Save the cProfile statistics of the slowest top-level phase to path
+        (in the format read by the pstats module) and return the name of the
+        phase.
+
+        The Profile must have been created with cprofile=True.
+
+        """
+        name = self.slowest_phase()
+        if name is None: return None
+        self.cprofiles[name].dump_stats(path)
+        return name
+
+    def to_dict(self):
+        return {
+            'peak_rss' : peak_rss(),
+            'phases' : [dict(self.phases[k].to_dict(),name=k[-1],path=list(k)) for k in self.phase_order],
+            'items' : [dict(self.items[k].to_dict(),kind=k[0],name=k[1]) for k in self.item_order]}
+
+    def dump_json(self,f):
+        json.dump(self.to_dict(),f,indent=2)
+
+    def report(self,out,items=20):
+        """Write a table of the phases, and of the "items" slowest classes and
+        functions, to the file-like object out."""
+        row = '{0:<40}{1:>8}{2:>11.3f}{3:>11.3f}{4:>19.1f}{5:>18}\n'
+        head = '{0:<40}{1:>8}{2:>11}{3:>11}{4:>19}{5:>18}\n'
+        mib = lambda x: '-' if x is None else '{0:.1f}'.format(x / 1048576.0)
+
+        out.write(head.format('phase','calls','wall (s)','cpu (s)','peak growth (MiB)','rss change (MiB)'))
+
+        # list nested phases under the phase that encloses them
+        for k in sorted(self.phase_order,key=lambda k: [self.phase_order.index(k[:i+1]) for i in range(len(k))]):
+            r = self.phases[k]
+            out.write(row.format('  ' * (len(k)-1) + k[-1],r.calls,r.wall,r.cpu,r.peak_growth / 1048576.0,mib(r.rss_change)))
+
+        if self.items and items:
+            out.write('\n')
+            out.write(head.format('slowest classes and functions','calls','wall (s)','cpu (s)','peak growth (MiB)','rss change (MiB)'))
+            for k in sorted(self.item_order,key=lambda k: self.items[k].wall,reverse=True)[0:items]:
+                r = self.items[k]
+                out.write(row.format('{0} {1}'.format(*k),r.calls,r.wall,r.cpu,r.peak_growth / 1048576.0,mib(r.rss_change)))
+
+        out.write('\npeak resident set size of the process: {0} MiB\n'.format(mib(peak_rss())))
+
+
+class _NullContext(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self,type,value,traceback):
+        return False
+
+_null = _NullContext()
+
+_active = None
+
+@contextmanager
+def activate(profile):
+    """Make profile the destination of phase and item until the with block
+    ends. If profile is None, the active Profile (if any) stays active."""
+    global _active
+    prev = _active
+    if profile is not None: _active = profile
+    try:
+        yield profile
+    finally:
+        _active = prev
+
+def phase(name):
+    """Return a context manager that records its body as the phase "name" of
+    the active Profile."""
+    return _active.phase(name) if _active else _null
+
+def item(kind,name):
+    """Return a context manager that records its body as the class or function
+    (depending on kind) "name" of the active Profile."""
+    return _active.item(kind,name) if _active else _null
@@ -0,0 +1,58 @@
+"""Regenerate a module whenever its spec or a header it depends on changes.
+
+The parsed interface is kept in memory between runs (see cache.MemoryCache).
+As long as an edit of the spec doesn't change the input for GCCXML (which
+only declares the types and functions that the spec refers to), only the spec
+is read again and the module regenerated; GCCXML is only run again after a
+header changes or the spec refers to something new.
+
+"""
+
+import sys
+import time
+import subprocess
+
+from .err import Error
+from .cache import file_stamp
+from . import espec
+
+
+def stamps(paths):
+    return [file_stamp(p) for p in paths]
+
+def wait_for_change(paths,interval):
+    """Return once the modification time or size of any file in paths
+    changes."""
+    old = stamps(paths)
+    while stamps(paths) == old:
+        time.sleep(interval)
+
+def watch(spec_path,generate,interval=0.5,out=sys.stderr):
+    """Read the spec at spec_path and call generate(spec,deps), then do it
+    again every time spec_path or a file it depends on changes. This only
+    returns if interrupted.
+
+    generate must append the names of the files the module depends on to the
+    list deps, including headers that only define macros (like the deps
+    parameter of expose.generate_module, see expose.header_dependencies).
+    Errors are written to out and the files are watched for the next change.
+
+    """
+    deps = []
+    while True:
+        start = time.time()
+        newdeps = []
+        try:
+            # so that the same spec produces the same input for GCCXML
+            espec.reset_unique_num()
+            spec = espec.getspec(spec_path)
+            generate(spec,newdeps)
+        except (Error,subprocess.CalledProcessError,EnvironmentError) as e:
+            print >> out, '{0}: {1}'.format(spec_path,e)
+        else:
+            print >> out, 'generated {0} in {1:.3f} s'.format(spec.name,time.time() - start)
+
+        # if generating failed before gccxml ran, keep watching the headers
+        # from the last time it did
+        if newdeps: deps = newdeps
+        wait_for_change([spec_path] + deps,interval)
@@ -12,7 +12,7 @@ setup(
     url='https://github.com/Rouslan/PyExpose',
     author='Rouslan Korneychuk',
     author_email='rouslank@msn.com',
-    packages=['pyexpose','pyexpose.test'],
+    packages=['pyexpose','pyexpose.test','pyexpose.bench'],
     headers=['include/pyexpose_common.h','include/pyobject.h'],
     scripts=['scripts/pyexpose'],
     requires=['Jinja2'])